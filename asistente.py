@@ -0,0 +1,756 @@
+"""Lógica de los turnos de ELISA, compartida por las interfaces.
+
+`Asistente` construye el pipeline (ver pipeline.py) con una etapa por fase del
+turno y ofrece a la interfaz operaciones de alto nivel (enviar texto, grabar,
+manos libres, decir). La interfaz solo se suscribe a los eventos del pipeline.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+import subprocess
+import webbrowser
+
+import numpy as np
+
+from pipeline import Pipeline, Etapa, Turno, Fragmento, Fase, Estado
+from servidor_modelos import ClienteModelos
+from captura import ServicioCaptura
+from silencio import recortar_silencio, filtrar_segmentos, MedidorDecodificacion
+from memoria import MemoriaLargoPlazo
+from gobernador import GobernadorRespuesta
+from calidad import ControladorCalidad
+from especulacion import Especulador
+import especulacion
+from reparto_cpu import REPARTO
+from gestor_memoria import GestorMemoria, descargar_ollama
+from cliente_ollama import (obtener_cliente, cerrar_cliente, CacheRespuestas,
+                            PlazoAgotado, CircuitoAbierto)
+import codificador_corto
+import latencia_audio
+from palabra_clave import DetectorPalabraClave
+from utilidades_audio import suavizar, remuestrear, a_mono, MUESTREO_WHISPER
+from registro import nuevo_turno
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+temp_audio_dir = os.path.join(script_dir, "temp_audio")
+
+# Configuración de Whisper - Modelo inicial; calidad.py cambia de nivel según la latencia
+MODELO_WHISPER = "small"
+OPCIONES_WHISPER = dict(
+    language="spanish",
+    task="transcribe",
+    fp16=False,
+    temperature=0.2,
+    best_of=3,
+    beam_size=5
+)
+# El borrador especulativo solo tiene que ser rápido
+OPCIONES_BORRADOR = dict(
+    language="spanish",
+    task="transcribe",
+    fp16=False,
+    temperature=0.0
+)
+
+# Configuración de Ollama - Modelo inicial (ver calidad.py)
+MODELO_LLM = "mistral"
+
+DURACION_GRABACION = 15
+SEGUNDOS_SILENCIO_ORDEN = 0.8
+MAX_SEGUNDOS_ORDEN = 10
+DISCULPA = "Lo siento, no pude procesar tu solicitud."
+SIN_LLM = "Ahora mismo no puedo pensar una respuesta; inténtalo de nuevo en un momento."
+
+_whisper_models = {}
+_whisper_lock = threading.Lock()
+
+
+def obtener_whisper_model(nombre=MODELO_WHISPER):
+    """Devuelve el modelo Whisper local `nombre`, cargándolo si aún no existe."""
+    # Sin bloqueo si ya está cargado: un turno no espera a que se cargue otro nivel
+    modelo = _whisper_models.get(nombre)
+    if modelo is not None:
+        return modelo
+    with _whisper_lock:
+        if nombre not in _whisper_models:
+            REPARTO.configurar_torch()
+            import whisper
+            logger.info(f"Cargando modelo Whisper local '{nombre}'")
+            _whisper_models[nombre] = whisper.load_model(nombre)
+        return _whisper_models[nombre]
+
+
+def liberar_whisper_models():
+    """Olvida los modelos Whisper locales para que se pueda liberar su memoria."""
+    with _whisper_lock:
+        _whisper_models.clear()
+
+
+def mejorar_calidad_audio(audio, salida):
+    """Normaliza y suaviza el audio escribiendo en `salida`."""
+    try:
+        pico = max(audio.max(), -audio.min())
+        if pico > 0:
+            audio /= pico
+        return suavizar(audio, salida)
+    except Exception as e:
+        logger.error(f"Error al mejorar audio: {e}")
+        return audio
+
+
+def transcribir_local(audio, samplerate, modelo=MODELO_WHISPER, opciones=OPCIONES_WHISPER):
+    """Transcribe con el Whisper local y devuelve el resultado sin filtrar."""
+    audio = remuestrear(audio, samplerate, MUESTREO_WHISPER)
+    whisper_model = obtener_whisper_model(modelo)
+    if codificador_corto.ACTIVO:
+        return codificador_corto.transcribir(whisper_model, audio, **opciones)
+    return whisper_model.transcribe(audio, **opciones)
+
+
+def redactar_prompt(texto, nombre_asistente, nombre_usuario, max_palabras, recuerdos=()):
+    """Prompt del LLM para un mensaje del usuario."""
+    contexto = ""
+    if recuerdos:
+        contexto = "Recuerdos de conversaciones anteriores:\n" + \
+            "".join(f"- {recuerdo}\n" for recuerdo in recuerdos)
+
+    return (
+        f"Eres {nombre_asistente}, un asistente virtual en español. "
+        f"{contexto}"
+        f"{f'El usuario {nombre_usuario} te dice:' if nombre_usuario else 'Usuario:'} {texto}\n"
+        f"Responde de manera clara y concisa en español (máximo {max_palabras} palabras):"
+    )
+
+
+def limpiar_texto_transcrito(texto):
+    texto = ' '.join(texto.strip().split())
+    return texto.capitalize()
+
+
+def quitar_palabra_clave(texto):
+    palabras = texto.split(maxsplit=1)
+    if palabras and palabras[0].strip(",.;:¡!¿?").lower() == "elisa":
+        texto = palabras[1] if len(palabras) > 1 else ""
+    return texto.strip(" ,.").capitalize()
+
+
+def ejecutar_comando(texto):
+    """Ejecuta comandos específicos."""
+    texto = texto.lower()
+
+    comandos = {
+        "abrir chrome": lambda: subprocess.Popen("chrome.exe"),
+        "abrir notepad": lambda: subprocess.Popen("notepad.exe"),
+        "abrir calculadora": lambda: subprocess.Popen("calc.exe"),
+        "ir a ": lambda url: webbrowser.open(f"https://{url}" if not url.startswith(("http", "www")) else url),
+        "reproducir ": lambda cancion: webbrowser.open(f"https://www.youtube.com/results?search_query={cancion}")
+    }
+
+    for cmd, accion in comandos.items():
+        if texto.startswith(cmd):
+            try:
+                parametro = texto[len(cmd):].strip()
+                if parametro:
+                    accion(parametro)
+                else:
+                    accion()
+                return True
+            except Exception as e:
+                logger.error(f"Error al ejecutar comando {cmd}: {e}")
+    return False
+
+
+# --- Etapas ---
+
+class EtapaCaptura(Etapa):
+    fase = Fase.CAPTURA
+
+    def __init__(self, asistente, duracion=DURACION_GRABACION):
+        super().__init__()
+        self.asistente = asistente
+        self.captura = asistente.captura
+        self.duracion = duracion
+
+    def procesar(self, turno):
+        samplerate = self.captura.samplerate
+        self.captura.iniciar()
+        if turno.origen == "palabra_clave":
+            inicio = turno.posicion
+            fin = self.grabar_orden(turno, inicio)
+        else:
+            inicio = self.captura.inicio_grabacion()
+            fin = self.captura.posicion() + self.duracion * samplerate
+            for i in range(self.duracion, 0, -1):
+                self.publicar("progreso", turno, mensaje=f"Grabando... {i}s")
+                for _ in range(10):
+                    time.sleep(0.1)
+                    if turno.cancelado:
+                        return None
+        if turno.cancelado:
+            return None
+
+        turno.audio = self.captura.extraer(inicio, fin, turno.cancelacion)
+        turno.samplerate = samplerate
+        turno.segundos_grabados = len(turno.audio) / samplerate
+        return turno.avanzar(Fase.DSP)
+
+    def grabar_orden(self, turno, inicio):
+        """Graba desde la palabra clave hasta una pausa, el tiempo máximo o la cancelación."""
+        detector = self.asistente.detector
+        samplerate = self.captura.samplerate
+        bloques_silencio = int(SEGUNDOS_SILENCIO_ORDEN * samplerate / detector.muestras_bloque)
+        fin_maximo = inicio + int(MAX_SEGUNDOS_ORDEN * samplerate)
+        silencio = 0
+        fin = self.captura.posicion()
+        for fin, bloque in self.captura.bloques(detector.muestras_bloque,
+                                                lambda: not turno.cancelado, desde=fin):
+            silencio = 0 if detector.es_voz(bloque) else silencio + 1
+            if silencio >= bloques_silencio or fin >= fin_maximo:
+                break
+        return fin
+
+
+class EtapaDSP(Etapa):
+    fase = Fase.DSP
+
+    def __init__(self, captura, medidor):
+        super().__init__()
+        self.captura = captura
+        self.medidor = medidor
+
+    def procesar(self, turno):
+        audio = recortar_silencio(turno.audio, turno.samplerate)
+        if audio is None:
+            logger.info("No se detectó voz en la grabación; se omite la transcripción")
+            self.medidor.registrar(turno.segundos_grabados, 0, 0)
+            turno.audio = None
+            return None
+        turno.audio = mejorar_calidad_audio(audio, self.captura.auxiliar_para(audio))
+        return turno.avanzar(Fase.ASR)
+
+
+class EtapaASR(Etapa):
+    fase = Fase.ASR
+
+    def __init__(self, cliente_modelos, medidor, calidad, gestor, especulador=None):
+        super().__init__()
+        self.cliente_modelos = cliente_modelos
+        self.medidor = medidor
+        self.calidad = calidad
+        self.gestor = gestor
+        self.especulador = especulador
+
+    def preparar_hilo(self):
+        REPARTO.aplicar_hilo("asr")
+
+    def procesar(self, turno):
+        with self.gestor.usar("whisper"):
+            borrador = self.lanzar_borrador(turno)
+            inicio = time.perf_counter()
+            texto = self.transcribir_audio(turno.audio, turno.samplerate,
+                                           self.calidad.modelo_whisper)
+        duracion = time.perf_counter() - inicio
+        self.medidor.registrar(turno.segundos_grabados, len(turno.audio) / turno.samplerate, duracion)
+        if not turno.cancelado:
+            self.calidad.registrar("asr", duracion)
+        turno.audio = None
+        if turno.origen == "palabra_clave":
+            texto = quitar_palabra_clave(texto)
+        if borrador is not None:
+            turno.especulacion = self.especulador.resolver(borrador, texto)
+        if not texto or turno.cancelado:
+            return None
+        turno.texto = texto
+        self.publicar("mensaje_usuario", turno, texto=texto)
+        return turno.avanzar(Fase.INTENCION)
+
+    def lanzar_borrador(self, turno):
+        """Transcripción rápida en paralelo para adelantar el LLM (ver especulacion.py)."""
+        especulador = self.especulador
+        if especulador is None or especulador.modelo == self.calidad.modelo_whisper:
+            return None
+        # El búfer del turno se reutiliza en otros turnos: el borrador trabaja con una copia
+        audio = turno.audio.copy()
+
+        def transcribir():
+            texto = self.transcribir_audio(audio, turno.samplerate, especulador.modelo,
+                                           OPCIONES_BORRADOR)
+            return quitar_palabra_clave(texto) if turno.origen == "palabra_clave" else texto
+
+        return especulador.lanzar(turno, transcribir)
+
+    def transcribir_audio(self, audio, samplerate, modelo=MODELO_WHISPER, opciones=OPCIONES_WHISPER):
+        resultado = None
+        if self.cliente_modelos.disponible():
+            try:
+                resultado = self.cliente_modelos.transcribir(
+                    audio, samplerate, modelo=modelo, corto=codificador_corto.ACTIVO,
+                    **opciones)
+            except Exception as e:
+                logger.warning(f"Servidor de modelos no disponible, usando modelo local: {e}")
+
+        try:
+            if resultado is None:
+                resultado = transcribir_local(audio, samplerate, modelo, opciones)
+            texto = filtrar_segmentos(resultado).strip()
+            return limpiar_texto_transcrito(texto)
+        except Exception as e:
+            logger.error(f"Error al transcribir: {e}")
+            return ""
+
+
+class EtapaIntencion(Etapa):
+    fase = Fase.INTENCION
+
+    def __init__(self, asistente):
+        super().__init__()
+        self.asistente = asistente
+
+    def procesar(self, turno):
+        ejecutar_comando(turno.texto)
+        saludo = self.asistente.detectar_nombre(turno.texto)
+        if saludo:
+            if turno.especulacion is not None:
+                turno.especulacion.cancelar()
+                turno.especulacion = None
+            turno.respuesta = saludo
+            self.publicar("respuesta", turno, texto=saludo)
+            return Fragmento(turno, saludo, 0, ultimo=True)
+        return turno.avanzar(Fase.LLM)
+
+
+class EtapaLLM(Etapa):
+    fase = Fase.LLM
+
+    def __init__(self, asistente):
+        super().__init__()
+        self.asistente = asistente
+
+    def procesar(self, turno):
+        """Genera la respuesta con Ollama y la entrega frase a frase a la TTS."""
+        asistente = self.asistente
+        confirmada = turno.especulacion
+        turno.especulacion = None
+        if confirmada is not None:
+            # La respuesta ya se está generando a partir del borrador de la ASR
+            vector, prompt = confirmada.vector, confirmada.prompt
+        else:
+            vector, prompt = asistente.construir_prompt(turno.texto)
+        frases = []
+        error = False
+        try:
+            if confirmada is not None:
+                for frase in confirmada.frases():
+                    if not frases:
+                        asistente.especulador.registrar_acierto(confirmada)
+                    yield Fragmento(turno, frase, len(frases))
+                    frases.append(frase)
+                    turno.respuesta = " ".join(frases)
+            else:
+                with asistente.gestor.usar("llm"):
+                    # La latencia no incluye la espera a que se recargue el modelo
+                    inicio = time.perf_counter()
+                    for frase in asistente.generar_frases(prompt, lambda: turno.cancelado):
+                        if not frases:
+                            asistente.calidad.registrar("llm", time.perf_counter() - inicio)
+                        yield Fragmento(turno, frase, len(frases))
+                        frases.append(frase)
+                        turno.respuesta = " ".join(frases)
+        except Exception as e:
+            logger.error(f"Error al generar respuesta: {e}")
+            error = True
+            if not frases:
+                respuesta = self.respuesta_sin_llm(turno.texto, e)
+                yield Fragmento(turno, respuesta, 0)
+                frases.append(respuesta)
+
+        turno.respuesta = " ".join(frases)
+        if turno.cancelado:
+            # Mostrar lo que llegó a decirse, sin guardarlo en la memoria
+            if frases:
+                self.publicar("respuesta", turno, texto=f"{turno.respuesta} …")
+            return
+        if not error:
+            asistente.respuestas.guardar(turno.texto, turno.respuesta)
+            if vector is not None:
+                asistente.memoria.agregar(
+                    vector, f"Usuario: {turno.texto} / {asistente.nombre_asistente}: {turno.respuesta}")
+        self.publicar("respuesta", turno, texto=turno.respuesta)
+        yield Fragmento(turno, "", len(frases), ultimo=True)
+
+    def respuesta_sin_llm(self, texto, error):
+        """Respuesta cuando el LLM falla: la guardada para la misma pregunta, si la hay."""
+        guardada = self.asistente.respuestas.buscar(texto)
+        if guardada:
+            logger.info("LLM no disponible: se repite la respuesta guardada a la misma pregunta")
+            return guardada
+        if isinstance(error, (PlazoAgotado, CircuitoAbierto)):
+            return SIN_LLM
+        return DISCULPA
+
+
+class EtapaTTS(Etapa):
+    fase = Fase.TTS
+
+    def __init__(self, cliente_modelos, directorio):
+        super().__init__()
+        self.cliente_modelos = cliente_modelos
+        self.directorio = directorio
+
+    def procesar(self, fragmento):
+        if fragmento.texto:
+            ruta = os.path.join(self.directorio, f"respuesta_{uuid.uuid4()}.mp3")
+            try:
+                fragmento.ruta = self.sintetizar(fragmento.texto, ruta)
+            except Exception as e:
+                logger.error(f"Error al sintetizar voz: {e}")
+        return fragmento.avanzar(Fase.REPRODUCCION)
+
+    def sintetizar(self, texto, ruta):
+        """Genera el mp3 de `texto` y devuelve su ruta: la del servidor de modelos
+        (que elige dónde escribir) o `ruta` si se sintetiza aquí."""
+        if self.cliente_modelos.disponible():
+            try:
+                return self.cliente_modelos.sintetizar(texto)
+            except Exception as e:
+                logger.warning(f"Servidor de modelos no disponible, usando gTTS local: {e}")
+        from gtts import gTTS
+        tts = gTTS(text=texto, lang="es", slow=False)
+        tts.save(ruta)
+        return ruta
+
+
+class EtapaReproduccion(Etapa):
+    fase = Fase.REPRODUCCION
+
+    def __init__(self, captura, gestor):
+        super().__init__()
+        self.captura = captura
+        self.gestor = gestor
+
+    def procesar(self, fragmento):
+        if fragmento.ruta:
+            if self.captura.duplex:
+                self.reproducir_duplex(fragmento)
+            else:
+                with self.gestor.usar("audio"):
+                    self.reproducir_pygame(fragmento)
+        if fragmento.turno.cancelado:
+            return None
+        if fragmento.ultimo:
+            return fragmento.avanzar(Fase.TERMINADO)
+        return None
+
+    def reproducir_pygame(self, fragmento):
+        import pygame
+        try:
+            pygame.mixer.music.load(fragmento.ruta)
+            pygame.mixer.music.play()
+            while pygame.mixer.music.get_busy():
+                if fragmento.turno.cancelacion.wait(0.05):
+                    pygame.mixer.music.stop()
+                    break
+        except Exception as e:
+            logger.error(f"Error al reproducir audio: {e}")
+        finally:
+            # Liberar el archivo antes de borrarlo (en Windows no se puede borrar abierto)
+            descargar = getattr(pygame.mixer.music, "unload", None)
+            if descargar is not None:
+                descargar()
+            self.descartar(fragmento)
+
+    def reproducir_duplex(self, fragmento):
+        """Reproduce por el flujo de captura para que el cancelador de eco tenga la referencia."""
+        import soundfile as sf
+        try:
+            # Leer mp3 requiere libsndfile >= 1.1 (incluida en soundfile >= 0.12)
+            audio, samplerate = sf.read(fragmento.ruta, dtype="float32")
+            audio = remuestrear(a_mono(audio), samplerate, self.captura.samplerate)
+            self.captura.reproducir(audio, fragmento.turno.cancelacion)
+            logger.debug(f"Cancelación de eco: {self.captura.estadisticas_eco()}")
+        except Exception as e:
+            logger.error(f"Error al reproducir audio: {e}")
+        finally:
+            self.descartar(fragmento)
+
+    def descartar(self, fragmento):
+        if fragmento.ruta:
+            try:
+                os.remove(fragmento.ruta)
+            except OSError as e:
+                logger.warning(f"No se pudo borrar {fragmento.ruta}: {e}")
+            fragmento.ruta = None
+
+
+class EscuchaPalabraClave(threading.Thread):
+    """Escucha continua: al detectar la palabra clave envía un turno a la captura."""
+
+    def __init__(self, asistente):
+        super().__init__(name="escucha-palabra-clave", daemon=True)
+        self.asistente = asistente
+        self._activo = True
+
+    def run(self):
+        # Se crea desde la interfaz; no debe quedarse con sus núcleos
+        REPARTO.liberar_hilo()
+        asistente = self.asistente
+        captura = asistente.captura
+        detector = asistente.detector
+        try:
+            captura.iniciar()
+            for posicion, bloque in captura.bloques(detector.muestras_bloque, lambda: self._activo):
+                # No escuchar la orden que se está grabando ni, sin cancelación de eco,
+                # la propia voz de ELISA; en dúplex la palabra clave la interrumpe
+                if (asistente.pipeline.ocupada(Fase.REPRODUCCION) and not captura.duplex) or \
+                        asistente.pipeline.ocupada(Fase.CAPTURA):
+                    detector.reiniciar()
+                    continue
+                if detector.procesar(bloque):
+                    turno = Turno(nuevo_turno(), "palabra_clave", Fase.CAPTURA,
+                                  posicion=posicion - len(detector.ultimo_segmento))
+                    asistente.gestor.anticipar("palabra clave")
+                    asistente.interrumpir()
+                    asistente.pipeline.publicar("palabra_clave", turno)
+                    asistente.pipeline.enviar(turno)
+                    detector.reiniciar()
+        except Exception as e:
+            logger.error(f"Error en escucha continua: {e}")
+
+    def detener(self):
+        self._activo = False
+        self.join(2)
+
+
+class Asistente:
+    def __init__(self, nombre_asistente="ELISA", nombre_usuario=None,
+                 directorio_audio=temp_audio_dir, memoria=None):
+        import pygame
+        self.nombre_asistente = nombre_asistente
+        self.nombre_usuario = nombre_usuario
+
+        # Inicializar pygame para audio, con el búfer calibrado para el dispositivo si lo hay
+        pygame.init()
+        self.opciones_mezclador = latencia_audio.opciones_mezclador()
+        pygame.mixer.init(**self.opciones_mezclador)
+
+        os.makedirs(directorio_audio, exist_ok=True)
+        self.cliente_modelos = ClienteModelos()
+        self.calidad = ControladorCalidad(self.cargar_whisper, self.cargar_llm,
+                                          MODELO_WHISPER, MODELO_LLM)
+        self.especulador = Especulador(self.construir_prompt, self.generar_especulacion) \
+            if especulacion.ACTIVO else None
+        threading.Thread(target=self.precargar_modelos, name="carga-modelos", daemon=True).start()
+
+        self.captura = ServicioCaptura()
+        self.captura.al_desbordar = lambda resumen: self.pipeline.publicar("cortes_audio", None, **resumen)
+        self.gestor = GestorMemoria()
+        self.medidor = MedidorDecodificacion()
+        self.gobernador = GobernadorRespuesta()
+        self.respuestas = CacheRespuestas()
+        self.memoria = memoria if memoria is not None else MemoriaLargoPlazo()
+        self.detector = None
+        self.escucha = None
+        # Último turno escrito, para unirle los mensajes que lleguen antes de su respuesta
+        self._ultimo_texto = None
+        self._lock_texto = threading.Lock()
+
+        self.pipeline = Pipeline([
+            EtapaCaptura(self),
+            EtapaDSP(self.captura, self.medidor),
+            EtapaASR(self.cliente_modelos, self.medidor, self.calidad, self.gestor,
+                     self.especulador),
+            EtapaIntencion(self),
+            EtapaLLM(self),
+            EtapaTTS(self.cliente_modelos, directorio_audio),
+            EtapaReproduccion(self.captura, self.gestor),
+        ])
+        self.pipeline.iniciar()
+        self.registrar_recursos()
+        self.gestor.iniciar()
+
+    def suscribir(self, callback):
+        self.pipeline.suscribir(callback)
+
+    # --- Modelos ---
+
+    def precargar_modelos(self):
+        if not self.cliente_modelos.disponible():
+            # Sin servidor de modelos: cargar Whisper local antes del primer turno
+            obtener_whisper_model(self.calidad.modelo_whisper)
+        if self.especulador is not None:
+            self.cargar_whisper(self.especulador.modelo)
+        self.calidad.precargar()
+
+    def generar_frases(self, prompt, cancelado):
+        """Genera con Ollama la respuesta a `prompt` y la entrega frase a frase."""
+        flujo = obtener_cliente().generate(
+            model=self.calidad.modelo_llm,
+            prompt=prompt,
+            stream=True,
+            options=self.gobernador.opciones(REPARTO.opciones_ollama(), self.nombre_usuario),
+            keep_alive=self.gestor.keep_alive,
+            respaldo=True
+        )
+        yield from self.gobernador.frases(flujo, cancelado)
+
+    def generar_especulacion(self, prompt, cancelado):
+        with self.gestor.usar("llm"):
+            yield from self.generar_frases(prompt, cancelado)
+
+    def cargar_whisper(self, nombre):
+        if self.cliente_modelos.disponible():
+            self.cliente_modelos.cargar(nombre)
+        else:
+            obtener_whisper_model(nombre)
+
+    def cargar_llm(self, nombre):
+        # Una petición sin prompt solo carga el modelo en memoria
+        # Mismas opciones de ejecución que los turnos, para que Ollama no lo vuelva a cargar
+        obtener_cliente().generate(model=nombre, prompt="", keep_alive=self.gestor.keep_alive,
+                        options=REPARTO.opciones_ollama())
+
+    def registrar_recursos(self):
+        """Recursos que el gestor de memoria puede descargar si no se usan."""
+        import pygame
+        # Whisper solo ocupa memoria de este proceso si no hay servidor de modelos;
+        # el LLM y los embeddings viven siempre en Ollama
+        self.gestor.registrar("whisper", lambda: self.cargar_whisper(self.calidad.modelo_whisper),
+                              self.descargar_whisper,
+                              local=lambda: not self.cliente_modelos.disponible())
+        self.gestor.registrar("llm", lambda: self.cargar_llm(self.calidad.modelo_llm),
+                              self.descargar_llm, local=False)
+        self.gestor.registrar("embeddings", self.cargar_embeddings, self.descargar_embeddings,
+                              local=False)
+        # El motor de TTS (gTTS) no guarda nada en memoria; el mezclador de pygame sí
+        self.gestor.registrar("audio", lambda: pygame.mixer.init(**self.opciones_mezclador),
+                              pygame.mixer.quit)
+
+    def descargar_whisper(self):
+        """Libera Whisper (en el servidor de modelos si lo hay). Devuelve los bytes liberados.
+
+        El servidor es compartido: solo libera los modelos que ningún cliente ha
+        usado en el tiempo de inactividad de este.
+        """
+        if self.cliente_modelos.disponible():
+            return self.cliente_modelos.descargar(inactivo=self.gestor.segundos_inactivo)
+        liberar_whisper_models()
+        return None
+
+    def descargar_llm(self):
+        cliente = obtener_cliente()
+        return descargar_ollama(set(self.calidad.escaleras["llm"].niveles),
+                                lambda nombre: cliente.generate(model=nombre, prompt="", keep_alive=0))
+
+    def cargar_embeddings(self):
+        obtener_cliente().embeddings(model=self.memoria.modelo, prompt="",
+                                     keep_alive=self.gestor.keep_alive)
+
+    def descargar_embeddings(self):
+        cliente = obtener_cliente()
+        return descargar_ollama({self.memoria.modelo},
+                                lambda nombre: cliente.embeddings(model=nombre, prompt="", keep_alive=0))
+
+    def anticipar(self, motivo):
+        """Recarga en segundo plano los modelos descargados porque se van a necesitar."""
+        self.gestor.anticipar(motivo)
+
+    # --- Operaciones de la interfaz ---
+
+    def enviar_texto(self, texto):
+        """Inicia un turno con un mensaje escrito. Devuelve False si el pipeline está lleno.
+
+        Interrumpe lo que esté en curso. Si el mensaje escrito anterior aún no
+        tiene respuesta, se une a este para responder a los dos de una vez.
+        """
+        with self._lock_texto:
+            previo = self._ultimo_texto
+            if previo is not None and not previo.respuesta and \
+                    previo.fase not in (Fase.TERMINADO, Fase.DESCARTADO):
+                logger.info(f"Mensaje unido al turno pendiente {previo.id}")
+                texto = f"{previo.texto} {texto}"
+            self.interrumpir()
+            turno = Turno(nuevo_turno(), "texto", Fase.INTENCION, texto=texto)
+            self._ultimo_texto = turno
+            return self.pipeline.enviar(turno, bloquear=False)
+
+    def grabar(self):
+        """Inicia un turno de voz de duración fija, interrumpiendo lo que esté en curso."""
+        self.anticipar("grabación")
+        self.interrumpir()
+        turno = Turno(nuevo_turno(), "voz", Fase.CAPTURA)
+        return self.pipeline.enviar(turno, bloquear=False)
+
+    def interrumpir(self):
+        """Cancela los turnos en curso: corta el LLM, descarta la TTS pendiente y calla."""
+        cancelados = self.pipeline.cancelar()
+        if cancelados:
+            self.pipeline.publicar("interrumpido", None, turnos=[t.id for t in cancelados])
+        return cancelados
+
+    def decir(self, texto):
+        """Pronuncia un texto sin pasar por el LLM."""
+        turno = Turno(nuevo_turno(), "sistema", Fase.TTS, respuesta=texto)
+        return self.pipeline.enviar(Fragmento(turno, texto, 0, ultimo=True), bloquear=False)
+
+    def activar_manos_libres(self, activo):
+        """Activa o desactiva la escucha continua. Lanza excepción si no hay plantillas."""
+        if not activo:
+            if self.escucha is not None:
+                self.escucha.detener()
+                self.escucha = None
+            self.pipeline.establecer_reposo(Estado.QUIETO)
+            return
+        if self.detector is None:
+            self.detector = DetectorPalabraClave.desde_directorio()
+        self.escucha = EscuchaPalabraClave(self)
+        self.escucha.start()
+        self.pipeline.establecer_reposo(Estado.ESCUCHANDO)
+
+    def detener(self):
+        import pygame
+        if self.escucha is not None:
+            self.escucha.detener()
+        self.pipeline.detener()
+        self.captura.detener()
+        self.gestor.detener()
+        cerrar_cliente()
+        pygame.quit()
+
+    # --- Lógica de la conversación ---
+
+    def detectar_nombre(self, texto):
+        """Si el usuario dice su nombre, lo guarda y devuelve el saludo."""
+        if self.nombre_usuario is not None:
+            return None
+        texto_lower = texto.lower()
+        nombre = None
+        if "me llamo" in texto_lower:
+            nombre = texto_lower.split("me llamo")[-1].strip().title()
+        elif "mi nombre es" in texto_lower:
+            nombre = texto_lower.split("mi nombre es")[-1].strip().title()
+        elif "soy" in texto_lower:
+            nombre = texto_lower.split("soy")[-1].strip().title()
+
+        if nombre and len(nombre) > 1:
+            self.nombre_usuario = nombre
+            logger.info(f"Nombre detectado: {nombre}")
+            return f"¡Mucho gusto, {nombre}! ¿En qué puedo ayudarte hoy?"
+        return None
+
+    def construir_prompt(self, texto):
+        """Devuelve (vector del texto para la memoria, prompt para el LLM)."""
+        # Recuperar turnos parecidos de conversaciones anteriores
+        vector = None
+        recuerdos = []
+        try:
+            with self.gestor.usar("embeddings"):
+                vector = self.memoria.incrustar(texto)
+            recuerdos = self.memoria.buscar(vector)
+        except Exception as e:
+            logger.warning(f"Memoria a largo plazo no disponible: {e}")
+        return vector, redactar_prompt(texto, self.nombre_asistente, self.nombre_usuario,
+                                       self.gobernador.max_palabras, recuerdos)
@@ -0,0 +1,144 @@
+"""Compara precisión y latencia del codificador recortado frente al de 30 s.
+
+El corpus es un directorio de grabaciones en español con su transcripción de
+referencia al lado:
+
+    corpus/orden_001.wav
+    corpus/orden_001.txt
+
+Para cada archivo se mide el tiempo del codificador solo y de la
+transcripción completa por tres caminos: ventana de 30 s (`transcribe`),
+contexto recortado sin respaldo y contexto recortado con respaldo (el modo
+que usa ELISA). La precisión se da como WER frente a la referencia.
+
+Uso:
+    python benchmark_codificador.py corpus/ [--modelo small] [--repeticiones 3]
+"""
+import os
+import re
+import glob
+import time
+import argparse
+import unicodedata
+
+import numpy as np
+import soundfile as sf
+
+from utilidades_audio import a_mono, remuestrear, MUESTREO_WHISPER
+import codificador_corto
+
+OPCIONES = dict(language="spanish", task="transcribe", fp16=False, temperature=0.0, beam_size=5)
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize("NFC", texto.lower())
+    return re.sub(r"[^\w\s]", " ", texto).split()
+
+
+def distancia_palabras(referencia, hipotesis):
+    """Distancia de edición entre dos listas de palabras."""
+    anterior = list(range(len(hipotesis) + 1))
+    for i, palabra in enumerate(referencia, 1):
+        actual = [i]
+        for j, otra in enumerate(hipotesis, 1):
+            actual.append(min(anterior[j] + 1, actual[j - 1] + 1,
+                              anterior[j - 1] + (palabra != otra)))
+        anterior = actual
+    return anterior[-1]
+
+
+def cronometrar(funcion, repeticiones):
+    """Devuelve (último resultado, mediana de segundos)."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return resultado, float(np.median(tiempos))
+
+
+def tiempo_codificador(modelo, audio, segundos, repeticiones):
+    import torch
+    import whisper
+    audio = whisper.pad_or_trim(audio, int(segundos * MUESTREO_WHISPER))
+    mel = whisper.log_mel_spectrogram(audio, getattr(modelo.dims, "n_mels", 80))
+    mel = mel.unsqueeze(0).to(modelo.device)
+    with torch.no_grad():
+        return cronometrar(lambda: modelo.encoder(mel), repeticiones)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del codificador recortado de Whisper")
+    parser.add_argument("corpus", help="Directorio con pares .wav/.txt")
+    parser.add_argument("--modelo", default="small")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    import whisper
+    modelo = codificador_corto.preparar(whisper.load_model(args.modelo))
+
+    modos = ("completo", "corto", "corto+respaldo")
+    errores = {modo: 0 for modo in modos}
+    latencias = {modo: [] for modo in modos}
+    codificador = {"completo": [], "corto": []}
+    palabras_referencia = 0
+    respaldos = 0
+
+    rutas = sorted(glob.glob(os.path.join(args.corpus, "*.wav")))
+    for ruta in rutas:
+        ruta_texto = os.path.splitext(ruta)[0] + ".txt"
+        if not os.path.exists(ruta_texto):
+            print(f"Sin referencia, se omite: {ruta}")
+            continue
+        with open(ruta_texto, encoding="utf-8") as f:
+            referencia = normalizar(f.read())
+        audio, samplerate = sf.read(ruta, dtype="float32")
+        audio = remuestrear(a_mono(audio), samplerate, MUESTREO_WHISPER).astype(np.float32)
+        segundos = len(audio) / MUESTREO_WHISPER
+
+        resultados = {}
+        resultados["completo"], latencia = cronometrar(
+            lambda: modelo.transcribe(audio, **OPCIONES), args.repeticiones)
+        latencias["completo"].append(latencia)
+        (resultados["corto"], _), latencia = cronometrar(
+            lambda: codificador_corto.decodificar_corto(modelo, audio, **OPCIONES), args.repeticiones)
+        latencias["corto"].append(latencia)
+        resultados["corto+respaldo"], latencia = cronometrar(
+            lambda: codificador_corto.transcribir(modelo, audio, **OPCIONES), args.repeticiones)
+        latencias["corto+respaldo"].append(latencia)
+        if not codificador_corto.aceptable(resultados["corto"]):
+            respaldos += 1
+
+        codificador["completo"].append(
+            tiempo_codificador(modelo, audio, codificador_corto.SEGUNDOS_VENTANA, args.repeticiones))
+        codificador["corto"].append(
+            tiempo_codificador(modelo, audio, codificador_corto.segundos_cubeta(segundos),
+                               args.repeticiones))
+
+        palabras_referencia += len(referencia)
+        linea = [f"{os.path.basename(ruta)} ({segundos:.1f}s)"]
+        for modo in modos:
+            error = distancia_palabras(referencia, normalizar(resultados[modo]["text"]))
+            errores[modo] += error
+            linea.append(f"{modo} {latencias[modo][-1]:.2f}s/{error}err")
+        print("  ".join(linea))
+
+    if not palabras_referencia:
+        print("No se encontraron pares .wav/.txt en el corpus")
+        return
+
+    print(f"\n{len(latencias['completo'])} archivos, {palabras_referencia} palabras de referencia, "
+          f"modelo {args.modelo}")
+    print(f"{'modo':>16}  {'WER':>6}  {'latencia p50':>12}  {'p90':>6}")
+    for modo in modos:
+        print(f"{modo:>16}  {errores[modo] / palabras_referencia:6.1%}  "
+              f"{np.percentile(latencias[modo], 50):11.2f}s  {np.percentile(latencias[modo], 90):5.2f}s")
+    completo = np.median(codificador["completo"])
+    corto = np.median(codificador["corto"])
+    print(f"\nCodificador (mediana): 30 s {completo * 1000:.0f} ms, recortado {corto * 1000:.0f} ms "
+          f"({completo / corto:.1f}x)")
+    print(f"Respaldos a la ventana completa: {respaldos}")
+
+
+if __name__ == "__main__":
+    main()
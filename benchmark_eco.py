@@ -0,0 +1,128 @@
+"""Mide la cancelación de eco y su coste por bloque frente al tiempo real.
+
+Simula un altavoz y un micrófono: la voz lejana (la de ELISA) pasa por una
+respuesta al impulso de sala sintética con el retardo indicado y se suma a
+una voz cercana (el usuario interrumpiendo) y a ruido. Se informa de:
+
+    - atenuación del eco (ERLE) tras la convergencia, sin voz cercana
+    - cuánto se atenúa la voz cercana durante la doble conversación
+    - coste medio, p99 y máximo por bloque y fracción del periodo del bloque
+
+Sin archivos se usa ruido modulado como voz; con --lejana/--cercana se usan
+grabaciones reales (se remuestrean a 16 kHz).
+
+Uso:
+    python benchmark_eco.py [--lejana respuesta.wav] [--cercana orden.wav]
+                            [--particiones 4 8 16] [--retardo-ms 60]
+"""
+import argparse
+
+import numpy as np
+
+import eco
+from captura import BLOQUES_MARGEN_ECO
+from utilidades_audio import a_mono, remuestrear, MUESTREO_WHISPER
+
+SEGUNDOS = 12
+# Tramo con voz cercana (segundos)
+DOBLE_CONVERSACION = (8.0, 9.5)
+
+
+def voz_sintetica(segundos, semilla):
+    """Ruido rosado aproximado con envolvente silábica, como sustituto de voz."""
+    rng = np.random.default_rng(semilla)
+    n = int(segundos * MUESTREO_WHISPER)
+    espectro = np.fft.rfft(rng.standard_normal(n))
+    espectro /= np.sqrt(np.arange(1, len(espectro) + 1))
+    x = np.fft.irfft(espectro, n)
+    envolvente = np.abs(np.sin(np.arange(n) / MUESTREO_WHISPER * 2 * np.pi * 2.5)) + 0.05
+    x *= envolvente
+    return (0.5 * x / np.max(np.abs(x))).astype(np.float32)
+
+
+def cargar(ruta, segundos):
+    import soundfile as sf
+    audio, samplerate = sf.read(ruta, dtype="float32")
+    audio = remuestrear(a_mono(audio), samplerate, MUESTREO_WHISPER)
+    n = int(segundos * MUESTREO_WHISPER)
+    return np.resize(audio, n) if len(audio) < n else audio[:n]
+
+
+def respuesta_sala(retardo, semilla, cola_ms=60, ganancia=0.3):
+    """Camino directo tras `retardo` muestras y reflexiones que decaen exponencialmente."""
+    rng = np.random.default_rng(semilla)
+    cola = int(cola_ms * MUESTREO_WHISPER / 1000)
+    h = np.zeros(retardo + cola)
+    h[retardo] = ganancia
+    # Reflexiones con la mitad de la energía del camino directo
+    decaimiento = np.exp(-np.arange(cola - 1) / (cola / 4))
+    h[retardo + 1:] = rng.standard_normal(cola - 1) * decaimiento * \
+        ganancia * np.sqrt(0.5 / np.sum(decaimiento ** 2))
+    return h
+
+
+def db(potencia, otra):
+    return 10 * np.log10((potencia + 1e-12) / (otra + 1e-12))
+
+
+def medir(lejana, cercana, h, particiones, retardo_estimado):
+    n = len(lejana)
+    eco_mic = np.convolve(lejana, h)[:n].astype(np.float32)
+    mic = eco_mic + cercana + 1e-3 * np.random.default_rng(2).standard_normal(n).astype(np.float32)
+    cancelador = eco.CanceladorEco(particiones=particiones, retardo=retardo_estimado,
+                                   samplerate=MUESTREO_WHISPER)
+    bloque = cancelador.n
+    salida = np.zeros_like(mic)
+    for i in range(0, n - bloque + 1, bloque):
+        salida[i:i + bloque] = cancelador.procesar(mic[i:i + bloque], lejana[i:i + bloque])
+
+    inicio_doble, fin_doble = (int(s * MUESTREO_WHISPER) for s in DOBLE_CONVERSACION)
+    convergido = slice(int(4 * MUESTREO_WHISPER), inicio_doble)
+    erle = db(np.mean(mic[convergido] ** 2), np.mean(salida[convergido] ** 2))
+    # Voz cercana conservada: salida frente a la voz cercana sola en ese tramo
+    doble = slice(inicio_doble, fin_doble)
+    perdida = db(np.mean(cercana[doble] ** 2), np.mean(salida[doble] ** 2))
+    return erle, perdida, cancelador.estadisticas()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la cancelación de eco")
+    parser.add_argument("--lejana", help="Grabación que sale por el altavoz")
+    parser.add_argument("--cercana", help="Grabación del usuario hablando encima")
+    parser.add_argument("--particiones", type=int, nargs="+", default=[4, eco.PARTICIONES, 16])
+    parser.add_argument("--retardo-ms", type=float, default=60,
+                        help="Latencia de salida + entrada + recorrido acústico")
+    parser.add_argument("--error-latencia-ms", type=float, default=10,
+                        help="Cuánto sobrestima el dispositivo la latencia")
+    args = parser.parse_args()
+
+    lejana = cargar(args.lejana, SEGUNDOS) if args.lejana else voz_sintetica(SEGUNDOS, 0)
+    cercana = np.zeros_like(lejana)
+    inicio, fin = (int(s * MUESTREO_WHISPER) for s in DOBLE_CONVERSACION)
+    voz = cargar(args.cercana, fin / MUESTREO_WHISPER) if args.cercana else \
+        voz_sintetica(fin / MUESTREO_WHISPER, 1)
+    cercana[inicio:fin] = 0.6 * voz[inicio:fin]
+
+    retardo = int(args.retardo_ms * MUESTREO_WHISPER / 1000)
+    # Igual que captura.py: latencia informada menos un margen de bloques
+    informado = retardo + int(args.error_latencia_ms * MUESTREO_WHISPER / 1000)
+    estimado = max(0, informado - BLOQUES_MARGEN_ECO * eco.MUESTRAS_BLOQUE)
+    h = respuesta_sala(retardo, 3)
+
+    periodo = eco.MUESTRAS_BLOQUE / MUESTREO_WHISPER * 1000
+    print(f"Bloque de {eco.MUESTRAS_BLOQUE} muestras ({periodo:.0f} ms), retardo real "
+          f"{args.retardo_ms:.0f} ms, estimado {estimado / MUESTREO_WHISPER * 1000:.0f} ms")
+    print(f"{'particiones':>11}  {'cola':>6}  {'ERLE':>7}  {'pérdida cercana':>15}  "
+          f"{'ms/bloque':>9}  {'p99':>6}  {'máx':>6}  {'tiempo real':>11}")
+    for particiones in args.particiones:
+        erle, perdida, e = medir(lejana, cercana, h, particiones, estimado)
+        cola = particiones * periodo
+        print(f"{particiones:>11}  {cola:4.0f}ms  {erle:5.1f}dB  {perdida:13.1f}dB  "
+              f"{e['ms_medio']:9.3f}  {e['ms_p99']:6.3f}  {e['ms_max']:6.3f}  "
+              f"{e['fraccion_tiempo_real']:10.1%}")
+    print(f"\nPresupuesto: {eco.PRESUPUESTO:.0%} del periodo; por encima el cancelador "
+          f"reduce la cola a la mitad (mínimo {eco.PARTICIONES_MINIMAS} particiones)")
+
+
+if __name__ == "__main__":
+    main()
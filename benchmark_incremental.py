@@ -0,0 +1,95 @@
+"""Coste por paso de la decodificación incremental frente a transcribir todo de nuevo.
+
+Simula un modo en vivo: el audio llega en pasos de `--paso` segundos y en
+cada paso se transcribe el búfer acumulado de varias maneras:
+
+    completo     `transcribe` sobre todo el búfer (codificador de 30 s)
+    corto        codificador_corto.decodificar_corto sobre todo el búfer
+    incremental  DecodificadorIncremental, que solo procesa lo nuevo
+
+Se mide el tiempo de CPU de cada paso y se muestra por tramos de longitud del
+búfer, junto con el tiempo de CPU por segundo de voz nueva. Al final se
+compara el texto del modo incremental con el de `transcribe` sobre todo el
+audio.
+
+Uso:
+    python benchmark_incremental.py [--audio orden.wav] [--modelo base] [--paso 0.5]
+"""
+import time
+import argparse
+
+import numpy as np
+
+from utilidades_audio import a_mono, remuestrear, MUESTREO_WHISPER
+from decodificacion_incremental import DecodificadorIncremental, SEGUNDOS_VENTANA
+import codificador_corto
+
+OPCIONES = dict(language="spanish", task="transcribe", fp16=False, temperature=0.0)
+
+
+def cargar_audio(ruta, segundos):
+    if ruta is None:
+        # Ruido con una envolvente de voz
+        rng = np.random.default_rng(0)
+        n = int(segundos * MUESTREO_WHISPER)
+        envolvente = np.abs(np.sin(np.arange(n) / MUESTREO_WHISPER * 2 * np.pi * 2))
+        return (0.1 * rng.standard_normal(n) * envolvente).astype(np.float32)
+    import soundfile as sf
+    audio, samplerate = sf.read(ruta, dtype="float32")
+    return remuestrear(a_mono(audio), samplerate, MUESTREO_WHISPER)[:int(segundos * MUESTREO_WHISPER)]
+
+
+def cpu(funcion):
+    """(resultado, segundos de CPU del proceso)."""
+    inicio = time.process_time()
+    resultado = funcion()
+    return resultado, time.process_time() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la decodificación incremental")
+    parser.add_argument("--audio", help="Grabación (por defecto, 20 s de ruido)")
+    parser.add_argument("--modelo", default="base", help="Modelo de Whisper")
+    parser.add_argument("--paso", type=float, default=0.5, help="Segundos de audio por paso")
+    parser.add_argument("--segundos", type=float, default=20)
+    parser.add_argument("--modos", nargs="+", default=["completo", "corto", "incremental"])
+    args = parser.parse_args()
+
+    import whisper
+    modelo = codificador_corto.preparar(whisper.load_model(args.modelo))
+    audio = cargar_audio(args.audio, min(args.segundos, SEGUNDOS_VENTANA))
+    paso = int(args.paso * MUESTREO_WHISPER)
+    fines = range(paso, len(audio) + 1, paso)
+    decodificador = DecodificadorIncremental(modelo, OPCIONES["language"])
+
+    tiempos = {modo: [] for modo in args.modos}
+    for fin in fines:
+        bufer = audio[:fin]
+        if "completo" in tiempos:
+            tiempos["completo"].append(cpu(lambda: modelo.transcribe(bufer, **OPCIONES))[1])
+        if "corto" in tiempos:
+            tiempos["corto"].append(cpu(lambda: codificador_corto.decodificar_corto(
+                modelo, bufer, **OPCIONES))[1])
+        if "incremental" in tiempos:
+            decodificador.agregar(audio[fin - paso:fin])
+            tiempos["incremental"].append(cpu(decodificador.decodificar)[1])
+
+    # Tiempo de CPU medio por paso en cada cuarto del audio
+    tramos = np.array_split(np.arange(len(fines)), 4)
+    cabecera = "".join(f"{f'{fines[t[0]] / MUESTREO_WHISPER:.0f}-{fines[t[-1]] / MUESTREO_WHISPER:.0f}s':>10}"
+                       for t in tramos if len(t))
+    print(f"CPU por paso de {args.paso}s según la longitud del búfer ({args.modelo}):")
+    print(f"{'modo':>12}{cabecera}{'CPU/s voz':>11}")
+    for modo, valores in tiempos.items():
+        valores = np.array(valores)
+        columnas = "".join(f"{valores[t].mean():9.3f}s" for t in tramos if len(t))
+        print(f"{modo:>12}{columnas}{valores.sum() / (len(audio) / MUESTREO_WHISPER):10.2f}s")
+
+    if "incremental" in tiempos:
+        referencia = modelo.transcribe(audio, **OPCIONES)["text"].strip()
+        print(f"\ntranscribe:  {referencia[:200]}")
+        print(f"incremental: {decodificador.texto()[:200]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Mide falsas aceptaciones, falsos rechazos y CPU del detector de palabra clave.
+
+El corpus es un directorio con dos subdirectorios de archivos de audio:
+
+    corpus/positivos/*.wav   grabaciones que contienen «Elisa»
+    corpus/negativos/*.wav   audio ambiente o conversación sin la palabra clave
+
+Uso:
+    python benchmark_palabra_clave.py corpus/ [--plantillas DIR]
+"""
+import os
+import glob
+import time
+import argparse
+
+import numpy as np
+import soundfile as sf
+
+from utilidades_audio import remuestrear, MUESTREO_WHISPER
+from palabra_clave import DetectorPalabraClave, DIR_PLANTILLAS, RMS_MINIMO
+
+
+def procesar_archivo(detector, ruta):
+    """Pasa el archivo por el detector en bloques y devuelve (detecciones, duración, cpu)."""
+    audio, samplerate = sf.read(ruta, dtype="float32")
+    audio = remuestrear(audio, samplerate)
+    # Cada archivo es una grabación independiente: el detector empieza de cero
+    detector.reiniciar()
+    detector.piso_ruido = RMS_MINIMO
+    detecciones = 0
+    n = detector.muestras_bloque
+    inicio = time.process_time()
+    for i in range(0, len(audio) - n + 1, n):
+        detecciones += detector.procesar(audio[i:i + n])
+    cpu = time.process_time() - inicio
+    return detecciones, len(audio) / MUESTREO_WHISPER, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del detector de palabra clave")
+    parser.add_argument("corpus", help="Directorio con positivos/ y negativos/")
+    parser.add_argument("--plantillas", default=DIR_PLANTILLAS)
+    args = parser.parse_args()
+
+    positivos = sorted(glob.glob(os.path.join(args.corpus, "positivos", "*.wav")))
+    negativos = sorted(glob.glob(os.path.join(args.corpus, "negativos", "*.wav")))
+    if not positivos and not negativos:
+        raise SystemExit(f"No hay audio en {args.corpus}/positivos ni {args.corpus}/negativos")
+
+    detector = DetectorPalabraClave.desde_directorio(args.plantillas)
+
+    # El umbral cambia qué tramos se evalúan (tras una detección el detector se
+    # reinicia), así que el corpus se vuelve a pasar entero con cada umbral
+    resultados = []
+    for umbral in np.arange(0.30, 0.85, 0.05):
+        detector.umbral = umbral
+        segundos_total = cpu_total = horas_negativos = 0.0
+        rechazos = falsas_aceptaciones = 0
+        for ruta in positivos:
+            detecciones, duracion, cpu = procesar_archivo(detector, ruta)
+            rechazos += detecciones == 0
+            segundos_total += duracion
+            cpu_total += cpu
+        for ruta in negativos:
+            detecciones, duracion, cpu = procesar_archivo(detector, ruta)
+            falsas_aceptaciones += detecciones
+            horas_negativos += duracion / 3600
+            segundos_total += duracion
+            cpu_total += cpu
+        frr = rechazos / len(positivos) if positivos else float("nan")
+        fa_hora = falsas_aceptaciones / horas_negativos if horas_negativos else float("nan")
+        resultados.append((umbral, frr, fa_hora, cpu_total))
+
+    print(f"Audio procesado: {segundos_total:.1f}s por umbral")
+    print(f"{'umbral':>8} {'rechazos':>10} {'FA/hora':>10} {'CPU':>8}")
+    for umbral, frr, fa_hora, cpu_total in resultados:
+        print(f"{umbral:8.2f} {100 * frr:9.1f}% {fa_hora:10.2f} "
+              f"{100 * cpu_total / max(segundos_total, 1e-9):7.2f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Compara la fluidez de la interfaz y la latencia de las etapas con cada reparto de CPU.
+
+Para cada reparto se lanza un proceso nuevo (los hilos de torch solo se
+pueden fijar una vez por proceso) con una ventana Qt que se repinta a 60 Hz
+mientras un hilo transcribe con Whisper sin parar y otro hace peticiones a
+Ollama (si está en marcha). Se mide el intervalo real entre fotogramas y la
+latencia de cada transcripción y respuesta.
+
+Repartos: "sin" (valores por defecto de torch y Ollama), "auto" (el reparto
+automático de reparto_cpu.py) o cualquier valor de ELISA_REPARTO_CPU.
+
+Uso:
+    python benchmark_reparto.py [--repartos sin auto "ui=1,asr=2,llm=1,afinidad=1"]
+                                [--audio orden.wav] [--modelo base] [--segundos 30]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+import numpy as np
+
+from reparto_cpu import RepartoCPU, nucleos_disponibles
+from utilidades_audio import a_mono, remuestrear, MUESTREO_WHISPER
+
+MS_FOTOGRAMA = 16
+OPCIONES = dict(language="spanish", task="transcribe", fp16=False, temperature=0.0)
+PREGUNTA = "Explica en dos frases qué es la fotosíntesis."
+
+
+def percentil(valores, p):
+    return float(np.percentile(valores, p)) if valores else float("nan")
+
+
+def cargar_audio(ruta):
+    if ruta is None:
+        # Ruido con una envolvente de voz: Whisper lo procesa igual que una orden
+        rng = np.random.default_rng(0)
+        n = 5 * MUESTREO_WHISPER
+        envolvente = np.abs(np.sin(np.arange(n) / MUESTREO_WHISPER * 2 * np.pi * 2))
+        return (0.1 * rng.standard_normal(n) * envolvente).astype(np.float32)
+    import soundfile as sf
+    audio, samplerate = sf.read(ruta, dtype="float32")
+    return remuestrear(a_mono(audio), samplerate, MUESTREO_WHISPER)
+
+
+def ollama_disponible(modelo):
+    try:
+        from cliente_ollama import obtener_cliente
+        obtener_cliente().generate(model=modelo, prompt="", keep_alive="5m")
+        return True
+    except Exception:
+        return False
+
+
+def medir(args):
+    """Proceso hijo: mide un reparto y escribe el resultado como JSON en la última línea."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication, QLabel
+    from PyQt5.QtCore import QTimer
+
+    reparto = None
+    if args.hijo != "sin":
+        reparto = RepartoCPU.desde_texto("" if args.hijo == "auto" else args.hijo)
+        # Antes de crear hilos: los de Qt heredan los núcleos de la interfaz
+        reparto.aplicar_hilo("ui")
+        reparto.configurar_torch()
+
+    import torch
+    import whisper
+    modelo = whisper.load_model(args.modelo)
+    audio = cargar_audio(args.audio)
+    con_llm = not args.sin_llm and ollama_disponible(args.modelo_llm)
+
+    parar = threading.Event()
+    latencias = {"asr": [], "llm": []}
+
+    def trabajo_asr():
+        if reparto is not None:
+            reparto.aplicar_hilo("asr")
+        while not parar.is_set():
+            inicio = time.perf_counter()
+            modelo.transcribe(audio, **OPCIONES)
+            latencias["asr"].append(time.perf_counter() - inicio)
+
+    def trabajo_llm():
+        from cliente_ollama import obtener_cliente
+        opciones = {"num_predict": 64, **(reparto.opciones_ollama() if reparto else {})}
+        while not parar.is_set():
+            inicio = time.perf_counter()
+            obtener_cliente().generate(model=args.modelo_llm, prompt=PREGUNTA, options=opciones)
+            latencias["llm"].append(time.perf_counter() - inicio)
+
+    app = QApplication(sys.argv[:1])
+    etiqueta = QLabel("0")
+    etiqueta.resize(400, 100)
+    etiqueta.show()
+    intervalos = []
+    anterior = [time.perf_counter()]
+
+    def fotograma():
+        ahora = time.perf_counter()
+        intervalos.append((ahora - anterior[0]) * 1000)
+        anterior[0] = ahora
+        etiqueta.setText(str(len(intervalos)))
+        etiqueta.repaint()
+
+    temporizador = QTimer()
+    temporizador.setTimerType(0)  # Qt.PreciseTimer
+    temporizador.timeout.connect(fotograma)
+    temporizador.start(MS_FOTOGRAMA)
+    QTimer.singleShot(int(args.segundos * 1000), app.quit)
+
+    hilos = [threading.Thread(target=trabajo_asr, daemon=True)]
+    if con_llm:
+        hilos.append(threading.Thread(target=trabajo_llm, daemon=True))
+    for hilo in hilos:
+        hilo.start()
+    app.exec_()
+    parar.set()
+    for hilo in hilos:
+        hilo.join()
+
+    # El primer intervalo incluye el arranque del bucle de eventos
+    intervalos = intervalos[1:]
+    print(json.dumps({
+        "hilos_torch": torch.get_num_threads(),
+        "fotograma_p50": percentil(intervalos, 50),
+        "fotograma_p99": percentil(intervalos, 99),
+        "fotograma_max": max(intervalos, default=float("nan")),
+        "tirones": sum(i > 2 * MS_FOTOGRAMA for i in intervalos) / max(1, len(intervalos)),
+        "asr_p50": percentil(latencias["asr"], 50),
+        "asr_n": len(latencias["asr"]),
+        "llm_p50": percentil(latencias["llm"], 50) if con_llm else None,
+        "llm_n": len(latencias["llm"]),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del reparto de CPU")
+    parser.add_argument("--repartos", nargs="+", default=["sin", "auto"])
+    parser.add_argument("--audio", help="Grabación a transcribir (por defecto, ruido de 5 s)")
+    parser.add_argument("--modelo", default="base", help="Modelo de Whisper")
+    parser.add_argument("--modelo-llm", default="mistral", help="Modelo de Ollama")
+    parser.add_argument("--segundos", type=float, default=30)
+    parser.add_argument("--sin-llm", action="store_true", help="Medir solo Whisper")
+    parser.add_argument("--hijo", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.hijo:
+        medir(args)
+        return
+
+    print(f"{len(nucleos_disponibles())} núcleos disponibles; reparto automático: "
+          f"{RepartoCPU().describir()}")
+    print(f"{'reparto':>28}  {'torch':>5}  {'fotograma p50':>13}  {'p99':>7}  {'máx':>7}  "
+          f"{'tirones':>7}  {'ASR p50':>8}  {'LLM p50':>8}")
+    for reparto in args.repartos:
+        orden = [sys.executable, os.path.abspath(__file__), "--hijo", reparto,
+                 "--modelo", args.modelo, "--modelo-llm", args.modelo_llm,
+                 "--segundos", str(args.segundos)]
+        if args.audio:
+            orden += ["--audio", args.audio]
+        if args.sin_llm:
+            orden.append("--sin-llm")
+        proceso = subprocess.run(orden, capture_output=True, text=True)
+        if proceso.returncode != 0:
+            print(f"{reparto:>28}  error: {proceso.stderr.strip().splitlines()[-1:]}")
+            continue
+        r = json.loads(proceso.stdout.strip().splitlines()[-1])
+        llm = "—" if r["llm_p50"] is None else f"{r['llm_p50']:7.2f}s"
+        print(f"{reparto:>28}  {r['hilos_torch']:>5}  {r['fotograma_p50']:11.1f}ms  "
+              f"{r['fotograma_p99']:5.1f}ms  {r['fotograma_max']:5.0f}ms  {r['tirones']:7.1%}  "
+              f"{r['asr_p50']:7.2f}s  {llm:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Control adaptativo de la calidad de los modelos.
+
+Mide la latencia de cada turno (transcripción y primera frase del LLM) en una
+ventana móvil junto con la carga del equipo y, según los objetivos (SLO)
+configurados, sube o baja de nivel el modelo de Whisper y el de Ollama. El
+modelo del nivel siguiente se carga en segundo plano y solo se cambia cuando
+está listo: el turno en curso sigue con el modelo que ya tenía.
+
+Configuración por variables de entorno:
+    ELISA_NIVELES_WHISPER  "tiny,base,small"      (de menor a mayor calidad)
+    ELISA_NIVELES_LLM      "llama3.2:1b,mistral"
+    ELISA_SLO_ASR          segundos de transcripción (3.0)
+    ELISA_SLO_LLM          segundos hasta la primera frase (2.5)
+    ELISA_MAX_CARGA        carga media por CPU a partir de la cual se baja (0.9)
+"""
+import os
+import time
+import logging
+import threading
+import statistics
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+def _lista_entorno(variable, defecto):
+    return [v.strip() for v in os.environ.get(variable, defecto).split(",") if v.strip()]
+
+
+NIVELES_WHISPER = _lista_entorno("ELISA_NIVELES_WHISPER", "tiny,base,small")
+NIVELES_LLM = _lista_entorno("ELISA_NIVELES_LLM", "llama3.2:1b,mistral")
+SLO_ASR = float(os.environ.get("ELISA_SLO_ASR", "3.0"))
+SLO_LLM = float(os.environ.get("ELISA_SLO_LLM", "2.5"))
+MAX_CARGA = float(os.environ.get("ELISA_MAX_CARGA", "0.9"))
+# Por debajo de esta fracción del SLO se intenta subir de nivel
+MARGEN_SUBIDA = 0.5
+VENTANA = 8
+# Turnos medidos con el nivel actual antes de volver a decidir
+MIN_MUESTRAS = 4
+
+
+def carga_equipo():
+    """Carga media del último minuto por CPU, o None si el sistema no la ofrece."""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+
+class Escalera:
+    """Niveles de un modelo con la ventana de latencias medidas con el actual."""
+
+    def __init__(self, tipo, niveles, inicial, slo, cargar):
+        self.tipo = tipo
+        self.niveles = list(niveles)
+        if inicial not in self.niveles:
+            self.niveles.append(inicial)
+        self.indice = self.niveles.index(inicial)
+        self.slo = slo
+        self.cargar = cargar
+        self.latencias = deque(maxlen=VENTANA)
+        self.cargando = None
+        # Niveles que no se pudieron cargar (p. ej. modelo de Ollama no descargado)
+        self.fallidos = set()
+
+    @property
+    def actual(self):
+        return self.niveles[self.indice]
+
+    def mediana(self):
+        return statistics.median(self.latencias) if self.latencias else None
+
+
+class ControladorCalidad:
+    """Elige en cada turno el modelo de Whisper y de Ollama a usar.
+
+    `cargar_whisper(nombre)` y `cargar_llm(nombre)` cargan un modelo y se
+    llaman siempre desde un hilo en segundo plano.
+    """
+
+    def __init__(self, cargar_whisper, cargar_llm, whisper_inicial, llm_inicial,
+                 niveles_whisper=NIVELES_WHISPER, niveles_llm=NIVELES_LLM,
+                 slo_asr=SLO_ASR, slo_llm=SLO_LLM, max_carga=MAX_CARGA):
+        self.escaleras = {
+            "asr": Escalera("asr", niveles_whisper, whisper_inicial, slo_asr, cargar_whisper),
+            "llm": Escalera("llm", niveles_llm, llm_inicial, slo_llm, cargar_llm),
+        }
+        self.max_carga = max_carga
+        self._lock = threading.Lock()
+
+    @property
+    def modelo_whisper(self):
+        return self.escaleras["asr"].actual
+
+    @property
+    def modelo_llm(self):
+        return self.escaleras["llm"].actual
+
+    def precargar(self):
+        """Carga en segundo plano el nivel inferior de cada modelo para poder bajar al instante."""
+        for escalera in self.escaleras.values():
+            if escalera.indice > 0:
+                self._cargar(escalera, escalera.indice - 1, cambiar=False)
+
+    def registrar(self, tipo, segundos):
+        """Anota la latencia de un turno ("asr" o "llm") y decide si cambiar de nivel."""
+        escalera = self.escaleras[tipo]
+        with self._lock:
+            escalera.latencias.append(segundos)
+            if escalera.cargando is not None or len(escalera.latencias) < MIN_MUESTRAS:
+                return
+            mediana = escalera.mediana()
+            carga = carga_equipo()
+            sobrecargado = carga is not None and carga > self.max_carga
+            if (mediana > escalera.slo or sobrecargado) and escalera.indice > 0:
+                destino = escalera.indice - 1
+            elif mediana < escalera.slo * MARGEN_SUBIDA and not sobrecargado and \
+                    escalera.indice < len(escalera.niveles) - 1:
+                destino = escalera.indice + 1
+            else:
+                return
+            if escalera.niveles[destino] in escalera.fallidos:
+                return
+            logger.info(f"Calidad {tipo}: mediana {mediana:.2f}s (SLO {escalera.slo:.2f}s), "
+                        f"carga {'desconocida' if carga is None else f'{carga:.2f}'}; "
+                        f"{escalera.actual} → {escalera.niveles[destino]}")
+            self._cargar(escalera, destino, cambiar=True)
+
+    def _cargar(self, escalera, destino, cambiar):
+        nombre = escalera.niveles[destino]
+        if cambiar:
+            escalera.cargando = nombre
+
+        def cargar():
+            inicio = time.perf_counter()
+            try:
+                escalera.cargar(nombre)
+            except Exception as e:
+                logger.error(f"No se pudo cargar el modelo {escalera.tipo} '{nombre}': {e}")
+                escalera.fallidos.add(nombre)
+                listo = False
+            else:
+                logger.info(f"Modelo {escalera.tipo} '{nombre}' listo en "
+                            f"{time.perf_counter() - inicio:.1f}s")
+                listo = True
+            if cambiar:
+                with self._lock:
+                    if listo:
+                        escalera.indice = destino
+                    # Medir de nuevo antes de otra decisión (también tras un fallo)
+                    escalera.latencias.clear()
+                    escalera.cargando = None
+
+        threading.Thread(target=cargar, name=f"carga-{escalera.tipo}-{nombre}", daemon=True).start()
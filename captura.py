@@ -0,0 +1,401 @@
+"""Servicio de captura de audio con el dispositivo de entrada siempre abierto.
+
+El flujo de entrada se abre una sola vez y su callback escribe en un búfer
+circular preasignado. Las grabaciones se extraen del búfer por posición
+absoluta, de modo que pueden incluir audio anterior al disparo (pre-roll) y no
+reservan búferes grandes en cada turno.
+
+En modo dúplex (ELISA_DUPLEX=1) se abre un único flujo de entrada y salida:
+la voz de ELISA se reproduce por él y lo que sale por el altavoz en cada
+bloque es la referencia del cancelador de eco (ver eco.py), que limpia el
+micrófono antes de escribirlo en el búfer. Así se puede seguir escuchando
+(palabra clave, interrupciones) mientras ELISA habla por altavoces.
+
+Si no se indican bloque ni latencia se usan los calibrados para el
+dispositivo con latencia_audio.py. En marcha se vigilan los cortes (xruns):
+se registran, se avisa a quien escuche `al_desbordar` y, si se repiten, el
+flujo se vuelve a abrir con un ajuste más holgado que queda guardado.
+"""
+import os
+import time
+import logging
+import threading
+
+import numpy as np
+
+from eco import CanceladorEco, MUESTRAS_BLOQUE
+import latencia_audio
+from pipeline import CAPACIDAD_COLAS
+from utilidades_audio import MUESTREO_WHISPER
+
+logger = logging.getLogger(__name__)
+
+# Segundos de audio previos al disparo que se incluyen en cada grabación
+SEGUNDOS_PREVIOS = float(os.environ.get("ELISA_PREVIO_SEGUNDOS", "0.5"))
+SEGUNDOS_MAXIMOS = 15
+SEGUNDOS_BUFFER = 30
+# Etapas que retienen el búfer de un turno: captura, DSP y ASR
+ETAPAS_CON_AUDIO = 3
+# Margen frente al escritor cuando el bloque es variable (blocksize=0)
+MUESTRAS_MARGEN_VARIABLE = 2048
+
+
+def buferes_turno(capacidad_cola=CAPACIDAD_COLAS, etapas=ETAPAS_CON_AUDIO):
+    """Grabaciones que pueden estar a la vez en el pipeline, cada una con su búfer.
+
+    Una en proceso en cada etapa que retiene el audio y hasta `capacidad_cola`
+    esperando en la cola de cada una de las que siguen a la captura.
+    """
+    return etapas + (etapas - 1) * capacidad_cola
+
+
+BUFERES_TURNO = buferes_turno()
+DUPLEX = os.environ.get("ELISA_DUPLEX", "0") == "1"
+# Bloques de la latencia estimada que se dejan dentro de la cola del filtro,
+# por si el dispositivo informa de una latencia mayor que la real
+BLOQUES_MARGEN_ECO = 2
+# Margen sobre la duración pedida para esperar el audio antes de dar el dispositivo por perdido
+SEGUNDOS_MARGEN_CAPTURA = 2.0
+# Cada cuánto se revisan los cortes del flujo
+SEGUNDOS_VIGILANCIA = 10
+
+
+class BufferCircular:
+    """Búfer circular de un escritor y varios lectores, sin bloqueos.
+
+    El escritor copia los datos y después publica el nuevo total de muestras
+    escritas; los lectores trabajan con posiciones absolutas y comprueban al
+    terminar que el escritor no ha sobrescrito lo que estaban copiando. Como
+    el escritor copia antes de publicar, las `margen` muestras más antiguas
+    (al menos un bloque) pueden estar sobrescribiéndose y no se leen.
+    """
+
+    def __init__(self, capacidad, margen=0):
+        self.datos = np.zeros(capacidad, dtype=np.float32)
+        self.capacidad = capacidad
+        self.margen = margen
+        self.escritas = 0
+
+    def primera_valida(self):
+        """Posición más antigua que se puede leer sin carrera con el escritor."""
+        return max(0, self.escritas - self.capacidad + self.margen)
+
+    def escribir(self, bloque):
+        n = len(bloque)
+        if n > self.capacidad:
+            bloque = bloque[-self.capacidad:]
+            self.escritas += n - self.capacidad
+            n = self.capacidad
+        inicio = self.escritas % self.capacidad
+        primera = min(n, self.capacidad - inicio)
+        self.datos[inicio:inicio + primera] = bloque[:primera]
+        self.datos[:n - primera] = bloque[primera:]
+        self.escritas += n
+
+    def leer(self, desde, hasta, destino):
+        """Copia las muestras [desde, hasta) en `destino`. Devuelve False si ya se perdieron."""
+        n = hasta - desde
+        if desde < self.primera_valida() or hasta > self.escritas:
+            return False
+        inicio = desde % self.capacidad
+        primera = min(n, self.capacidad - inicio)
+        destino[:primera] = self.datos[inicio:inicio + primera]
+        destino[primera:n] = self.datos[:n - primera]
+        # Si el escritor alcanzó lo copiado (o el bloque que estaba escribiendo), no vale
+        return desde >= self.primera_valida()
+
+
+class ServicioCaptura:
+    def __init__(self, samplerate=MUESTREO_WHISPER, segundos_previos=SEGUNDOS_PREVIOS,
+                 segundos_maximos=SEGUNDOS_MAXIMOS, segundos_buffer=SEGUNDOS_BUFFER,
+                 blocksize=0, latency=None, device=None, buferes_turno=BUFERES_TURNO,
+                 duplex=DUPLEX):
+        self.samplerate = samplerate
+        self.segundos_previos = segundos_previos
+        self.duplex = duplex
+        # El cancelador trabaja con bloques de tamaño fijo
+        self.blocksize = MUESTRAS_BLOQUE if duplex else blocksize
+        self.latency = latency
+        self.device = device
+        # Sin bloque ni latencia explícitos se usa (y se reajusta) lo calibrado para el dispositivo
+        self.autoajuste = latencia_audio.ACTIVO and not blocksize and latency is None
+        self._clave = None
+        self.buffer = BufferCircular(int(segundos_buffer * samplerate))
+        # Búferes de turno preasignados (grabación y audio procesado), usados en rotación
+        muestras_turno = int((segundos_maximos + segundos_previos) * samplerate)
+        self._turnos = [np.zeros(muestras_turno, dtype=np.float32) for _ in range(buferes_turno)]
+        self._auxiliares = [np.zeros(muestras_turno, dtype=np.float32) for _ in range(buferes_turno)]
+        self._siguiente = 0
+        self.desbordes = 0
+        self.desbordes_salida = 0
+        self.reajustes = 0
+        # Recibe el resumen de cortes (ver `xruns`) cuando aparecen cortes nuevos
+        self.al_desbordar = None
+        self.eco = None
+        # [audio, muestras ya enviadas, evento de fin] de la reproducción en curso
+        self._salida = None
+        self._stream = None
+        self._lock = threading.Lock()
+        self._parar_vigilancia = threading.Event()
+        self._vigilancia = None
+
+    @property
+    def activo(self):
+        return self._stream is not None and self._stream.active
+
+    def iniciar(self):
+        """Abre el dispositivo de entrada si aún no está abierto."""
+        with self._lock:
+            if self.activo:
+                return
+            import sounddevice as sd
+            if self.autoajuste and self._clave is None:
+                self._aplicar_ajuste(sd)
+            self._abrir(sd)
+            if self._vigilancia is None:
+                self._parar_vigilancia.clear()
+                self._vigilancia = threading.Thread(target=self._vigilar, name="vigilancia-audio",
+                                                    daemon=True)
+                self._vigilancia.start()
+
+    def _abrir(self, sd):
+        self.buffer.margen = self.blocksize or MUESTRAS_MARGEN_VARIABLE
+        if self.duplex:
+            self._iniciar_duplex(sd)
+            return
+        self._stream = sd.InputStream(samplerate=self.samplerate, channels=1, dtype='float32',
+                                      blocksize=self.blocksize, latency=self.latency,
+                                      device=self.device, callback=self._callback)
+        self._stream.start()
+        logger.info(f"Captura iniciada a {self.samplerate} Hz (bloque {self.blocksize or 'variable'}, "
+                    f"latencia {self._stream.latency:.3f}s)")
+
+    def _aplicar_ajuste(self, sd):
+        """Toma el bloque y la latencia calibrados para el dispositivo, si los hay."""
+        self._clave, ajuste = latencia_audio.ajuste_para(self.device, sd)
+        if not ajuste:
+            return
+        if ajuste.get("samplerate", self.samplerate) != self.samplerate:
+            logger.info(f"El ajuste de audio de {self._clave} es para otra frecuencia; no se aplica")
+            return
+        # En dúplex el bloque lo fija el cancelador de eco; la latencia sí se aplica
+        if not self.duplex:
+            self.blocksize = ajuste["blocksize"]
+        self.latency = ajuste["latency"]
+        logger.info(f"Ajuste de audio de {self._clave}: bloque {self.blocksize}, "
+                    f"latencia {self.latency} ({ajuste.get('origen')}, {ajuste.get('fecha')})")
+
+    def _iniciar_duplex(self, sd):
+        self._stream = sd.Stream(samplerate=self.samplerate, channels=1, dtype='float32',
+                                 blocksize=self.blocksize, latency=self.latency,
+                                 device=self.device, callback=self._callback_duplex)
+        entrada, salida = self._stream.latency
+        # Lo que se escribe en la salida tarda ~ (salida + entrada) en volver por el micrófono
+        retardo = int((entrada + salida) * self.samplerate) - BLOQUES_MARGEN_ECO * self.blocksize
+        self.eco = CanceladorEco(self.blocksize, retardo=retardo, samplerate=self.samplerate)
+        self._stream.start()
+        logger.info(f"Captura dúplex iniciada a {self.samplerate} Hz (latencia entrada "
+                    f"{entrada:.3f}s, salida {salida:.3f}s; retardo del eco {self.eco.retardo} muestras)")
+
+    def detener(self):
+        if self._vigilancia is not None:
+            self._parar_vigilancia.set()
+            self._vigilancia.join()
+            self._vigilancia = None
+        if self._stream is not None:
+            self.callar()
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+            logger.info(f"Cortes de audio: {self.desbordes} de entrada, {self.desbordes_salida} "
+                        f"de salida ({self.reajustes} reajustes)")
+            if self.eco is not None:
+                e = self.eco.estadisticas()
+                logger.info(f"Cancelación de eco: {e['bloques']} bloques, {e['ms_medio']:.3f} ms "
+                            f"de media (p99 {e['ms_p99']:.3f} ms, {e['fraccion_tiempo_real']:.1%} "
+                            f"del tiempo real), atenuación {e['erle_db']:.1f} dB")
+
+    def xruns(self):
+        """Resumen de los cortes del flujo y del ajuste con que está abierto."""
+        latencia = self._stream.latency if self._stream is not None else None
+        return {"entrada": self.desbordes, "salida": self.desbordes_salida,
+                "reajustes": self.reajustes, "bloque": self.blocksize,
+                "latencia": max(latencia) if isinstance(latencia, tuple) else latencia}
+
+    def _vigilar(self):
+        anteriores = 0
+        while not self._parar_vigilancia.wait(SEGUNDOS_VIGILANCIA):
+            total = self.desbordes + self.desbordes_salida
+            nuevos = total - anteriores
+            anteriores = total
+            if not nuevos:
+                continue
+            resumen = self.xruns()
+            logger.warning(f"{nuevos} cortes de audio en {SEGUNDOS_VIGILANCIA}s (total: "
+                           f"{resumen['entrada']} de entrada, {resumen['salida']} de salida; "
+                           f"bloque {resumen['bloque']}, latencia {resumen['latencia']})")
+            if self.al_desbordar is not None:
+                try:
+                    self.al_desbordar(resumen)
+                except Exception as e:
+                    logger.error(f"Error al avisar de cortes de audio: {e}")
+            if self.autoajuste and nuevos * 60 / SEGUNDOS_VIGILANCIA >= latencia_audio.XRUNS_MINUTO_REAJUSTE:
+                self._reajustar()
+
+    def _reajustar(self):
+        """Vuelve a abrir el flujo con más bloque y latencia y guarda el ajuste para el dispositivo."""
+        with self._lock:
+            # No cortar una reproducción dúplex en curso; se reintentará en la siguiente revisión
+            if self._stream is None or self._salida is not None:
+                return
+            latencia = self._stream.latency
+            siguiente = latencia_audio.mas_holgado(
+                self.blocksize, max(latencia) if isinstance(latencia, tuple) else latencia,
+                fijo=self.duplex)
+            if siguiente is None:
+                return
+            import sounddevice as sd
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+            self.blocksize, self.latency = siguiente
+            self._abrir(sd)
+            self.reajustes += 1
+        logger.warning(f"Captura reabierta con bloque {self.blocksize} y latencia {self.latency:.3f}s "
+                       f"por cortes repetidos")
+        if self._clave is not None:
+            try:
+                anterior = latencia_audio.cargar_ajustes().get(self._clave, {})
+                latencia_audio.guardar_ajuste(self._clave, {
+                    **anterior,
+                    "blocksize": self.blocksize,
+                    "latency": self.latency,
+                    "samplerate": self.samplerate,
+                    "buffer_mezclador": latencia_audio.buffer_mezclador(self.blocksize or MUESTRAS_BLOQUE,
+                                                                       self.samplerate),
+                    "origen": "en marcha",
+                    "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+                })
+            except OSError as e:
+                logger.warning(f"No se pudo guardar el ajuste de audio: {e}")
+
+    def _callback(self, indata, frames, tiempo, status):
+        if status.input_overflow:
+            self.desbordes += 1
+        self.buffer.escribir(indata[:, 0])
+
+    def _callback_duplex(self, indata, outdata, frames, tiempo, status):
+        if status.input_overflow:
+            self.desbordes += 1
+        if status.output_underflow:
+            self.desbordes_salida += 1
+        referencia = outdata[:, 0]
+        salida = self._salida
+        if salida is None:
+            referencia[:] = 0
+        else:
+            audio, enviadas, terminado = salida
+            n = min(frames, len(audio) - enviadas)
+            referencia[:n] = audio[enviadas:enviadas + n]
+            referencia[n:] = 0
+            salida[1] = enviadas + n
+            if salida[1] >= len(audio):
+                self._salida = None
+                terminado.set()
+        if frames == self.eco.n:
+            self.buffer.escribir(self.eco.procesar(indata[:, 0], referencia))
+        else:
+            self.buffer.escribir(indata[:, 0])
+
+    def reproducir(self, audio, cancelacion=None):
+        """Reproduce `audio` (mono, a `samplerate`) por la salida dúplex y espera a que termine.
+
+        Devuelve False si se detuvo porque se activó el evento `cancelacion`.
+        """
+        self.iniciar()
+        terminado = threading.Event()
+        self._salida = [np.asarray(audio, dtype=np.float32), 0, terminado]
+        while not terminado.wait(0.05):
+            if cancelacion is not None and cancelacion.is_set():
+                self.callar()
+                return False
+        return True
+
+    def callar(self):
+        """Corta la reproducción dúplex en curso."""
+        salida = self._salida
+        self._salida = None
+        if salida is not None:
+            salida[2].set()
+
+    def estadisticas_eco(self):
+        return self.eco.estadisticas() if self.eco is not None else None
+
+    def posicion(self):
+        """Posición absoluta (en muestras) del final del audio capturado."""
+        return self.buffer.escritas
+
+    def esperar(self, posicion, timeout=None, cancelacion=None):
+        """Espera a que se haya capturado hasta `posicion`.
+
+        Devuelve False si vence el plazo o se activa el evento `cancelacion`.
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        while self.buffer.escritas < posicion:
+            if limite is not None and time.monotonic() > limite:
+                return False
+            if cancelacion is not None and cancelacion.is_set():
+                return False
+            time.sleep(0.01)
+        return True
+
+    def inicio_grabacion(self, segundos_previos=None):
+        """Posición de inicio de una grabación que empieza ahora, con pre-roll."""
+        previos = self.segundos_previos if segundos_previos is None else segundos_previos
+        return max(self.posicion() - int(previos * self.samplerate), self.buffer.primera_valida())
+
+    def extraer(self, desde, hasta, cancelacion=None):
+        """Copia [desde, hasta) al siguiente búfer de turno y devuelve una vista.
+
+        La vista es válida hasta que se hayan hecho `buferes_turno` extracciones más.
+        Si el audio no llega a tiempo (dispositivo perdido) o se activa
+        `cancelacion`, lanza RuntimeError.
+        """
+        turno = self._turnos[self._siguiente]
+        self._siguiente = (self._siguiente + 1) % len(self._turnos)
+        hasta = min(hasta, desde + len(turno))
+        faltan = max(0, hasta - self.posicion()) / self.samplerate
+        if not self.esperar(hasta, faltan + SEGUNDOS_MARGEN_CAPTURA, cancelacion):
+            if cancelacion is not None and cancelacion.is_set():
+                raise RuntimeError("Grabación cancelada antes de capturar todo el audio")
+            raise RuntimeError(f"El dispositivo de entrada dejó de enviar audio "
+                               f"({self.buffer.escritas - desde} de {hasta - desde} muestras)")
+        destino = turno[:hasta - desde]
+        if not self.buffer.leer(desde, hasta, destino):
+            raise RuntimeError("Audio perdido: la grabación superó el búfer de captura")
+        return destino
+
+    def auxiliar_para(self, audio):
+        """Búfer auxiliar del mismo tamaño que `audio`, ligado a su búfer de turno."""
+        for turno, auxiliar in zip(self._turnos, self._auxiliares):
+            if audio.base is turno or audio is turno:
+                return auxiliar[:len(audio)]
+        return np.empty_like(audio)
+
+    def bloques(self, tamano, continuar=lambda: True, desde=None):
+        """Itera bloques consecutivos de `tamano` muestras desde `desde` (por defecto, ahora).
+
+        Produce pares (posición final, bloque). El bloque se reutiliza entre
+        iteraciones; hay que copiarlo si se quiere conservar.
+        """
+        posicion = self.posicion() if desde is None else desde
+        bloque = np.zeros(tamano, dtype=np.float32)
+        while continuar():
+            if not self.esperar(posicion + tamano, timeout=0.5):
+                continue
+            if not self.buffer.leer(posicion, posicion + tamano, bloque):
+                # El lector se quedó atrás: saltar al audio más reciente
+                posicion = self.posicion() - tamano
+                continue
+            posicion += tamano
+            yield posicion, bloque
@@ -0,0 +1,456 @@
+"""Cliente HTTP de Ollama con conexiones persistentes, plazos, reintentos y respaldo.
+
+Las funciones del módulo `ollama` no tienen timeout: si el servidor se cuelga
+o va saturado, el turno (y con él la interfaz) se queda esperando. Este
+cliente habla con la API REST de Ollama con un único `httpx.Client`:
+
+    - conexiones persistentes reutilizadas entre turnos (pool de httpx)
+    - un plazo por petición (ELISA_PLAZO_LLM segundos) que cubre la conexión,
+      los reintentos y todo el flujo de tokens
+    - reintentos acotados con espera exponencial y jitter ante errores de red
+      y respuestas 5xx, solo mientras no haya llegado ningún token
+    - un circuito por modelo: tras FALLOS_CIRCUITO fallos seguidos deja de
+      enviarle peticiones durante SEGUNDOS_CIRCUITO y, si la petición lo
+      admite, las desvía al modelo de respaldo (ELISA_MODELO_RESPALDO); pasado
+      ese tiempo deja pasar una petición de prueba
+    - métricas de conexiones abiertas, reintentos, plazos agotados, respaldos y
+      latencia (primer token y total)
+
+`CacheRespuestas` guarda las últimas respuestas por pregunta para poder
+contestar algo útil mientras no hay ningún modelo disponible. El servidor
+falso de ollama_falso.py permite probar todo sin Ollama.
+"""
+import os
+import json
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from especulacion import normalizar
+
+logger = logging.getLogger(__name__)
+
+HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
+PLAZO = float(os.environ.get("ELISA_PLAZO_LLM", "60"))
+MODELO_RESPALDO = os.environ.get("ELISA_MODELO_RESPALDO") or None
+SEGUNDOS_CONEXION = 2.0
+REINTENTOS = 2
+# Espera antes del reintento n: uniforme entre 0 y min(ESPERA_MAXIMA, ESPERA_BASE * 2**n)
+ESPERA_BASE = 0.25
+ESPERA_MAXIMA = 2.0
+FALLOS_CIRCUITO = 3
+SEGUNDOS_CIRCUITO = 30.0
+MUESTRAS_LATENCIA = 256
+
+
+class ErrorOllama(Exception):
+    """La petición a Ollama no se pudo completar."""
+
+
+class PlazoAgotado(ErrorOllama):
+    """La petición superó su plazo."""
+
+
+class CircuitoAbierto(ErrorOllama):
+    """El modelo (y su respaldo) no están aceptando peticiones."""
+
+
+class ErrorRespuesta(ErrorOllama):
+    def __init__(self, estado, mensaje):
+        super().__init__(f"HTTP {estado}: {mensaje}")
+        self.estado = estado
+
+
+def _completar(url):
+    return url if "://" in url else f"http://{url}"
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))]
+
+
+class Circuito:
+    """Cortacircuitos de un modelo: cerrado, abierto o semiabierto (una petición de prueba)."""
+
+    def __init__(self, modelo, fallos_max=FALLOS_CIRCUITO, segundos=SEGUNDOS_CIRCUITO):
+        self.modelo = modelo
+        self.fallos_max = fallos_max
+        self.segundos = segundos
+        self.estado = "cerrado"
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+        self.aperturas = 0
+        self._lock = threading.Lock()
+
+    def permite(self):
+        with self._lock:
+            if self.estado == "cerrado":
+                return True
+            if self.estado == "abierto" and time.monotonic() >= self.abierto_hasta:
+                self.estado = "semiabierto"
+                logger.info(f"Circuito de {self.modelo} semiabierto: probando una petición")
+                return True
+            return False
+
+    def exito(self):
+        with self._lock:
+            if self.estado != "cerrado":
+                logger.info(f"Circuito de {self.modelo} cerrado: el modelo responde de nuevo")
+            self.estado = "cerrado"
+            self.fallos = 0
+
+    def liberar(self):
+        """Suelta la petición de prueba del semiabierto sin contarla como fallo
+        (p. ej. interrumpida por quien llama); la siguiente vuelve a probar."""
+        with self._lock:
+            if self.estado == "semiabierto":
+                self.estado = "abierto"
+                self.abierto_hasta = 0.0
+
+    def fallo(self):
+        with self._lock:
+            self.fallos += 1
+            if self.estado == "semiabierto" or \
+                    (self.estado == "cerrado" and self.fallos >= self.fallos_max):
+                self.estado = "abierto"
+                self.abierto_hasta = time.monotonic() + self.segundos
+                self.aperturas += 1
+                logger.warning(f"Circuito de {self.modelo} abierto tras {self.fallos} fallos "
+                               f"seguidos; sin peticiones durante {self.segundos:g}s")
+
+
+class MetricasOllama:
+    def __init__(self):
+        self.peticiones = 0
+        self.errores = 0
+        self.reintentos = 0
+        self.plazos_agotados = 0
+        self.respaldos = 0
+        self.rechazadas = 0
+        self.conexiones = 0
+        self.primer_token = deque(maxlen=MUESTRAS_LATENCIA)
+        self.total = deque(maxlen=MUESTRAS_LATENCIA)
+        self.lock = threading.Lock()
+
+    def sumar(self, campo, n=1):
+        with self.lock:
+            setattr(self, campo, getattr(self, campo) + n)
+
+    def informe(self):
+        with self.lock:
+            return {
+                "peticiones": self.peticiones,
+                "errores": self.errores,
+                "reintentos": self.reintentos,
+                "plazos_agotados": self.plazos_agotados,
+                "respaldos": self.respaldos,
+                "rechazadas": self.rechazadas,
+                "conexiones_nuevas": self.conexiones,
+                "primer_token_p50": percentil(self.primer_token, 50),
+                "primer_token_p95": percentil(self.primer_token, 95),
+                "total_p50": percentil(self.total, 50),
+                "total_p95": percentil(self.total, 95),
+            }
+
+
+class ClienteOllama:
+    def __init__(self, host=HOST, plazo=PLAZO, reintentos=REINTENTOS,
+                 modelo_respaldo=MODELO_RESPALDO, fallos_circuito=FALLOS_CIRCUITO,
+                 segundos_circuito=SEGUNDOS_CIRCUITO):
+        import httpx
+        self._httpx = httpx
+        self.host = _completar(host)
+        self.plazo = plazo
+        self.reintentos = reintentos
+        self.modelo_respaldo = modelo_respaldo
+        self.fallos_circuito = fallos_circuito
+        self.segundos_circuito = segundos_circuito
+        self.metricas = MetricasOllama()
+        self._circuitos = {}
+        self._lock = threading.Lock()
+        # Pocas conexiones: las usan un turno, la especulación y el gestor de memoria
+        self.http = httpx.Client(
+            base_url=self.host,
+            limits=httpx.Limits(max_connections=8, max_keepalive_connections=4,
+                                keepalive_expiry=120))
+
+    def circuito(self, modelo):
+        with self._lock:
+            if modelo not in self._circuitos:
+                self._circuitos[modelo] = Circuito(modelo, self.fallos_circuito,
+                                                   self.segundos_circuito)
+            return self._circuitos[modelo]
+
+    def cerrar(self):
+        informe = self.metricas.informe()
+        if informe["peticiones"]:
+            logger.info("Cliente de Ollama: " + ", ".join(
+                f"{k} {v:.2f}s" if isinstance(v, float) else f"{k} {v}"
+                for k, v in informe.items() if v is not None))
+        self.http.close()
+
+    # --- API (mismas formas de respuesta que el módulo ollama) ---
+
+    def generate(self, model, prompt, stream=False, options=None, keep_alive=None,
+                 plazo=None, respaldo=False):
+        """Genera con `model`. Con stream=True devuelve un iterador de fragmentos con `close()`.
+
+        `respaldo` permite desviar la petición al modelo de respaldo mientras el
+        circuito de `model` está abierto.
+        """
+        cuerpo = {"model": model, "prompt": prompt, "stream": stream}
+        if options:
+            cuerpo["options"] = options
+        if keep_alive is not None:
+            cuerpo["keep_alive"] = keep_alive
+        limite = time.monotonic() + (plazo or self.plazo)
+        if stream:
+            return self._flujo(cuerpo, limite, respaldo)
+        respuesta, _ = self._peticion("/api/generate", cuerpo, limite, respaldo)
+        return respuesta
+
+    def embeddings(self, model, prompt, keep_alive=None, plazo=None):
+        cuerpo = {"model": model, "prompt": prompt}
+        if keep_alive is not None:
+            cuerpo["keep_alive"] = keep_alive
+        respuesta, _ = self._peticion("/api/embeddings", cuerpo,
+                                      time.monotonic() + (plazo or self.plazo))
+        return respuesta
+
+    def ps(self, plazo=SEGUNDOS_CONEXION):
+        """Modelos cargados en Ollama. Sin reintentos ni circuito: es solo una consulta."""
+        try:
+            respuesta = self.http.get("/api/ps", timeout=plazo, extensions=self._extensiones())
+        except self._httpx.TransportError as e:
+            raise ErrorOllama(f"No se pudo consultar Ollama: {e}") from e
+        self._comprobar(respuesta)
+        return respuesta.json()
+
+    # --- Plazos, reintentos y circuito ---
+
+    def _extensiones(self):
+        return {"trace": self._traza}
+
+    def _traza(self, evento, info):
+        # httpcore anuncia cada conexión nueva; las reutilizadas no pasan por aquí
+        if evento in ("connection.connect_tcp.complete", "connection.connect_unix_socket.complete"):
+            self.metricas.sumar("conexiones")
+
+    def _timeout(self, restante):
+        return self._httpx.Timeout(restante, connect=min(SEGUNDOS_CONEXION, restante))
+
+    def _comprobar(self, respuesta):
+        if respuesta.status_code >= 400:
+            respuesta.read()
+            try:
+                mensaje = respuesta.json().get("error", respuesta.text)
+            except ValueError:
+                mensaje = respuesta.text
+            respuesta.close()
+            raise ErrorRespuesta(respuesta.status_code, mensaje)
+
+    def _elegir_modelo(self, modelo, respaldo):
+        if self.circuito(modelo).permite():
+            return modelo
+        if respaldo and self.modelo_respaldo and self.modelo_respaldo != modelo and \
+                self.circuito(self.modelo_respaldo).permite():
+            self.metricas.sumar("respaldos")
+            logger.info(f"{modelo} no disponible: se usa el modelo de respaldo {self.modelo_respaldo}")
+            return self.modelo_respaldo
+        self.metricas.sumar("rechazadas")
+        raise CircuitoAbierto(f"El circuito de {modelo} está abierto")
+
+    def _reintentar(self, cuerpo, limite, respaldo, intentar, confirmar=True):
+        """Llama a `intentar(cuerpo, restante)` hasta que funcione, se agoten los
+        reintentos o el plazo. Devuelve su resultado.
+
+        Deja en `cuerpo["model"]` el modelo usado. Con `confirmar=False` el
+        éxito no se anota en el circuito: lo hace quien termina de leer la respuesta.
+        """
+        modelo_pedido = cuerpo["model"]
+        for intento in range(self.reintentos + 1):
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                self.metricas.sumar("plazos_agotados")
+                raise PlazoAgotado(f"Plazo agotado tras {intento} intentos")
+            cuerpo["model"] = self._elegir_modelo(modelo_pedido, respaldo)
+            circuito = self.circuito(cuerpo["model"])
+            self.metricas.sumar("peticiones")
+            try:
+                resultado = intentar(cuerpo, restante)
+            except ErrorRespuesta as e:
+                self.metricas.sumar("errores")
+                if e.estado < 500:
+                    # Errores del cliente (modelo inexistente, petición mal formada): no se
+                    # repiten, pero el servidor responde, así que cuentan como éxito del circuito
+                    circuito.exito()
+                    raise
+                circuito.fallo()
+                error = e
+            except self._httpx.TimeoutException as e:
+                self.metricas.sumar("errores")
+                circuito.fallo()
+                error = e
+                if limite - time.monotonic() <= 0:
+                    self.metricas.sumar("plazos_agotados")
+                    raise PlazoAgotado(f"{cuerpo['model']} no respondió a tiempo") from e
+            except self._httpx.TransportError as e:
+                self.metricas.sumar("errores")
+                circuito.fallo()
+                error = e
+            except Exception:
+                # Cualquier otro error también resuelve la petición de prueba del semiabierto
+                self.metricas.sumar("errores")
+                circuito.fallo()
+                raise
+            except BaseException:
+                # Interrupciones (KeyboardInterrupt, GeneratorExit): no dicen nada del modelo
+                circuito.liberar()
+                raise
+            else:
+                if confirmar:
+                    circuito.exito()
+                return resultado
+            espera = random.uniform(0, min(ESPERA_MAXIMA, ESPERA_BASE * 2 ** intento))
+            if intento == self.reintentos or time.monotonic() + espera >= limite:
+                break
+            logger.warning(f"Fallo en la petición a {cuerpo['model']} ({error}); "
+                           f"reintento en {espera:.2f}s")
+            self.metricas.sumar("reintentos")
+            time.sleep(espera)
+        raise ErrorOllama(f"{cuerpo['model']} falló tras {intento + 1} intentos: {error}") from error
+
+    def _peticion(self, ruta, cuerpo, limite, respaldo=False):
+        inicio = time.perf_counter()
+
+        def intentar(cuerpo, restante):
+            respuesta = self.http.post(ruta, json=cuerpo, timeout=self._timeout(restante),
+                                       extensions=self._extensiones())
+            self._comprobar(respuesta)
+            return respuesta.json()
+
+        resultado = self._reintentar(dict(cuerpo), limite, respaldo, intentar)
+        duracion = time.perf_counter() - inicio
+        with self.metricas.lock:
+            self.metricas.primer_token.append(duracion)
+            self.metricas.total.append(duracion)
+        return resultado, duracion
+
+    def _flujo(self, cuerpo, limite, respaldo):
+        inicio = time.perf_counter()
+
+        def intentar(cuerpo, restante):
+            # Se reintenta hasta recibir el primer fragmento; después ya no se puede
+            peticion = self.http.build_request("POST", "/api/generate", json=cuerpo,
+                                               timeout=self._timeout(restante),
+                                               extensions=self._extensiones())
+            respuesta = self.http.send(peticion, stream=True)
+            try:
+                self._comprobar(respuesta)
+                lineas = respuesta.iter_lines()
+                primera = next((linea for linea in lineas if linea.strip()), None)
+                # Un error como primer fragmento o un cuerpo vacío son fallos del modelo
+                if primera is None:
+                    raise ErrorOllama(f"{cuerpo['model']} respondió sin ningún fragmento")
+                primera = json.loads(primera)
+                if "error" in primera:
+                    raise ErrorOllama(primera["error"])
+            except BaseException:
+                respuesta.close()
+                raise
+            return respuesta, lineas, primera
+
+        peticion = dict(cuerpo)
+        respuesta, lineas, primera = self._reintentar(peticion, limite, respaldo, intentar,
+                                                      confirmar=False)
+        # Los errores a mitad del flujo también cuentan para el circuito del modelo usado
+        circuito = self.circuito(peticion["model"])
+        resuelto = False
+        with self.metricas.lock:
+            self.metricas.primer_token.append(time.perf_counter() - inicio)
+        try:
+            yield primera
+            for linea in lineas:
+                if not linea.strip():
+                    continue
+                if time.monotonic() > limite:
+                    self.metricas.sumar("plazos_agotados")
+                    raise PlazoAgotado(f"{cuerpo['model']} no terminó la respuesta a tiempo")
+                fragmento = json.loads(linea)
+                if "error" in fragmento:
+                    raise ErrorOllama(fragmento["error"])
+                if fragmento.get("done"):
+                    # Leer el final del cuerpo antes de entregar el último fragmento:
+                    # quien consume suele cerrar ahí, y sin leerlo la conexión no se reutiliza
+                    for _ in lineas:
+                        pass
+                yield fragmento
+            with self.metricas.lock:
+                self.metricas.total.append(time.perf_counter() - inicio)
+        except self._httpx.TimeoutException as e:
+            circuito.fallo()
+            resuelto = True
+            self.metricas.sumar("plazos_agotados")
+            raise PlazoAgotado(f"{cuerpo['model']} dejó de responder a mitad de la respuesta") from e
+        except self._httpx.TransportError as e:
+            circuito.fallo()
+            resuelto = True
+            raise ErrorOllama(f"Conexión con Ollama perdida: {e}") from e
+        except Exception:
+            circuito.fallo()
+            resuelto = True
+            raise
+        finally:
+            # Terminado o abandonado por quien consume (cancelación): el modelo respondió
+            if not resuelto:
+                circuito.exito()
+            # Cerrar la respuesta detiene la generación en el servidor
+            respuesta.close()
+
+
+class CacheRespuestas:
+    """Últimas respuestas por pregunta normalizada, para contestar sin LLM."""
+
+    def __init__(self, maximo=128):
+        self.maximo = maximo
+        self._respuestas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def guardar(self, pregunta, respuesta):
+        clave = normalizar(pregunta)
+        with self._lock:
+            self._respuestas[clave] = respuesta
+            self._respuestas.move_to_end(clave)
+            while len(self._respuestas) > self.maximo:
+                self._respuestas.popitem(last=False)
+
+    def buscar(self, pregunta):
+        with self._lock:
+            return self._respuestas.get(normalizar(pregunta))
+
+
+_cliente = None
+_lock_cliente = threading.Lock()
+
+
+def obtener_cliente():
+    """Cliente compartido por todo el proceso, creado en el primer uso."""
+    global _cliente
+    with _lock_cliente:
+        if _cliente is None:
+            _cliente = ClienteOllama()
+        return _cliente
+
+
+def cerrar_cliente():
+    """Cierra el cliente compartido (registrando sus métricas); el siguiente uso crea otro."""
+    global _cliente
+    with _lock_cliente:
+        cliente, _cliente = _cliente, None
+    if cliente is not None:
+        cliente.cerrar()
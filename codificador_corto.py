@@ -0,0 +1,126 @@
+"""Codificador de Whisper con contexto recortado para órdenes cortas.
+
+Whisper rellena toda entrada hasta una ventana de 30 s, así que una orden de
+2 s cuesta lo mismo en el codificador que una ventana completa. En este modo
+el audio se rellena solo hasta la cubeta (múltiplo de `SEGUNDOS_CUBETA`) que
+lo contiene y el codificador usa la parte correspondiente de sus embeddings
+posicionales, con lo que el número de tramas del codificador (y su coste)
+es proporcional a la duración de la orden.
+
+El modelo se entrenó siempre con 30 s de contexto: si la decodificación corta
+no pasa los mismos controles de calidad que usa Whisper (compresión y
+log-probabilidad media), se repite por el camino normal.
+
+Se activa con ELISA_CODIFICADOR_CORTO=1. `benchmark_codificador.py` compara
+precisión y latencia de ambos caminos.
+"""
+import os
+import math
+import types
+import logging
+
+import numpy as np
+
+from silencio import MIN_LOGPROB, MAX_COMPRESION
+
+logger = logging.getLogger(__name__)
+
+ACTIVO = os.environ.get("ELISA_CODIFICADOR_CORTO", "0") == "1"
+SEGUNDOS_CUBETA = 2
+# Por debajo de este contexto la precisión cae demasiado
+SEGUNDOS_MINIMOS = 4
+SEGUNDOS_VENTANA = 30
+# Silencio que se deja tras la voz para que el modelo cierre la frase
+SEGUNDOS_MARGEN = 0.5
+MUESTREO = 16000
+
+
+def segundos_cubeta(segundos):
+    """Duración del contexto que se usa para un audio de `segundos`."""
+    cubeta = math.ceil((segundos + SEGUNDOS_MARGEN) / SEGUNDOS_CUBETA) * SEGUNDOS_CUBETA
+    return min(max(cubeta, SEGUNDOS_MINIMOS), SEGUNDOS_VENTANA)
+
+
+def _forward_recortado(self, x):
+    """AudioEncoder.forward con los embeddings posicionales recortados a la entrada."""
+    import torch.nn.functional as F
+    x = F.gelu(self.conv1(x))
+    x = F.gelu(self.conv2(x))
+    x = x.permute(0, 2, 1)
+    x = (x + self.positional_embedding[:x.shape[1]]).to(x.dtype)
+    for block in self.blocks:
+        x = block(x)
+    return self.ln_post(x)
+
+
+def preparar(modelo):
+    """Permite al codificador de `modelo` aceptar menos de 30 s. Idempotente.
+
+    Con la ventana completa el resultado es idéntico al del codificador original.
+    """
+    codificador = modelo.encoder
+    if not getattr(codificador, "contexto_variable", False):
+        codificador.forward = types.MethodType(_forward_recortado, codificador)
+        codificador.contexto_variable = True
+    return modelo
+
+
+def _opciones_decodificacion(opciones):
+    """Convierte las opciones de `transcribe` en las de `DecodingOptions`."""
+    import whisper
+    opciones = dict(opciones)
+    temperatura = opciones.pop("temperature", 0.0)
+    if isinstance(temperatura, (list, tuple)):
+        temperatura = temperatura[0]
+    # Whisper no admite beam_size y best_of a la vez: depende de la temperatura
+    if temperatura > 0:
+        opciones.pop("beam_size", None)
+    else:
+        opciones.pop("best_of", None)
+    for clave in ("verbose", "condition_on_previous_text", "initial_prompt",
+                  "compression_ratio_threshold", "logprob_threshold", "no_speech_threshold",
+                  "word_timestamps"):
+        opciones.pop(clave, None)
+    return whisper.DecodingOptions(temperature=temperatura, without_timestamps=True, **opciones)
+
+
+def decodificar_corto(modelo, audio, **opciones):
+    """Decodifica `audio` (16 kHz, < 30 s) con el contexto recortado.
+
+    Devuelve (resultado con el formato de `transcribe`, segundos de contexto).
+    """
+    import whisper
+    preparar(modelo)
+    duracion = len(audio) / MUESTREO
+    contexto = segundos_cubeta(duracion)
+    audio = whisper.pad_or_trim(np.asarray(audio, dtype=np.float32), contexto * MUESTREO)
+    mel = whisper.log_mel_spectrogram(audio, getattr(modelo.dims, "n_mels", 80))
+    resultado = whisper.decode(modelo, mel.to(modelo.device), _opciones_decodificacion(opciones))
+    segmento = {
+        "id": 0,
+        "start": 0.0,
+        "end": duracion,
+        "text": resultado.text,
+        "avg_logprob": resultado.avg_logprob,
+        "compression_ratio": resultado.compression_ratio,
+        "no_speech_prob": resultado.no_speech_prob,
+    }
+    return {"text": resultado.text, "segments": [segmento]}, contexto
+
+
+def aceptable(resultado):
+    """Mismos criterios que usa Whisper para repetir una decodificación."""
+    segmento = resultado["segments"][0]
+    return segmento["compression_ratio"] <= MAX_COMPRESION and segmento["avg_logprob"] >= MIN_LOGPROB
+
+
+def transcribir(modelo, audio, **opciones):
+    """Como `modelo.transcribe`, pero con el codificador recortado si el audio es corto."""
+    if len(audio) >= SEGUNDOS_VENTANA * MUESTREO:
+        return modelo.transcribe(audio, **opciones)
+    resultado, contexto = decodificar_corto(modelo, audio, **opciones)
+    if aceptable(resultado):
+        logger.debug(f"Codificador corto: {len(audio) / MUESTREO:.1f}s de audio con {contexto}s de contexto")
+        return resultado
+    logger.info("Decodificación corta poco fiable; se repite con la ventana completa")
+    return modelo.transcribe(audio, **opciones)
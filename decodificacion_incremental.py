@@ -0,0 +1,231 @@
+"""Decodificación incremental de Whisper sobre un búfer de audio que crece.
+
+Transcribir de nuevo todo el búfer en cada paso (lo que haría un modo en vivo
+sobre `transcribe`) repite el codificador sobre el mismo audio una y otra
+vez. Aquí se guarda el trabajo hecho sobre el prefijo ya confirmado:
+
+    codificador  el audio se codifica en trozos de SEGUNDOS_TROZO, cada uno
+                 con su parte de los embeddings posicionales (como en
+                 codificador_corto.py) y atención solo dentro del trozo. Las
+                 salidas de los trozos completos y sus claves/valores de la
+                 atención cruzada de cada capa del decodificador se guardan;
+                 en cada paso solo se codifica lo nuevo (el último trozo, aún
+                 incompleto, se recalcula).
+    decodificador  los tokens en los que coinciden dos hipótesis seguidas se
+                 confirman y se guardan sus claves/valores de autoatención; en
+                 cada paso solo se decodifican tokens nuevos a partir de ahí.
+
+El coste por paso depende del audio y los tokens nuevos, no de la longitud del
+búfer (salvo la atención, que es una parte pequeña). Es una aproximación: el
+codificador no ve más allá de su trozo y los tokens confirmados no se
+recalculan con el audio posterior, así que la transcripción final de un turno
+debe seguir haciéndose por el camino normal. Decodificación voraz, sin
+marcas de tiempo y con un máximo de 30 s por búfer (luego hay que reiniciar).
+`benchmark_incremental.py` compara el coste por paso con el de transcribir
+todo de nuevo.
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MUESTREO = 16000
+SEGUNDOS_TROZO = 2
+SEGUNDOS_VENTANA = 30
+# Muestras por trama del codificador (paso del mel de 160 y la segunda convolución con paso 2)
+MUESTRAS_TRAMA = 320
+# Tokens que se generan como mucho en cada paso
+MAX_TOKENS_PASO = 64
+
+
+class DecodificadorIncremental:
+    """Transcripción en pasos de un búfer de audio que crece.
+
+    Usa los módulos de `modelo` directamente: no debe coincidir con otra
+    decodificación del mismo modelo (`transcribe` instala ganchos en ellos).
+    """
+
+    def __init__(self, modelo, language="spanish", task="transcribe",
+                 segundos_trozo=SEGUNDOS_TROZO):
+        import torch
+        import whisper
+        from whisper.tokenizer import get_tokenizer, TO_LANGUAGE_CODE
+        self._torch = torch
+        self._whisper = whisper
+        self.modelo = modelo
+        self.muestras_trozo = int(segundos_trozo * MUESTREO)
+        idioma = TO_LANGUAGE_CODE.get(language, language)
+        self.tokenizer = get_tokenizer(modelo.is_multilingual, num_languages=modelo.num_languages,
+                                       language=idioma, task=task)
+        self.prefijo = list(self.tokenizer.sot_sequence_including_notimestamps)
+        vocabulario = modelo.dims.n_vocab
+        # Ni símbolos que no son voz ni tokens especiales (van todos tras el de fin) ni marcas de tiempo
+        self._suprimir = torch.zeros(vocabulario, dtype=torch.bool, device=modelo.device)
+        self._suprimir[list(self.tokenizer.non_speech_tokens)] = True
+        self._suprimir[self.tokenizer.eot + 1:] = True
+        self.reiniciar()
+
+    def reiniciar(self):
+        """Vacía el búfer y todo lo guardado, para empezar otro segmento de audio."""
+        self.audio = np.zeros(0, dtype=np.float32)
+        # Trozos completos ya codificados: salidas del codificador y K/V cruzadas por capa
+        self._rasgos = []
+        self._cruzadas = [([], []) for _ in self.modelo.decoder.blocks]
+        # Tokens confirmados (tras el prefijo) y K/V de autoatención de todos menos el último
+        self.confirmados = []
+        self._propias = None
+        self._anterior = []
+        self.pasos = 0
+
+    @property
+    def segundos(self):
+        return len(self.audio) / MUESTREO
+
+    @property
+    def lleno(self):
+        return len(self.audio) >= SEGUNDOS_VENTANA * MUESTREO
+
+    def agregar(self, audio):
+        """Añade audio (16 kHz) al búfer. Devuelve False si no cupo entero."""
+        audio = np.asarray(audio, dtype=np.float32)
+        hueco = SEGUNDOS_VENTANA * MUESTREO - len(self.audio)
+        self.audio = np.concatenate((self.audio, audio[:hueco]))
+        return len(audio) <= hueco
+
+    # --- Codificador por trozos ---
+
+    def _codificar(self, audio, desplazamiento):
+        """Salida del codificador para `audio`, con los embeddings posicionales desde `desplazamiento`."""
+        import torch.nn.functional as F
+        codificador = self.modelo.encoder
+        mel = self._whisper.log_mel_spectrogram(audio, self.modelo.dims.n_mels)[:, :-1]
+        x = mel.unsqueeze(0).to(self.modelo.device)
+        x = F.gelu(codificador.conv1(x))
+        x = F.gelu(codificador.conv2(x))
+        x = x.permute(0, 2, 1)
+        x = x + codificador.positional_embedding[desplazamiento:desplazamiento + x.shape[1]]
+        for bloque in codificador.blocks:
+            x = bloque(x)
+        return codificador.ln_post(x)
+
+    def _proyectar(self, rasgos):
+        """K/V de la atención cruzada de cada capa del decodificador para `rasgos`."""
+        return [(b.cross_attn.key(rasgos), b.cross_attn.value(rasgos))
+                for b in self.modelo.decoder.blocks]
+
+    def _actualizar_rasgos(self):
+        """Codifica los trozos completos nuevos y devuelve las K/V cruzadas de todo el búfer."""
+        torch = self._torch
+        tramas_trozo = self.muestras_trozo // MUESTRAS_TRAMA
+        while (len(self._rasgos) + 1) * self.muestras_trozo <= len(self.audio):
+            i = len(self._rasgos)
+            trozo = self.audio[i * self.muestras_trozo:(i + 1) * self.muestras_trozo]
+            rasgos = self._codificar(trozo, i * tramas_trozo)
+            self._rasgos.append(rasgos)
+            for (claves, valores), (k, v) in zip(self._cruzadas, self._proyectar(rasgos)):
+                claves.append(k)
+                valores.append(v)
+
+        cruzadas = [(list(claves), list(valores)) for claves, valores in self._cruzadas]
+        inicio = len(self._rasgos) * self.muestras_trozo
+        resto = len(self.audio) - inicio
+        if resto >= MUESTRAS_TRAMA:
+            # El trozo incompleto se recalcula en cada paso; cuesta como mucho un trozo
+            cola = self.audio[inicio:inicio + resto // MUESTRAS_TRAMA * MUESTRAS_TRAMA]
+            rasgos = self._codificar(cola, len(self._rasgos) * tramas_trozo)
+            for (claves, valores), (k, v) in zip(cruzadas, self._proyectar(rasgos)):
+                claves.append(k)
+                valores.append(v)
+        if not cruzadas[0][0]:
+            return []
+        return [(torch.cat(claves, dim=1), torch.cat(valores, dim=1)) for claves, valores in cruzadas]
+
+    # --- Decodificador con caché de autoatención ---
+
+    def _avanzar(self, tokens, cruzadas, propias):
+        """Pasa `tokens` por el decodificador tras los ya guardados en `propias`.
+
+        Devuelve (logits del último token, K/V de autoatención ampliadas).
+        """
+        torch = self._torch
+        decodificador = self.modelo.decoder
+        desplazamiento = 0 if propias is None else propias[0][0].shape[1]
+        x = torch.tensor([tokens], device=self.modelo.device)
+        x = decodificador.token_embedding(x) + \
+            decodificador.positional_embedding[desplazamiento:desplazamiento + len(tokens)]
+        # La máscara causal solo hace falta al pasar varios tokens de golpe (desde el principio)
+        mascara = decodificador.mask if len(tokens) > 1 else None
+        nuevas = []
+        for i, bloque in enumerate(decodificador.blocks):
+            atencion = bloque.attn
+            h = bloque.attn_ln(x)
+            k, v = atencion.key(h), atencion.value(h)
+            if propias is not None:
+                k = torch.cat((propias[i][0], k), dim=1)
+                v = torch.cat((propias[i][1], v), dim=1)
+            nuevas.append((k, v))
+            x = x + atencion.out(atencion.qkv_attention(atencion.query(h), k, v, mascara)[0])
+            cruzada = bloque.cross_attn
+            h = bloque.cross_attn_ln(x)
+            x = x + cruzada.out(cruzada.qkv_attention(cruzada.query(h), *cruzadas[i])[0])
+            x = x + bloque.mlp(bloque.mlp_ln(x))
+        x = decodificador.ln(x[:, -1])
+        logits = (x @ decodificador.token_embedding.weight.to(x.dtype).T).float()[0]
+        return logits, nuevas
+
+    def _siguiente(self, logits, primero):
+        logits = logits.masked_fill(self._suprimir, -np.inf)
+        if primero:
+            # Como SuppressBlank de Whisper: no empezar con espacio ni con el fin
+            logits[self.tokenizer.encode(" ") + [self.tokenizer.eot]] = -np.inf
+        return int(logits.argmax())
+
+    def decodificar(self, final=False):
+        """Decodifica lo que haya en el búfer reutilizando lo confirmado.
+
+        Devuelve (texto confirmado, texto provisional). Los tokens en los que
+        coinciden esta hipótesis y la anterior pasan a confirmados; con
+        `final=True` se confirma toda la hipótesis.
+        """
+        torch = self._torch
+        limite = self.modelo.dims.n_text_ctx // 2
+        with torch.no_grad():
+            cruzadas = self._actualizar_rasgos()
+            if not cruzadas:
+                return "", ""
+            # El último token conocido se pasa de nuevo para obtener el siguiente
+            conocidos = self.prefijo + self.confirmados
+            if self._propias is None:
+                logits, propias = self._avanzar(conocidos, cruzadas, None)
+            else:
+                logits, propias = self._avanzar(conocidos[-1:], cruzadas, self._propias)
+            hipotesis = []
+            while len(hipotesis) < MAX_TOKENS_PASO and len(conocidos) + len(hipotesis) < limite:
+                token = self._siguiente(logits, not self.confirmados and not hipotesis)
+                if token == self.tokenizer.eot:
+                    break
+                hipotesis.append(token)
+                logits, propias = self._avanzar([token], cruzadas, propias)
+        self.pasos += 1
+
+        if final:
+            acordados = len(hipotesis)
+        else:
+            acordados = 0
+            while acordados < min(len(hipotesis), len(self._anterior)) and \
+                    hipotesis[acordados] == self._anterior[acordados]:
+                acordados += 1
+        self._anterior = hipotesis[acordados:]
+        self.confirmados += hipotesis[:acordados]
+        # `propias` cubre los tokens conocidos y toda la hipótesis; se guardan los
+        # confirmados menos el último, que se vuelve a pasar en el siguiente paso
+        n = len(conocidos) + acordados - 1
+        self._propias = [(k[:, :n], v[:, :n]) for k, v in propias]
+        return (self.tokenizer.decode(self.confirmados).strip(),
+                self.tokenizer.decode(hipotesis[acordados:]).strip())
+
+    def texto(self):
+        """Transcripción completa del búfer (confirma todo lo pendiente)."""
+        confirmado, _ = self.decodificar(final=True)
+        return confirmado
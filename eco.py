@@ -0,0 +1,165 @@
+"""Cancelación de eco acústico para escuchar mientras ELISA habla.
+
+Filtro adaptativo NLMS por bloques en el dominio de la frecuencia con
+particiones (PBFDAF, solapamiento y descarte): la señal que se reproduce por
+el altavoz es la referencia y el filtro estima el eco que llega al micrófono
+para restarlo. Todo el cálculo de un bloque está vectorizado sobre las
+particiones, de modo que el coste es de unas pocas FFT por bloque.
+
+La adaptación se congela mientras habla el usuario (detector de Geigel) para
+que la voz cercana no desajuste el filtro, y sin reproducción el micrófono
+pasa sin procesar. El coste de cada bloque se mide; si la media supera el
+presupuesto de tiempo real, se reduce la longitud de la cola del filtro.
+"""
+import time
+import logging
+from collections import deque
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MUESTRAS_BLOQUE = 256
+# Cola de eco cubierta por el filtro: particiones × bloque (8 × 16 ms = 128 ms a 16 kHz)
+PARTICIONES = 8
+# Con más de ~0.3 el filtro diverge al sumarse el paso de todas las particiones
+PASO = 0.2
+# Olvido de la estimación de potencia de la referencia por bin
+OLVIDO_POTENCIA = 0.9
+# Geigel: hay voz cercana si el micrófono supera esta fracción del pico de la referencia
+UMBRAL_GEIGEL = 0.5
+BLOQUES_RETENCION = 8
+# Fracción del periodo de un bloque que puede gastar la cancelación
+PRESUPUESTO = 0.5
+BLOQUES_REVISION = 256
+PARTICIONES_MINIMAS = 2
+
+
+class CanceladorEco:
+    def __init__(self, muestras_bloque=MUESTRAS_BLOQUE, particiones=PARTICIONES, retardo=0,
+                 paso=PASO, samplerate=16000, presupuesto=PRESUPUESTO):
+        """`retardo` son las muestras entre que un bloque se reproduce y su eco
+        empieza a llegar al micrófono (latencias de salida y entrada)."""
+        self.n = muestras_bloque
+        self.particiones = particiones
+        self.paso = paso
+        self.periodo = muestras_bloque / samplerate
+        self.presupuesto = presupuesto
+        bins = self.n + 1
+        self.W = np.zeros((particiones, bins), dtype=np.complex128)
+        self.X = np.zeros((particiones, bins), dtype=np.complex128)
+        self.potencia = np.full(bins, 1e-6)
+        self._cabeza = 0
+        self._ventana = np.zeros(2 * self.n)
+        self._error = np.zeros(2 * self.n)
+        self.salida = np.zeros(self.n, dtype=np.float32)
+
+        # Línea de retardo de la referencia (en bloques completos más un resto)
+        self.retardo = max(0, int(retardo))
+        self._linea = np.zeros(self.retardo + self.n, dtype=np.float64)
+        self._retenidos = deque([0.0] * (particiones + 1), maxlen=particiones + 1)
+        self._bloques_sin_referencia = particiones + 1
+        self._retencion = 0
+
+        self.bloques = 0
+        self.tiempos = deque(maxlen=BLOQUES_REVISION)
+        self.tiempo_max = 0.0
+        self._energia_mic = 0.0
+        self._energia_salida = 0.0
+
+    def procesar(self, mic, referencia):
+        """Devuelve el bloque del micrófono sin eco (vista reutilizada en cada llamada)."""
+        inicio = time.perf_counter()
+        n = self.n
+        ref = self._retrasar(referencia)
+        pico = float(np.max(np.abs(ref)))
+        self._retenidos.append(pico)
+        self._bloques_sin_referencia = 0 if pico > 0 else self._bloques_sin_referencia + 1
+
+        if self._bloques_sin_referencia > self.particiones:
+            # Nada reproducido dentro de la cola del filtro: no hay eco que quitar
+            self.salida[:] = mic
+            self._medir(inicio)
+            return self.salida
+
+        # Espectro de los dos últimos bloques de referencia (solapamiento y descarte)
+        self._ventana[:n] = self._ventana[n:]
+        self._ventana[n:] = ref
+        self._cabeza = (self._cabeza - 1) % self.particiones
+        self.X[self._cabeza] = np.fft.rfft(self._ventana)
+        self.potencia *= OLVIDO_POTENCIA
+        self.potencia += (1 - OLVIDO_POTENCIA) * (self.X[self._cabeza].real ** 2 +
+                                                  self.X[self._cabeza].imag ** 2)
+
+        # W está en orden de antigüedad: W[p] multiplica la referencia de hace p bloques
+        orden = (self._cabeza + np.arange(self.particiones)) % self.particiones
+        X = self.X[orden]
+        eco = np.fft.irfft(np.einsum("pk,pk->k", self.W, X))[n:]
+        error = mic - eco
+        self.salida[:] = error
+
+        if self._hay_voz_cercana(mic):
+            self._retencion = BLOQUES_RETENCION
+        elif self._retencion:
+            self._retencion -= 1
+        else:
+            self._error[n:] = error
+            E = np.fft.rfft(self._error)
+            gradiente = np.conj(X) * (E / (self.potencia + 1e-10))
+            # Restricción de gradiente: cada partición solo puede modelar n muestras
+            g = np.fft.irfft(gradiente, axis=1)
+            g[:, n:] = 0
+            self.W += self.paso * np.fft.rfft(g, axis=1)
+            # Atenuación medida solo con eco sin voz cercana
+            self._energia_mic = 0.99 * self._energia_mic + 0.01 * float(np.dot(mic, mic))
+            self._energia_salida = 0.99 * self._energia_salida + 0.01 * float(np.dot(error, error))
+
+        self._medir(inicio)
+        return self.salida
+
+    def _retrasar(self, referencia):
+        if not self.retardo:
+            return np.asarray(referencia, dtype=np.float64)
+        self._linea[:-self.n] = self._linea[self.n:]
+        self._linea[-self.n:] = referencia
+        return self._linea[:self.n]
+
+    def _hay_voz_cercana(self, mic):
+        return float(np.max(np.abs(mic))) > UMBRAL_GEIGEL * max(self._retenidos)
+
+    def _medir(self, inicio):
+        duracion = time.perf_counter() - inicio
+        self.tiempos.append(duracion)
+        self.tiempo_max = max(self.tiempo_max, duracion)
+        self.bloques += 1
+        if self.bloques % BLOQUES_REVISION == 0:
+            self._vigilar_presupuesto()
+
+    def _vigilar_presupuesto(self):
+        """Acorta la cola del filtro si la media de coste no cabe en el presupuesto."""
+        media = sum(self.tiempos) / len(self.tiempos)
+        if media <= self.presupuesto * self.periodo or self.particiones <= PARTICIONES_MINIMAS:
+            return
+        particiones = max(PARTICIONES_MINIMAS, self.particiones // 2)
+        logger.warning(f"Cancelación de eco: {media * 1e3:.2f} ms por bloque de "
+                       f"{self.periodo * 1e3:.0f} ms; cola reducida a {particiones} particiones")
+        orden = (self._cabeza + np.arange(self.particiones)) % self.particiones
+        self.W = np.ascontiguousarray(self.W[:particiones])
+        self.X = np.ascontiguousarray(self.X[orden][:particiones])
+        self._cabeza = 0
+        self.particiones = particiones
+        self._retenidos = deque(list(self._retenidos)[-(particiones + 1):], maxlen=particiones + 1)
+
+    def estadisticas(self):
+        """Coste por bloque (ms), fracción del tiempo real y atenuación del eco (dB)."""
+        tiempos = np.array(self.tiempos) if self.tiempos else np.zeros(1)
+        erle = 10 * np.log10((self._energia_mic + 1e-12) / (self._energia_salida + 1e-12))
+        return {
+            "bloques": self.bloques,
+            "ms_medio": float(tiempos.mean() * 1e3),
+            "ms_p99": float(np.percentile(tiempos, 99) * 1e3),
+            "ms_max": self.tiempo_max * 1e3,
+            "fraccion_tiempo_real": float(tiempos.mean() / self.periodo),
+            "particiones": self.particiones,
+            "erle_db": float(erle),
+        }
@@ -1,38 +1,25 @@
 import os
-import webbrowser
-import whisper
-import ollama
-from gtts import gTTS
-import sounddevice as sd
-import soundfile as sf
-import uuid
 import logging
-import pygame
-import subprocess
-import threading
 from PIL import Image, ImageSequence
 import time
 from queue import Queue
-import numpy as np
 import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                             QLabel, QPushButton, QTextEdit, QLineEdit, QScrollArea, QFrame)
-from PyQt5.QtCore import Qt, QTimer, QSize, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QTimer, QSize, QObject, QEvent, pyqtSignal
 from PyQt5.QtGui import QMovie, QPixmap, QIcon, QFont, QPalette, QColor, QTextCursor
 
-# Configuración de logging
-logging.basicConfig(level=logging.DEBUG, 
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+from registro import configurar_registro
+from asistente import Asistente
+from pipeline import Estado
+from reparto_cpu import REPARTO
+
+# Configuración de logging (cola no bloqueante, ver registro.py)
+configurar_registro()
 
 # Obtener la ruta del directorio del script
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Configuración de Whisper - Modelo pequeño para mejor rendimiento
-whisper_model = whisper.load_model("small")
-
-# Configuración de Ollama
-model_name = "mistral"
-
 # Nombre del asistente
 nombre_asistente = "ELISA"
 
@@ -40,143 +27,50 @@ nombre_asistente = "ELISA"
 nombre_usuario = None
 
 # Rutas relativas para archivos
-temp_audio_path = os.path.join(script_dir, "grabacion.wav")
 conversacion_path = os.path.join(script_dir, "conversacion.txt")
-temp_audio_dir = os.path.join(script_dir, "temp_audio")
-os.makedirs(temp_audio_dir, exist_ok=True)
 
 # Configuración del avatar GIF
 avatar_quieto_gif = os.path.join(script_dir, "assets", "avatar_quieto.gif")
 avatar_hablando_gif = os.path.join(script_dir, "assets", "avatar_hablando.gif")
 
-# Estados
-class Estado:
-    QUIETO = 0
-    GRABANDO = 1
-    HABLANDO = 2
+# Intervalo de refresco de la conversación (un fotograma a 60 Hz)
+MS_FOTOGRAMA = 16
 
-class WorkerGrabacion(QThread):
-    finished = pyqtSignal(str)
-    update_status = pyqtSignal(str)
-    
-    def __init__(self, whisper_model, temp_audio_path):
-        super().__init__()
-        self.whisper_model = whisper_model
-        self.temp_audio_path = temp_audio_path
-        self._is_running = True
-    
-    def run(self):
-        try:
-            samplerate = 44100
-            duration = 15
-            
-            self.update_status.emit(f"Grabando... {duration}s")
-            audio = sd.rec(int(duration * samplerate), 
-                         samplerate=samplerate, 
-                         channels=1,
-                         dtype='float32')
-            
-            for i in range(duration, 0, -1):
-                if not self._is_running:
-                    return
-                self.update_status.emit(f"Grabando... {i}s")
-                time.sleep(1)
-            
-            sd.wait()
-            audio = self.mejorar_calidad_audio(audio, samplerate)
-            sf.write(self.temp_audio_path, audio, samplerate)
-            
-            texto = self.transcribir_audio()
-            self.finished.emit(texto)
-        except Exception as e:
-            logging.error(f"Error en grabación: {e}")
-            self.finished.emit("")
-    
-    def mejorar_calidad_audio(self, audio, samplerate):
-        try:
-            if audio.ndim > 1:
-                audio = np.mean(audio, axis=1)
-            audio = audio / np.max(np.abs(audio))
-            audio = np.convolve(audio, np.ones(5)/5, mode='same')
-            return audio
-        except Exception as e:
-            logging.error(f"Error al mejorar audio: {e}")
-            return audio
-    
-    def transcribir_audio(self):
-        if not os.path.exists(self.temp_audio_path):
-            logging.error(f"Archivo {self.temp_audio_path} no existe")
-            return ""
-        
-        try:
-            resultado = self.whisper_model.transcribe(
-                self.temp_audio_path,
-                language="spanish",
-                task="transcribe",
-                fp16=False,
-                temperature=0.2,
-                best_of=3,
-                beam_size=5
-            )
-            
-            texto = resultado["text"].strip()
-            texto = self.limpiar_texto_transcrito(texto)
-            return texto
-        except Exception as e:
-            logging.error(f"Error al transcribir: {e}")
-            return ""
-    
-    def limpiar_texto_transcrito(self, texto):
-        palabras_confusas = ["喝水", "thereel", "谢谢", "gracias", "thank you"]
-        for palabra in palabras_confusas:
-            texto = texto.replace(palabra, "")
-        texto = ' '.join(texto.strip().split())
-        return texto.capitalize()
-    
-    def stop(self):
-        self._is_running = False
-        self.terminate()
+# Mensajes que se conservan en la ventana; el historial completo queda en conversacion.txt
+MAX_MENSAJES = int(os.environ.get("ELISA_MAX_MENSAJES", "500"))
 
-class WorkerHablar(QThread):
-    finished = pyqtSignal()
-    
-    def __init__(self, texto, temp_audio_dir):
-        super().__init__()
-        self.texto = texto
-        self.temp_audio_dir = temp_audio_dir
-    
-    def run(self):
-        try:
-            temp_tts_path = os.path.join(self.temp_audio_dir, f"respuesta_{uuid.uuid4()}.mp3")
-            tts = gTTS(text=self.texto, lang="es", slow=False)
-            tts.save(temp_tts_path)
-            
-            pygame.mixer.music.load(temp_tts_path)
-            pygame.mixer.music.play()
-            
-            while pygame.mixer.music.get_busy():
-                time.sleep(0.1)
-                
-        except Exception as e:
-            logging.error(f"Error al reproducir audio: {e}")
-        finally:
-            try:
-                os.remove(temp_tts_path)
-            except:
-                pass
-            self.finished.emit()
+TEXTO_ESTADOS = {
+    Estado.QUIETO: "",
+    Estado.ESCUCHANDO: "Escuchando...",
+    Estado.GRABANDO: "Grabando...",
+    Estado.PENSANDO: "Pensando...",
+    Estado.HABLANDO: "Hablando...",
+}
+
+class PuenteEventos(QObject):
+    """Lleva al hilo de Qt los eventos que el pipeline publica desde sus hilos."""
+    evento = pyqtSignal(object)
 
 class AsistenteVirtualGUI(QMainWindow):
     def __init__(self):
         super().__init__()
         self.nombre_asistente = nombre_asistente
-        self.nombre_usuario = nombre_usuario
         self.estado_actual = Estado.QUIETO
         self.conversacion = []
         
-        # Inicializar pygame para audio
-        pygame.init()
-        pygame.mixer.init()
+        # Los mensajes y el estado se acumulan y se muestran una vez por fotograma
+        self._mensajes_pendientes = []
+        self._estado_pendiente = None
+        self.temporizador_refresco = QTimer(self)
+        self.temporizador_refresco.setSingleShot(True)
+        self.temporizador_refresco.setInterval(MS_FOTOGRAMA)
+        self.temporizador_refresco.timeout.connect(self._refrescar)
+        
+        # El asistente ejecuta los turnos; la ventana solo muestra sus eventos
+        self.asistente = Asistente(self.nombre_asistente, nombre_usuario)
+        self.puente = PuenteEventos()
+        self.puente.evento.connect(self.procesar_evento)
+        self.asistente.suscribir(self.puente.evento.emit)
         
         self.setWindowTitle(f"Asistente Virtual {self.nombre_asistente}")
         self.setGeometry(100, 100, 1000, 700)
@@ -185,7 +79,7 @@ class AsistenteVirtualGUI(QMainWindow):
         # Mensaje inicial
         mensaje_inicial = f"{self.nombre_asistente}: ¡Hola! Soy {self.nombre_asistente}, tu asistente virtual. ¿Cómo te llamas?"
         self.agregar_mensaje(mensaje_inicial)
-        self.hablar(mensaje_inicial.split(": ")[1])
+        self.asistente.decir(mensaje_inicial.split(": ")[1])
     
     def setup_ui(self):
         # Widget central
@@ -205,6 +99,9 @@ class AsistenteVirtualGUI(QMainWindow):
         self.avatar_label = QLabel()
         self.avatar_label.setAlignment(Qt.AlignCenter)
         self.avatar_label.setFixedSize(300, 500)
+        # Un QMovie por GIF, creado la primera vez que se muestra
+        self.avatar_movies = {}
+        self.avatar_movie = None
         self.cargar_avatar(avatar_quieto_gif)
         
         # Estilo del avatar
@@ -227,6 +124,14 @@ class AsistenteVirtualGUI(QMainWindow):
         self.grabar_button.clicked.connect(self.iniciar_grabacion)
         
         left_column.addWidget(self.grabar_button)
+        
+        # Botón de modo manos libres (palabra clave)
+        self.manos_libres_button = QPushButton("Manos libres")
+        self.manos_libres_button.setCheckable(True)
+        self.manos_libres_button.setFixedHeight(40)
+        self.manos_libres_button.toggled.connect(self.alternar_manos_libres)
+        
+        left_column.addWidget(self.manos_libres_button)
         left_column.addStretch()
         
         # Columna derecha (conversación)
@@ -249,6 +154,8 @@ class AsistenteVirtualGUI(QMainWindow):
         # Área de conversación
         self.conversacion_text = QTextEdit()
         self.conversacion_text.setReadOnly(True)
+        # Cada mensaje ocupa un bloque del documento: los más antiguos se descartan
+        self.conversacion_text.document().setMaximumBlockCount(MAX_MENSAJES)
         self.conversacion_text.setStyleSheet("""
             QTextEdit {
                 background-color: white;
@@ -349,32 +256,99 @@ class AsistenteVirtualGUI(QMainWindow):
     def cargar_avatar(self, gif_path):
         """Carga el GIF del avatar en el QLabel."""
         if os.path.exists(gif_path):
-            self.avatar_movie = QMovie(gif_path)
-            self.avatar_movie.setScaledSize(QSize(300, 500))
-            self.avatar_label.setMovie(self.avatar_movie)
-            self.avatar_movie.start()
+            movie = self.avatar_movies.get(gif_path)
+            if movie is None:
+                movie = QMovie(gif_path)
+                movie.setScaledSize(QSize(300, 500))
+                self.avatar_movies[gif_path] = movie
+            if movie is self.avatar_movie:
+                return
+            if self.avatar_movie is not None:
+                self.avatar_movie.stop()
+            self.avatar_movie = movie
+            self.avatar_label.setMovie(movie)
+            movie.start()
         else:
             # Avatar por defecto si no se encuentra el GIF
             pixmap = QPixmap(300, 500)
             pixmap.fill(QColor(234, 234, 234))
             self.avatar_label.setPixmap(pixmap)
+            self.avatar_movie = None
     
     def cambiar_estado_avatar(self, estado):
         """Cambia el estado del avatar (quieto/hablando)."""
-        if estado == Estado.QUIETO:
-            self.cargar_avatar(avatar_quieto_gif)
-        elif estado in (Estado.GRABANDO, Estado.HABLANDO):
+        self.estado_actual = estado
+        if estado in (Estado.GRABANDO, Estado.HABLANDO):
             self.cargar_avatar(avatar_hablando_gif)
+        else:
+            self.cargar_avatar(avatar_quieto_gif)
+    
+    def procesar_evento(self, evento):
+        """Actualiza la interfaz con un evento del pipeline (en el hilo de Qt)."""
+        if evento.tipo == "estado":
+            estado = evento.datos["estado"]
+            self.cambiar_estado_avatar(estado)
+            grabando = estado == Estado.GRABANDO
+            self.grabar_button.setEnabled(not grabando)
+            self.grabar_button.setText("Grabando..." if grabando else "Grabar Audio")
+            self.mostrar_estado(TEXTO_ESTADOS[estado])
+        elif evento.tipo == "progreso":
+            self.mostrar_estado(evento.datos["mensaje"])
+        elif evento.tipo == "interrumpido":
+            self.mostrar_estado("Interrumpido")
+        elif evento.tipo == "cortes_audio":
+            self.mostrar_estado(f"Cortes de audio: {evento.datos['entrada']} de entrada, "
+                                f"{evento.datos['salida']} de salida")
+        elif evento.tipo == "mensaje_usuario":
+            self.agregar_mensaje(f"Tú: {evento.datos['texto']}")
+        elif evento.tipo == "respuesta":
+            self.agregar_mensaje(f"{self.nombre_asistente}: {evento.datos['texto']}")
     
     def agregar_mensaje(self, mensaje):
-        """Agrega un mensaje a la conversación."""
+        """Agrega un mensaje a la conversación (se muestra en el siguiente fotograma)."""
         self.conversacion.append(mensaje)
-        self.guardar_conversacion(mensaje)
+        del self.conversacion[:-MAX_MENSAJES]
+        self._mensajes_pendientes.append(mensaje)
+        self._programar_refresco()
+    
+    def mostrar_estado(self, texto):
+        """Muestra un estado transitorio en la barra de estado, fuera de la conversación."""
+        self._estado_pendiente = texto
+        self._programar_refresco()
+    
+    def _programar_refresco(self):
+        if not self.temporizador_refresco.isActive():
+            self.temporizador_refresco.start()
+    
+    def _refrescar(self):
+        """Vuelca de una vez lo acumulado desde el último fotograma."""
+        if self._estado_pendiente is not None:
+            self.statusBar().showMessage(self._estado_pendiente)
+            self._estado_pendiente = None
+        if not self._mensajes_pendientes:
+            return
+        mensajes, self._mensajes_pendientes = self._mensajes_pendientes, []
+        self.guardar_conversacion(mensajes)
+        
+        # Seguir el final solo si el usuario no se ha desplazado hacia arriba
+        barra = self.conversacion_text.verticalScrollBar()
+        al_final = barra.value() >= barra.maximum() - 4
         
-        # Formatear el mensaje con color diferente para el asistente/usuario
+        # Un solo bloque de edición: el documento se maqueta una vez por fotograma
         cursor = self.conversacion_text.textCursor()
         cursor.movePosition(QTextCursor.End)
-        
+        separador = not self.conversacion_text.document().isEmpty()
+        cursor.beginEditBlock()
+        for mensaje in mensajes:
+            self._insertar_mensaje(cursor, mensaje, separador)
+            separador = True
+        cursor.endEditBlock()
+        
+        if al_final:
+            barra.setValue(barra.maximum())
+    
+    def _insertar_mensaje(self, cursor, mensaje, separador):
+        """Inserta un mensaje, con color diferente para el asistente/usuario."""
         if mensaje.startswith(f"{self.nombre_asistente}:"):
             color = "#2c3e50"  # Azul oscuro para el asistente
             prefix = f"<b>{self.nombre_asistente}:</b> "
@@ -385,7 +359,7 @@ class AsistenteVirtualGUI(QMainWindow):
             texto = mensaje[len("Tú:"):].strip() if mensaje.startswith("Tú:") else mensaje
         
         # Agregar separador si no es el primer mensaje
-        if self.conversacion_text.toPlainText():
+        if separador:
             cursor.insertHtml("<hr style='margin: 10px 0; border: 1px solid #eee;'>")
         
         # Insertar el mensaje formateado
@@ -394,16 +368,13 @@ class AsistenteVirtualGUI(QMainWindow):
                 {prefix}{texto}
             </div>
         """)
-        
-        # Auto-scroll
-        self.conversacion_text.verticalScrollBar().setValue(
-            self.conversacion_text.verticalScrollBar().maximum())
     
-    def guardar_conversacion(self, mensaje):
-        """Guarda la conversación en un archivo de texto."""
+    def guardar_conversacion(self, mensajes):
+        """Guarda los mensajes en el archivo de la conversación."""
         try:
+            marca = time.strftime('%Y-%m-%d %H:%M:%S')
             with open(conversacion_path, "a", encoding="utf-8") as archivo:
-                archivo.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {mensaje}\n")
+                archivo.write("".join(f"{marca} - {mensaje}\n" for mensaje in mensajes))
         except Exception as e:
             logging.error(f"Error al guardar conversación: {e}")
     
@@ -414,130 +385,44 @@ class AsistenteVirtualGUI(QMainWindow):
             self.agregar_mensaje(f"Tú: {texto}")
             self.input_line.clear()
             
-            # Procesar el mensaje y obtener respuesta
-            respuesta = self.generar_respuesta(texto)
-            self.agregar_mensaje(f"{self.nombre_asistente}: {respuesta}")
-            self.hablar(respuesta)
-            
-            # Ejecutar comandos si es necesario
-            self.ejecutar_comando(texto)
+            # El pipeline genera, muestra y pronuncia la respuesta
+            if not self.asistente.enviar_texto(texto):
+                logging.warning("Pipeline lleno, mensaje descartado")
+                self.mostrar_estado("Dame un momento, aún estoy con lo anterior.")
     
     def iniciar_grabacion(self):
         """Inicia el proceso de grabación de audio."""
-        if hasattr(self, 'worker_grabacion') and self.worker_grabacion.isRunning():
+        if self.estado_actual == Estado.GRABANDO:
             return
-        
-        self.cambiar_estado_avatar(Estado.GRABANDO)
-        self.grabar_button.setEnabled(False)
-        self.grabar_button.setText("Grabando...")
-        
-        self.worker_grabacion = WorkerGrabacion(whisper_model, temp_audio_path)
-        self.worker_grabacion.finished.connect(self.finalizar_grabacion)
-        self.worker_grabacion.update_status.connect(
-            lambda msg: self.agregar_mensaje(f"{self.nombre_asistente}: {msg}"))
-        self.worker_grabacion.start()
+        self.asistente.grabar()
     
-    def finalizar_grabacion(self, texto):
-        """Finaliza el proceso de grabación y procesa el texto."""
-        self.grabar_button.setEnabled(True)
-        self.grabar_button.setText("Grabar Audio")
-        self.cambiar_estado_avatar(Estado.QUIETO)
-        
-        if texto:
-            self.agregar_mensaje(f"Tú: {texto}")
-            
-            # Generar y mostrar respuesta
-            respuesta = self.generar_respuesta(texto)
-            self.agregar_mensaje(f"{self.nombre_asistente}: {respuesta}")
-            self.hablar(respuesta)
-            
-            # Ejecutar comandos si es necesario
-            self.ejecutar_comando(texto)
-    
-    def generar_respuesta(self, texto):
-        """Genera una respuesta usando Ollama."""
-        texto_lower = texto.lower()
-        
-        # Detección de nombre
-        if self.nombre_usuario is None:
-            if "me llamo" in texto_lower:
-                self.nombre_usuario = texto_lower.split("me llamo")[-1].strip().title()
-            elif "mi nombre es" in texto_lower:
-                self.nombre_usuario = texto_lower.split("mi nombre es")[-1].strip().title()
-            elif "soy" in texto_lower:
-                self.nombre_usuario = texto_lower.split("soy")[-1].strip().title()
-            
-            if self.nombre_usuario and len(self.nombre_usuario) > 1:
-                respuesta = f"¡Mucho gusto, {self.nombre_usuario}! ¿En qué puedo ayudarte hoy?"
-                logging.info(f"Nombre detectado: {self.nombre_usuario}")
-                return respuesta
-        
-        # Generar respuesta normal
-        prompt = (
-            f"Eres {self.nombre_asistente}, un asistente virtual en español. "
-            f"{f'El usuario {self.nombre_usuario} te dice:' if self.nombre_usuario else 'Usuario:'} {texto}\n"
-            f"Responde de manera clara y concisa en español (máximo 50 palabras):"
-        )
-        
+    def alternar_manos_libres(self, activo):
+        """Activa o desactiva la escucha continua con palabra clave."""
         try:
-            respuesta = ollama.generate(
-                model=model_name,
-                prompt=prompt,
-                options={"max_tokens": 50}
-            )
-            return respuesta["response"]
+            self.asistente.activar_manos_libres(activo)
         except Exception as e:
-            logging.error(f"Error al generar respuesta: {e}")
-            return "Lo siento, no pude procesar tu solicitud."
-    
-    def hablar(self, texto):
-        """Convierte el texto en voz usando gTTS."""
-        self.cambiar_estado_avatar(Estado.HABLANDO)
-        
-        self.worker_hablar = WorkerHablar(texto, temp_audio_dir)
-        self.worker_hablar.finished.connect(
-            lambda: self.cambiar_estado_avatar(Estado.QUIETO))
-        self.worker_hablar.start()
-    
-    def ejecutar_comando(self, texto):
-        """Ejecuta comandos específicos."""
-        texto = texto.lower()
-        
-        comandos = {
-            "abrir chrome": lambda: subprocess.Popen("chrome.exe"),
-            "abrir notepad": lambda: subprocess.Popen("notepad.exe"),
-            "abrir calculadora": lambda: subprocess.Popen("calc.exe"),
-            "ir a ": lambda url: webbrowser.open(f"https://{url}" if not url.startswith(("http", "www")) else url),
-            "reproducir ": lambda cancion: webbrowser.open(f"https://www.youtube.com/results?search_query={cancion}")
-        }
-        
-        for cmd, accion in comandos.items():
-            if texto.startswith(cmd):
-                try:
-                    parametro = texto[len(cmd):].strip()
-                    if parametro:
-                        accion(parametro)
-                    else:
-                        accion()
-                    return True
-                except Exception as e:
-                    logging.error(f"Error al ejecutar comando {cmd}: {e}")
-        return False
+            logging.error(f"No se pudo cargar la palabra clave: {e}")
+            self.agregar_mensaje(f"{self.nombre_asistente}: No encuentro grabaciones de mi nombre. "
+                                 f"Ejecuta 'python palabra_clave.py --enrolar 5' para crearlas.")
+            self.manos_libres_button.setChecked(False)
     
     def limpiar_conversacion(self):
         """Limpia el área de conversación."""
         self.conversacion_text.clear()
         self.conversacion = []
+        self._mensajes_pendientes = []
+    
+    def changeEvent(self, event):
+        """Al activarse la ventana, recarga por adelantado los modelos descargados."""
+        if event.type() == QEvent.ActivationChange and self.isActiveWindow():
+            self.asistente.anticipar("ventana activa")
+        super().changeEvent(event)
     
     def closeEvent(self, event):
         """Maneja el cierre de la aplicación."""
-        if hasattr(self, 'worker_grabacion') and self.worker_grabacion.isRunning():
-            self.worker_grabacion.stop()
-        
-        if hasattr(self, 'worker_hablar') and self.worker_hablar.isRunning():
-            self.worker_hablar.terminate()
-        
-        pygame.quit()
+        self.temporizador_refresco.stop()
+        self._refrescar()
+        self.asistente.detener()
         event.accept()
 
 if __name__ == "__main__":
@@ -564,5 +449,7 @@ if __name__ == "__main__":
     app.setPalette(palette)
     
     window = AsistenteVirtualGUI()
+    # Solo el hilo de Qt: los del asistente ya están creados y no heredan la afinidad
+    REPARTO.aplicar_hilo("ui")
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,183 @@
+"""Respuesta especulativa del LLM a partir de un borrador rápido de la transcripción.
+
+El LLM no puede empezar hasta que Whisper termina de transcribir con el
+modelo del nivel actual. En modo especulativo, un hilo transcribe a la vez la
+misma orden con un modelo pequeño (ELISA_MODELO_BORRADOR, "tiny" por
+defecto) y con ese borrador prepara el prompt y empieza a generar. Cuando
+llega la transcripción buena:
+
+    - si coincide con el borrador (normalizados), la respuesta especulativa
+      se confirma y la etapa del LLM la consume con la ventaja que ya lleve
+    - si no coincide, se cancela (se cierra el flujo de Ollama) y el LLM
+      empieza de cero con el texto bueno
+    - si el borrador aún no estaba, no se especula en ese turno
+
+Se registran la tasa de aciertos y el tiempo ahorrado hasta la primera
+frase en cada acierto. Se activa con ELISA_ESPECULATIVO=1.
+"""
+import os
+import re
+import time
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+ACTIVO = os.environ.get("ELISA_ESPECULATIVO", "0") == "1"
+MODELO_BORRADOR = os.environ.get("ELISA_MODELO_BORRADOR", "tiny")
+
+
+def normalizar(texto):
+    """Minúsculas, sin tildes ni puntuación y con los espacios colapsados."""
+    texto = unicodedata.normalize("NFD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s]", " ", texto).split())
+
+
+class Especulacion:
+    """Generación del LLM a partir del borrador, en su propio hilo."""
+
+    def __init__(self, texto, vector, prompt, generar, turno):
+        self.texto = texto
+        self.vector = vector
+        self.prompt = prompt
+        self.turno = turno
+        self.inicio = time.perf_counter()
+        self.confirmada = None
+        self.primera = None
+        self._frases = []
+        self._terminada = False
+        self._error = None
+        self._cancelacion = threading.Event()
+        self._cond = threading.Condition()
+        threading.Thread(target=self._generar, args=(generar,),
+                         name="llm-especulativo", daemon=True).start()
+
+    @property
+    def cancelada(self):
+        return self._cancelacion.is_set() or self.turno.cancelado
+
+    def cancelar(self):
+        self._cancelacion.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _generar(self, generar):
+        try:
+            for frase in generar(self.prompt, lambda: self.cancelada):
+                with self._cond:
+                    if self.primera is None:
+                        self.primera = time.perf_counter()
+                    self._frases.append(frase)
+                    self._cond.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            with self._cond:
+                self._terminada = True
+                self._cond.notify_all()
+
+    def frases(self):
+        """Frases generadas, en orden, a medida que llegan."""
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self._frases) and not self._terminada and not self.cancelada:
+                    self._cond.wait(0.1)
+                if i < len(self._frases):
+                    frase = self._frases[i]
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+            i += 1
+            yield frase
+
+    def ahorro(self):
+        """Segundos que la primera frase llegó antes que sin especular."""
+        if self.confirmada is None or self.primera is None:
+            return 0.0
+        return min(self.confirmada, self.primera) - self.inicio
+
+
+class Borrador:
+    def __init__(self):
+        self.texto = None
+        self.especulacion = None
+        # Una vez resuelto el turno ya no se lanza la especulación
+        self.resuelto = False
+        self.lock = threading.Lock()
+
+
+class Especulador:
+    """Lanza y resuelve las especulaciones de los turnos de voz.
+
+    `preparar(texto)` devuelve (vector, prompt) y `generar(prompt, cancelado)`
+    produce las frases de la respuesta.
+    """
+
+    def __init__(self, preparar, generar, modelo=MODELO_BORRADOR):
+        self.preparar = preparar
+        self.generar = generar
+        self.modelo = modelo
+        self.intentos = 0
+        self.aciertos = 0
+        self.tardios = 0
+        self.ahorro_total = 0.0
+        self._lock = threading.Lock()
+
+    def lanzar(self, turno, transcribir):
+        """Transcribe el borrador con `transcribir()` en segundo plano y especula con él."""
+        borrador = Borrador()
+
+        def trabajar():
+            try:
+                texto = transcribir()
+                if not texto or turno.cancelado or borrador.resuelto:
+                    return
+                vector, prompt = self.preparar(texto)
+                with borrador.lock:
+                    if borrador.resuelto:
+                        return
+                    borrador.texto = texto
+                    borrador.especulacion = Especulacion(texto, vector, prompt, self.generar, turno)
+            except Exception as e:
+                logger.warning(f"Error en el borrador especulativo: {e}")
+
+        threading.Thread(target=trabajar, name="asr-borrador", daemon=True).start()
+        return borrador
+
+    def resolver(self, borrador, texto):
+        """Con la transcripción buena, devuelve la especulación confirmada o None."""
+        with borrador.lock:
+            borrador.resuelto = True
+            especulacion = borrador.especulacion
+        if especulacion is None:
+            with self._lock:
+                self.tardios += 1
+            logger.debug("El borrador no llegó antes que la transcripción; sin especulación")
+            return None
+        acierto = bool(texto) and normalizar(especulacion.texto) == normalizar(texto)
+        with self._lock:
+            self.intentos += 1
+            if acierto:
+                self.aciertos += 1
+            tasa = self.aciertos / self.intentos
+        if acierto:
+            especulacion.confirmada = time.perf_counter()
+            return especulacion
+        especulacion.cancelar()
+        logger.info(f"Especulación fallida ({tasa:.0%} de aciertos): "
+                    f"'{especulacion.texto}' ≠ '{texto}'")
+        return None
+
+    def registrar_acierto(self, especulacion):
+        """Anota lo ahorrado en una especulación confirmada, al entregar su primera frase."""
+        ahorro = especulacion.ahorro()
+        with self._lock:
+            self.ahorro_total += ahorro
+            aciertos, intentos, tardios = self.aciertos, self.intentos, self.tardios
+        logger.info(f"Especulación acertada: primera frase {ahorro:.2f}s antes "
+                    f"({aciertos}/{intentos} aciertos, {tardios} borradores tardíos, "
+                    f"ahorro medio {self.ahorro_total / aciertos:.2f}s)")
@@ -0,0 +1,271 @@
+"""Gestor de memoria: descarga los modelos inactivos y los recarga por adelantado.
+
+Cada recurso pesado (Whisper, el LLM y el modelo de embeddings en Ollama, el
+mezclador de audio de pygame) se registra con sus funciones de carga y
+descarga. Las etapas lo usan dentro de `usar(nombre)`, que lo recarga si hacía
+falta y apunta la última vez que se usó. Un hilo revisa periódicamente:
+
+    - si un recurso lleva más de ELISA_SEGUNDOS_INACTIVO sin usarse, se descarga
+    - si el RSS del proceso supera ELISA_PRESUPUESTO_MB, se descargan los
+      recursos de este proceso usados hace más tiempo hasta volver dentro del
+      presupuesto (los que viven en Ollama u otro proceso no lo bajan)
+
+Los modelos de Ollama se descargan con `keep_alive=0`. Para no pagar la recarga
+en el turno, `anticipar()` los vuelve a cargar en segundo plano en cuanto hay
+señales de que se van a usar (palabra clave, empezar a grabar, la ventana
+recibe el foco). Se registra la memoria liberada en cada descarga y lo que
+costó cada recarga (y cuánto de ello esperó un turno).
+"""
+import os
+import gc
+import time
+import ctypes
+import logging
+import threading
+from contextlib import contextmanager
+
+from reparto_cpu import REPARTO
+
+logger = logging.getLogger(__name__)
+
+SEGUNDOS_INACTIVO = float(os.environ.get("ELISA_SEGUNDOS_INACTIVO", "600"))
+PRESUPUESTO_MB = float(os.environ.get("ELISA_PRESUPUESTO_MB", "0"))
+SEGUNDOS_REVISION = 10
+MB = 1024 * 1024
+
+
+def rss_bytes():
+    """Memoria residente del proceso, o None si no se puede medir."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss
+        except ImportError:
+            return None
+
+
+def devolver_memoria():
+    """Recolecta basura y devuelve al sistema la memoria libre del montículo."""
+    gc.collect()
+    torch = __import__("sys").modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    try:
+        # glibc se queda con la memoria liberada si no se le pide que la devuelva
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def modelos_ollama():
+    """{nombre: bytes} de los modelos cargados en Ollama, o None si no se puede consultar."""
+    try:
+        from cliente_ollama import obtener_cliente
+        return {m["name"] if "name" in m else m["model"]: m["size"]
+                for m in obtener_cliente().ps()["models"]}
+    except Exception as e:
+        logger.debug(f"No se pudo consultar los modelos cargados en Ollama: {e}")
+        return None
+
+
+def descargar_ollama(nombres, generar):
+    """Descarga de Ollama los modelos `nombres` con keep_alive=0.
+
+    `generar(nombre)` hace la petición de descarga adecuada al tipo de modelo.
+    Devuelve los bytes liberados según Ollama, o None si no se pudo saber.
+    """
+    cargados = modelos_ollama()
+    if cargados is None:
+        for nombre in nombres:
+            generar(nombre)
+        return None
+    liberado = 0
+    for cargado, tamano in cargados.items():
+        # Ollama añade la etiqueta ":latest" a los nombres sin etiqueta
+        if cargado in nombres or cargado.split(":")[0] in nombres and cargado.endswith(":latest"):
+            generar(cargado)
+            liberado += tamano
+    return liberado
+
+
+class Recurso:
+    def __init__(self, nombre, cargar, descargar, cargado=True, local=True):
+        """`descargar()` puede devolver los bytes liberados fuera de este proceso
+        (p. ej. en Ollama); si devuelve None se mide la bajada del RSS propio.
+
+        `local` (o una función que lo diga) indica si el recurso ocupa memoria
+        de este proceso, y por tanto cuenta para el presupuesto de RSS.
+        """
+        self.nombre = nombre
+        self.cargar = cargar
+        self.descargar = descargar
+        self.cargado = cargado
+        self.local = local
+        self.en_uso = 0
+        self.ultimo_uso = time.monotonic()
+        # Serializa cargas y descargas del recurso
+        self.lock = threading.Lock()
+        self.descargas = 0
+        self.bytes_liberados = 0
+        self.recargas = 0
+        self.segundos_recarga = 0.0
+        self.segundos_espera = 0.0
+
+    def es_local(self):
+        return self.local() if callable(self.local) else self.local
+
+
+class GestorMemoria:
+    def __init__(self, segundos_inactivo=SEGUNDOS_INACTIVO, presupuesto_mb=PRESUPUESTO_MB,
+                 segundos_revision=SEGUNDOS_REVISION):
+        self.segundos_inactivo = segundos_inactivo
+        self.presupuesto = presupuesto_mb * MB
+        self.segundos_revision = segundos_revision
+        self.recursos = {}
+        self._parar = threading.Event()
+        self._hilo = None
+
+    @property
+    def keep_alive(self):
+        """Tiempo que Ollama debe mantener un modelo, acorde con el de inactividad."""
+        return f"{int(self.segundos_inactivo)}s" if self.segundos_inactivo > 0 else None
+
+    def registrar(self, nombre, cargar, descargar, cargado=True, local=True):
+        self.recursos[nombre] = Recurso(nombre, cargar, descargar, cargado, local)
+
+    def iniciar(self):
+        if self._hilo is None and (self.segundos_inactivo > 0 or self.presupuesto > 0):
+            self._hilo = threading.Thread(target=self._bucle, name="gestor-memoria", daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(2)
+            self._hilo = None
+        for recurso in self.recursos.values():
+            if recurso.descargas or recurso.recargas:
+                logger.info(f"Memoria {recurso.nombre}: {recurso.descargas} descargas, "
+                            f"{recurso.bytes_liberados / MB:.0f} MB liberados en total, "
+                            f"{recurso.recargas} recargas ({recurso.segundos_recarga:.1f}s, "
+                            f"{recurso.segundos_espera:.1f}s esperadas por los turnos)")
+
+    @contextmanager
+    def usar(self, nombre):
+        """Marca el recurso en uso mientras dura el bloque, recargándolo si hacía falta."""
+        recurso = self.recursos.get(nombre)
+        if recurso is None:
+            yield
+            return
+        inicio = time.perf_counter()
+        with recurso.lock:
+            if not recurso.cargado:
+                self._recargar(recurso, "uso")
+            recurso.en_uso += 1
+        espera = time.perf_counter() - inicio
+        # Solo cuenta como espera lo que un turno tuvo que aguardar a una (re)carga
+        if espera > 0.05:
+            recurso.segundos_espera += espera
+            logger.info(f"Turno esperó {espera:.2f}s a que se recargara {nombre}")
+        try:
+            yield
+        finally:
+            # Bajo el lock: dos turnos que terminan a la vez no pueden perder una resta
+            with recurso.lock:
+                recurso.en_uso -= 1
+                recurso.ultimo_uso = time.monotonic()
+
+    def anticipar(self, motivo):
+        """Recarga en segundo plano los recursos descargados porque se van a usar pronto."""
+        for recurso in self.recursos.values():
+            recurso.ultimo_uso = time.monotonic()
+            if not recurso.cargado:
+                threading.Thread(target=self._recargar_si_falta, args=(recurso, motivo),
+                                 name=f"recarga-{recurso.nombre}", daemon=True).start()
+
+    def _recargar_si_falta(self, recurso, motivo):
+        # Suele crearse desde la interfaz; la recarga no debe quedarse con sus núcleos
+        REPARTO.liberar_hilo()
+        with recurso.lock:
+            if not recurso.cargado:
+                self._recargar(recurso, motivo)
+
+    def _recargar(self, recurso, motivo):
+        # Llamar con recurso.lock adquirido
+        inicio = time.perf_counter()
+        try:
+            recurso.cargar()
+        except Exception as e:
+            # El uso seguirá adelante y el recurso se cargará por su cuenta si puede;
+            # sigue sin marcarse como cargado para que el siguiente uso o anticipo lo reintente
+            logger.error(f"No se pudo recargar {recurso.nombre} en "
+                         f"{time.perf_counter() - inicio:.2f}s ({motivo}): {e}")
+            return
+        duracion = time.perf_counter() - inicio
+        recurso.cargado = True
+        recurso.recargas += 1
+        recurso.segundos_recarga += duracion
+        logger.info(f"Recargado {recurso.nombre} en {duracion:.2f}s ({motivo})")
+
+    def _descargar(self, recurso, motivo):
+        with recurso.lock:
+            if not recurso.cargado or recurso.en_uso:
+                return 0
+            antes = rss_bytes()
+            try:
+                liberado = recurso.descargar()
+            except Exception as e:
+                logger.error(f"No se pudo descargar {recurso.nombre}: {e}")
+                return 0
+            devolver_memoria()
+            despues = rss_bytes()
+            if liberado is None:
+                liberado = max(0, antes - despues) if antes is not None and despues is not None else 0
+            recurso.cargado = False
+            recurso.descargas += 1
+            recurso.bytes_liberados += liberado
+        logger.info(f"Descargado {recurso.nombre} ({motivo}): {liberado / MB:.0f} MB liberados"
+                    + (f", RSS {despues / MB:.0f} MB" if despues is not None else ""))
+        return liberado
+
+    def _bucle(self):
+        while not self._parar.wait(self.segundos_revision):
+            try:
+                self.revisar()
+            except Exception as e:
+                logger.error(f"Error en el gestor de memoria: {e}")
+
+    def revisar(self):
+        """Descarga los recursos inactivos y, si se supera el presupuesto, los menos recientes."""
+        ahora = time.monotonic()
+        if self.segundos_inactivo > 0:
+            for recurso in self.recursos.values():
+                inactivo = ahora - recurso.ultimo_uso
+                if recurso.cargado and not recurso.en_uso and inactivo > self.segundos_inactivo:
+                    self._descargar(recurso, f"{inactivo / 60:.0f} min sin usarse")
+
+        if self.presupuesto > 0:
+            rss = rss_bytes()
+            if rss is None or rss <= self.presupuesto:
+                return
+            for recurso in sorted(self.recursos.values(), key=lambda r: r.ultimo_uso):
+                if recurso.cargado and not recurso.en_uso and recurso.es_local():
+                    self._descargar(recurso, f"RSS {rss / MB:.0f} MB sobre el presupuesto de "
+                                             f"{self.presupuesto / MB:.0f} MB")
+                    rss = rss_bytes()
+                    if rss is None or rss <= self.presupuesto:
+                        return
+
+    def informe(self):
+        """Estado y contadores de cada recurso."""
+        return {nombre: {
+            "cargado": r.cargado,
+            "descargas": r.descargas,
+            "mb_liberados": r.bytes_liberados / MB,
+            "recargas": r.recargas,
+            "segundos_recarga": r.segundos_recarga,
+            "segundos_espera": r.segundos_espera,
+        } for nombre, r in self.recursos.items()}
@@ -0,0 +1,115 @@
+"""Control de la longitud de las respuestas del LLM.
+
+Traduce un presupuesto de palabras (o de segundos de voz) a `num_predict` y
+`stop` para Ollama y vigila el flujo de tokens: una vez superado el
+presupuesto, corta la generación en el primer final de frase en lugar de a
+mitad de palabra. Registra los tokens generados por turno para poder
+ajustarlo.
+"""
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+MAX_PALABRAS = int(os.environ.get("ELISA_MAX_PALABRAS", "50"))
+MAX_SEGUNDOS_VOZ = float(os.environ.get("ELISA_MAX_SEGUNDOS_VOZ", "0")) or None
+# Ritmo aproximado de gTTS en español
+PALABRAS_POR_SEGUNDO = 2.5
+# Tokens por palabra en español con los tokenizadores de Mistral/Llama
+TOKENS_POR_PALABRA = 1.8
+# Holgura sobre el presupuesto para poder terminar la frase
+MARGEN = 1.5
+
+FIN_DE_FRASE = re.compile(r'[.!?…]["»)]?(?=\s)')
+# Solo marcas de turno del prompt (ver asistente.redactar_prompt): si el modelo
+# se pone a escribir el siguiente mensaje del usuario, se corta ahí
+SECUENCIAS_STOP = ["Usuario:"]
+
+
+def secuencias_stop(nombre_usuario=None):
+    """Secuencias de parada para el prefijo de turno que usa el prompt."""
+    if nombre_usuario:
+        return SECUENCIAS_STOP + [f"El usuario {nombre_usuario} te dice:"]
+    return list(SECUENCIAS_STOP)
+
+
+class GobernadorRespuesta:
+    def __init__(self, max_palabras=MAX_PALABRAS, max_segundos=MAX_SEGUNDOS_VOZ,
+                 tokens_por_palabra=TOKENS_POR_PALABRA, margen=MARGEN):
+        self.max_palabras = max_palabras
+        if max_segundos:
+            self.max_palabras = min(max_palabras, int(max_segundos * PALABRAS_POR_SEGUNDO))
+        self.tokens_por_palabra = tokens_por_palabra
+        self.margen = margen
+        self.turnos = 0
+        self.tokens_total = 0
+
+    def opciones(self, extra=None, nombre_usuario=None):
+        """Opciones de Ollama para el presupuesto actual."""
+        opciones = {
+            "num_predict": int(self.max_palabras * self.tokens_por_palabra * self.margen),
+            "stop": secuencias_stop(nombre_usuario),
+        }
+        opciones.update(extra or {})
+        return opciones
+
+    def generar(self, flujo, cancelado=None):
+        """Consume el flujo de Ollama (stream=True) y devuelve el texto gobernado."""
+        return " ".join(self.frases(flujo, cancelado))
+
+    def frases(self, flujo, cancelado=None):
+        """Recorre el flujo de Ollama (stream=True) y produce cada frase al completarse.
+
+        Cierra el flujo al cortar, lo que cierra la petición HTTP y detiene la
+        generación en el servidor. `cancelado` es una función que se consulta en
+        cada token; si devuelve True se corta sin emitir nada más.
+        """
+        texto = ""
+        emitido = 0
+        tokens = 0
+        palabras = 0
+        motivo = "fin"
+        try:
+            for fragmento in flujo:
+                if cancelado is not None and cancelado():
+                    motivo = "cancelado"
+                    break
+                texto += fragmento.get("response", "")
+                tokens += 1
+                if fragmento.get("done"):
+                    tokens = fragmento.get("eval_count", tokens)
+                    if fragmento.get("done_reason") == "length":
+                        motivo = "num_predict"
+                    break
+                # Frases completas desde lo último emitido
+                for fin in FIN_DE_FRASE.finditer(texto, emitido):
+                    frase = texto[emitido:fin.end()].strip()
+                    emitido = fin.end()
+                    if frase:
+                        palabras += len(frase.split())
+                        yield frase
+                    if palabras >= self.max_palabras:
+                        motivo = "presupuesto"
+                        break
+                if motivo == "presupuesto":
+                    break
+        finally:
+            cerrar = getattr(flujo, "close", None)
+            if cerrar is not None:
+                cerrar()
+
+        resto = texto[emitido:].strip()
+        if motivo == "fin" and resto:
+            palabras += len(resto.split())
+            yield resto
+        # Si se agotó num_predict a mitad de frase, el resto incompleto se descarta
+        # (salvo que no se haya emitido ninguna frase).
+        elif motivo == "num_predict" and resto and palabras == 0:
+            palabras += len(resto.split())
+            yield resto
+
+        self.turnos += 1
+        self.tokens_total += tokens
+        logger.info(f"Respuesta: {tokens} tokens, {palabras} palabras "
+                    f"(corte: {motivo}; media {self.tokens_total / self.turnos:.1f} tokens/turno)")
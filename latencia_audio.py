@@ -0,0 +1,414 @@
+"""Ajuste del tamaño de bloque y la latencia de los flujos de audio por dispositivo.
+
+La captura (captura.py) y el mezclador de pygame se abrían con los valores por
+defecto del sistema, que según la tarjeta y el controlador pueden ser
+demasiado justos (cortes, xruns) o dar más retardo del necesario. Aquí se
+prueban combinaciones de tamaño de bloque y latencia con un flujo dúplex:
+
+    ida y vuelta  por la salida se emiten ráfagas de ruido y se busca su eco
+                  en la entrada por correlación; hace falta un lazo entre
+                  salida y entrada (cable, dispositivo de bucle como
+                  snd-aloop o el monitor de PulseAudio, o altavoz y
+                  micrófono). Sin lazo se usa la latencia que informa el
+                  dispositivo.
+    cortes        desbordes y vacíos que el controlador marca en el callback
+                  (input_overflow, output_underflow...), por minuto.
+
+Se elige la combinación de menor retardo que no pase de XRUNS_MINUTO_MAXIMOS
+y se guarda por dispositivo en ARCHIVO_AJUSTES. ServicioCaptura la aplica al
+abrir el flujo, el mezclador de pygame usa un búfer equivalente y, en marcha,
+la captura vigila los cortes y pasa a un ajuste más holgado si se repiten.
+
+Sin lazo ni dispositivo de bucle, `--virtual` calibra contra FlujoVirtual, un
+dispositivo simulado con retardo conocido que marca un corte cuando el
+callback llega tarde: así se mide lo que aguanta este equipo con su carga
+(`--carga` añade hilos de Python que compiten por el GIL, como la
+transcripción o la interfaz).
+
+Uso:
+    python latencia_audio.py [--entrada N] [--salida N] [--segundos 3]
+    python latencia_audio.py --virtual --carga 2
+    python latencia_audio.py --listar
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+import types
+from collections import Counter
+
+import numpy as np
+
+from utilidades_audio import MUESTREO_WHISPER
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+ARCHIVO_AJUSTES = os.environ.get("ELISA_AJUSTES_AUDIO", os.path.join(script_dir, "ajustes_audio.json"))
+# Aplicar los ajustes guardados y reajustar en marcha si hay cortes
+ACTIVO = os.environ.get("ELISA_AJUSTE_AUDIO", "1") == "1"
+
+BLOQUES = (128, 256, 512, 1024, 2048)
+LATENCIAS = ("low", 0.05, "high")
+# Segundos que se asocian a "low" y "high" para ordenar y en el dispositivo virtual
+LATENCIAS_NOMINALES = {"low": 0.01, "high": 0.1}
+LATENCIA_MAXIMA = 0.5
+SEGUNDOS_PRUEBA = 3.0
+# Cortes por minuto que se toleran al elegir y a partir de los cuales se reajusta en marcha
+XRUNS_MINUTO_MAXIMOS = 1.0
+XRUNS_MINUTO_REAJUSTE = 6.0
+# Ráfagas de ruido emitidas para medir la ida y vuelta
+SEGUNDOS_RAFAGA = 0.02
+PERIODO_RAFAGA = 0.25
+SEGUNDOS_RETARDO_MAXIMO = 1.0
+# Veces la raíz cuadrática media de la correlación que debe superar el pico del eco
+RELACION_PICO = 8.0
+# El mezclador de pygame trabaja a esta frecuencia por defecto
+FRECUENCIA_MEZCLADOR = 44100
+CAMPOS_XRUN = ("input_overflow", "input_underflow", "output_overflow", "output_underflow")
+
+
+def latencia_nominal(bloque, latencia, samplerate=MUESTREO_WHISPER):
+    """Retardo aproximado en segundos de un ajuste, para ordenar candidatos."""
+    if latencia is None:
+        latencia = LATENCIAS_NOMINALES["high"]
+    segundos = LATENCIAS_NOMINALES.get(latencia, latencia)
+    return max(segundos, bloque / samplerate)
+
+
+def buffer_mezclador(bloque, samplerate=MUESTREO_WHISPER, frecuencia=FRECUENCIA_MEZCLADOR):
+    """Búfer de pygame (potencia de dos) que dura lo mismo que `bloque` muestras a `samplerate`."""
+    muestras = int(np.ceil(bloque * frecuencia / samplerate))
+    return int(min(4096, max(256, 1 << (muestras - 1).bit_length())))
+
+
+def mas_holgado(bloque, latencia, fijo=False):
+    """Siguiente ajuste tras cortes en marcha: doble bloque y latencia. None si no queda margen.
+
+    `latencia` son segundos (la que informa el flujo abierto); con `fijo` el
+    tamaño de bloque no se toca (modo dúplex, en que lo fija el cancelador de eco).
+    """
+    nuevo_bloque = bloque if fijo or not bloque else min(2 * bloque, BLOQUES[-1])
+    nueva_latencia = min(2 * latencia, LATENCIA_MAXIMA)
+    if nuevo_bloque == bloque and nueva_latencia <= latencia:
+        return None
+    return nuevo_bloque, nueva_latencia
+
+
+# --- Persistencia por dispositivo ---
+
+def clave_dispositivo(device=None, sd=None):
+    """Nombre del par de dispositivos (entrada -> salida) con que se guardan sus ajustes."""
+    if sd is None:
+        import sounddevice as sd
+    entrada, salida = device if isinstance(device, (tuple, list)) else (device, device)
+    nombres = [sd.query_devices(d, kind=tipo)["name"] if d is None else sd.query_devices(d)["name"]
+               for d, tipo in ((entrada, "input"), (salida, "output"))]
+    return " -> ".join(nombres)
+
+
+def cargar_ajustes(archivo=ARCHIVO_AJUSTES):
+    try:
+        with open(archivo, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"No se pudieron leer los ajustes de audio de {archivo}: {e}")
+        return {}
+
+
+def guardar_ajuste(clave, ajuste, archivo=ARCHIVO_AJUSTES):
+    ajustes = cargar_ajustes(archivo)
+    ajustes[clave] = ajuste
+    temporal = f"{archivo}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(ajustes, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, archivo)
+
+
+def ajuste_para(device=None, sd=None, archivo=ARCHIVO_AJUSTES):
+    """(clave, ajuste guardado o None) del dispositivo; (None, None) si no se puede consultar."""
+    try:
+        clave = clave_dispositivo(device, sd)
+    except Exception as e:
+        logger.debug(f"No se pudo identificar el dispositivo de audio: {e}")
+        return None, None
+    return clave, cargar_ajustes(archivo).get(clave)
+
+
+def opciones_mezclador(device=None):
+    """Argumentos de pygame.mixer.init según el ajuste guardado (vacío si no hay)."""
+    if not ACTIVO:
+        return {}
+    _, ajuste = ajuste_para(device)
+    if not ajuste or "buffer_mezclador" not in ajuste:
+        return {}
+    return {"buffer": ajuste["buffer_mezclador"]}
+
+
+# --- Dispositivo virtual ---
+
+class FlujoVirtual:
+    """Flujo dúplex simulado con la interfaz de sounddevice.Stream que usa este módulo.
+
+    Lo que sale vuelve por la entrada con el retardo de las dos latencias. Un
+    hilo llama al callback cada bloque; si la llamada termina después de lo
+    que el búfer de salida puede cubrir (latencia menos un bloque), se marca
+    un corte, como haría el controlador.
+    """
+
+    def __init__(self, samplerate, channels=1, dtype="float32", blocksize=0, latency=None,
+                 device=None, callback=None, ruido=0.001):
+        self.samplerate = samplerate
+        self.blocksize = blocksize or 512
+        periodo = self.blocksize / samplerate
+        segundos = latencia_nominal(self.blocksize, latency, samplerate)
+        self.latency = (segundos, segundos)
+        # Lo que se puede retrasar el callback sin que se vacíe la salida
+        self.holgura = max(segundos - periodo, periodo / 2)
+        self.callback = callback
+        self.ruido = ruido
+        self.active = False
+        self.cpu_load = 0.0
+        self._linea = np.zeros(int(2 * segundos * samplerate), dtype=np.float32)
+        self._rng = np.random.default_rng(0)
+        self._hilo = None
+
+    def start(self):
+        self.active = True
+        self._hilo = threading.Thread(target=self._producir, name="audio-virtual", daemon=True)
+        self._hilo.start()
+
+    def stop(self):
+        self.active = False
+        if self._hilo is not None:
+            self._hilo.join()
+            self._hilo = None
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        self.close()
+
+    def _producir(self):
+        periodo = self.blocksize / self.samplerate
+        entrada = np.zeros((self.blocksize, 1), dtype=np.float32)
+        salida = np.zeros((self.blocksize, 1), dtype=np.float32)
+        inicio = time.perf_counter()
+        ocupado = 0.0
+        n = 0
+        while self.active:
+            limite = inicio + n * periodo + self.holgura
+            # Lo que entra ahora es lo que salió hace ida y vuelta
+            entrada[:, 0] = self._linea[:self.blocksize]
+            entrada[:, 0] += self.ruido * self._rng.standard_normal(self.blocksize)
+            comienzo = time.perf_counter()
+            tarde = comienzo > limite
+            estado = types.SimpleNamespace(input_overflow=tarde, output_underflow=tarde)
+            self.callback(entrada, salida, self.blocksize, None, estado)
+            fin = time.perf_counter()
+            ocupado += fin - comienzo
+            self._linea = np.concatenate((self._linea[self.blocksize:], salida[:, 0]))
+            n += 1
+            if fin > limite + periodo:
+                # Muy atrasado: el controlador descarta lo pendiente y sigue desde ahora
+                n = int((fin - inicio) / periodo) + 1
+            espera = inicio + n * periodo - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+            self.cpu_load = ocupado / max(time.perf_counter() - inicio, 1e-9)
+
+
+# --- Medición ---
+
+def senal_prueba(segundos, samplerate, semilla=0):
+    """Ráfagas de ruido distintas cada PERIODO_RAFAGA: el eco solo casa con un retardo."""
+    rng = np.random.default_rng(semilla)
+    senal = np.zeros(int(segundos * samplerate), dtype=np.float32)
+    largo = int(SEGUNDOS_RAFAGA * samplerate)
+    for inicio in range(0, len(senal) - largo, int(PERIODO_RAFAGA * samplerate)):
+        senal[inicio:inicio + largo] = 0.3 * rng.uniform(-1, 1, largo)
+    return senal
+
+
+def estimar_retardo(emitido, recibido, samplerate, maximo=SEGUNDOS_RETARDO_MAXIMO):
+    """Segundos entre `emitido` y su eco en `recibido`, o None si no se encuentra."""
+    tamano = 1 << (len(emitido) + len(recibido) - 1).bit_length()
+    correlacion = np.fft.irfft(np.fft.rfft(recibido, tamano) * np.conj(np.fft.rfft(emitido, tamano)),
+                               tamano)[:int(maximo * samplerate)]
+    correlacion = np.abs(correlacion)
+    pico = int(np.argmax(correlacion))
+    if correlacion[pico] < RELACION_PICO * np.sqrt(np.mean(correlacion ** 2)):
+        return None
+    return pico / samplerate
+
+
+def medir(abrir, bloque, latencia, samplerate=MUESTREO_WHISPER, segundos=SEGUNDOS_PRUEBA):
+    """Ida y vuelta y cortes de un ajuste. `abrir` crea el flujo dúplex (sd.Stream o FlujoVirtual)."""
+    emitido = senal_prueba(segundos, samplerate)
+    recibido = np.zeros_like(emitido)
+    n = len(emitido)
+    cortes = Counter()
+    estado = {"posicion": 0}
+    terminado = threading.Event()
+
+    def callback(indata, outdata, frames, tiempo, status):
+        for campo in CAMPOS_XRUN:
+            if getattr(status, campo, False):
+                cortes[campo] += 1
+        i = estado["posicion"]
+        m = max(0, min(frames, n - i))
+        outdata[:m, 0] = emitido[i:i + m]
+        outdata[m:] = 0
+        recibido[i:i + m] = indata[:m, 0]
+        estado["posicion"] = i + m
+        if i + m >= n:
+            terminado.set()
+
+    flujo = abrir(samplerate=samplerate, channels=1, dtype="float32", blocksize=bloque,
+                  latency=latencia, callback=callback)
+    with flujo:
+        terminado.wait(2 * segundos + 2)
+        informada = sum(flujo.latency)
+        carga = flujo.cpu_load
+    retardo = estimar_retardo(emitido, recibido, samplerate)
+    xruns = sum(cortes.values())
+    return {
+        "blocksize": bloque,
+        "latency": latencia,
+        "ida_vuelta_ms": None if retardo is None else round(1000 * retardo, 1),
+        "latencia_informada_ms": round(1000 * informada, 1),
+        "xruns": xruns,
+        "xruns_minuto": round(60 * xruns / segundos, 2),
+        "detalle_xruns": dict(cortes),
+        "carga_cpu": round(carga, 3),
+    }
+
+
+def elegir(mediciones):
+    """La medición de menor retardo sin demasiados cortes (o la de menos cortes si ninguna vale)."""
+    def retardo(m):
+        return m["ida_vuelta_ms"] if m["ida_vuelta_ms"] is not None else m["latencia_informada_ms"]
+
+    validas = [m for m in mediciones if m["xruns_minuto"] <= XRUNS_MINUTO_MAXIMOS]
+    if validas:
+        # A igual retardo, el bloque mayor (menos llamadas al callback)
+        return min(validas, key=lambda m: (retardo(m), -m["blocksize"]))
+    return min(mediciones, key=lambda m: (m["xruns_minuto"], retardo(m)))
+
+
+def _cargar_cpu(parar):
+    """Trabajo en Python que compite por el GIL con el callback de audio."""
+    while not parar.is_set():
+        sum(i * i for i in range(10000))
+
+
+def calibrar(device=None, samplerate=MUESTREO_WHISPER, bloques=BLOQUES, latencias=LATENCIAS,
+             segundos=SEGUNDOS_PRUEBA, virtual=False, carga=0, archivo=ARCHIVO_AJUSTES):
+    """Mide todas las combinaciones, guarda la mejor para el dispositivo y la devuelve.
+
+    Devuelve (clave del dispositivo, ajuste guardado).
+    """
+    if virtual:
+        clave = "virtual"
+        abrir = FlujoVirtual
+    else:
+        import sounddevice as sd
+        clave = clave_dispositivo(device, sd)
+
+        def abrir(**opciones):
+            return sd.Stream(device=device, **opciones)
+
+    parar = threading.Event()
+    hilos = [threading.Thread(target=_cargar_cpu, args=(parar,), daemon=True) for _ in range(carga)]
+    for hilo in hilos:
+        hilo.start()
+    mediciones = []
+    try:
+        for bloque in bloques:
+            for latencia in latencias:
+                try:
+                    medicion = medir(abrir, bloque, latencia, samplerate, segundos)
+                except Exception as e:
+                    logger.warning(f"Bloque {bloque}, latencia {latencia}: no se pudo abrir ({e})")
+                    continue
+                logger.info(f"Bloque {bloque:>5}, latencia {str(latencia):>5}: ida y vuelta "
+                            f"{medicion['ida_vuelta_ms']} ms (informada "
+                            f"{medicion['latencia_informada_ms']} ms), "
+                            f"{medicion['xruns_minuto']} cortes/min, carga {medicion['carga_cpu']:.1%}")
+                mediciones.append(medicion)
+    finally:
+        parar.set()
+        for hilo in hilos:
+            hilo.join()
+    if not mediciones:
+        raise RuntimeError(f"Ningún ajuste se pudo abrir en {clave}")
+
+    mejor = elegir(mediciones)
+    ajuste = {
+        "blocksize": mejor["blocksize"],
+        "latency": mejor["latency"],
+        "samplerate": samplerate,
+        "ida_vuelta_ms": mejor["ida_vuelta_ms"],
+        "latencia_informada_ms": mejor["latencia_informada_ms"],
+        "xruns_minuto": mejor["xruns_minuto"],
+        "buffer_mezclador": buffer_mezclador(mejor["blocksize"], samplerate),
+        "origen": "calibración",
+        "fecha": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "mediciones": mediciones,
+    }
+    guardar_ajuste(clave, ajuste, archivo)
+    return clave, ajuste
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibra bloque y latencia de audio por dispositivo")
+    parser.add_argument("--entrada", type=lambda v: int(v) if v.isdigit() else v,
+                        help="Dispositivo de entrada (índice o nombre)")
+    parser.add_argument("--salida", type=lambda v: int(v) if v.isdigit() else v,
+                        help="Dispositivo de salida (índice o nombre)")
+    parser.add_argument("--segundos", type=float, default=SEGUNDOS_PRUEBA, help="Segundos por ajuste")
+    parser.add_argument("--virtual", action="store_true", help="Usar el dispositivo simulado")
+    parser.add_argument("--carga", type=int, default=0, help="Hilos de carga durante la medición")
+    parser.add_argument("--duplex", action="store_true", default=os.environ.get("ELISA_DUPLEX") == "1",
+                        help="Solo el bloque del cancelador de eco (modo dúplex)")
+    parser.add_argument("--listar", action="store_true", help="Mostrar dispositivos y ajustes guardados")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+
+    if args.listar:
+        import sounddevice as sd
+        print(sd.query_devices())
+        for clave, ajuste in cargar_ajustes().items():
+            print(f"\n{clave}: bloque {ajuste['blocksize']}, latencia {ajuste['latency']}, "
+                  f"ida y vuelta {ajuste['ida_vuelta_ms']} ms, {ajuste['xruns_minuto']} cortes/min "
+                  f"({ajuste['origen']}, {ajuste['fecha']})")
+        return
+
+    if args.duplex:
+        from eco import MUESTRAS_BLOQUE
+        bloques = (MUESTRAS_BLOQUE,)
+    else:
+        bloques = BLOQUES
+    device = None if args.entrada is None and args.salida is None else (args.entrada, args.salida)
+    clave, ajuste = calibrar(device, bloques=bloques, segundos=args.segundos,
+                             virtual=args.virtual, carga=args.carga)
+    print(f"\n{clave}: bloque {ajuste['blocksize']}, latencia {ajuste['latency']} "
+          f"(ida y vuelta {ajuste['ida_vuelta_ms']} ms, {ajuste['xruns_minuto']} cortes/min, "
+          f"búfer de pygame {ajuste['buffer_mezclador']})")
+    if ajuste["ida_vuelta_ms"] is None:
+        print("No se encontró el eco: sin lazo entre salida y entrada se usa la latencia informada.")
+    print(f"Guardado en {ARCHIVO_AJUSTES}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""Procesa por lotes un directorio o manifiesto de grabaciones sin interfaz.
+
+Cada grabación pasa por la misma lógica que un turno de voz de ELISA (recorte
+de silencio, mejora del audio, Whisper, limpieza del texto y respuesta del
+LLM con el gobernador) y el resultado se añade como una línea JSON al archivo
+de salida en cuanto está listo.
+
+La transcripción corre en un grupo de procesos (uno por núcleo por defecto)
+que cargan el modelo una sola vez; las peticiones al LLM salen del proceso
+principal con un máximo de peticiones simultáneas. Si se interrumpe, al
+volver a lanzarlo con la misma salida se saltan los archivos ya procesados;
+los que terminaron con error se reintentan y su registro de error se quita,
+de modo que cada archivo queda con una sola línea en la salida.
+
+El manifiesto tiene una ruta por línea (relativa al manifiesto) o líneas JSON
+con "ruta" y cualquier otro campo (p. ej. "referencia"), que se copia a la
+salida.
+
+Uso:
+    python lote.py grabaciones/ -o resultados.jsonl [--procesos 4] [--llm-simultaneas 2]
+    python lote.py preguntas.txt -o resultados.jsonl --sin-llm
+"""
+import os
+import sys
+import json
+import time
+import glob
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from registro import configurar_registro
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONES = (".wav", ".flac", ".ogg", ".mp3")
+
+
+def leer_entradas(origen):
+    """Devuelve la lista de entradas {"ruta": ..., ...} de un directorio o manifiesto."""
+    if os.path.isdir(origen):
+        rutas = sorted(r for r in glob.glob(os.path.join(origen, "**", "*"), recursive=True)
+                       if r.lower().endswith(EXTENSIONES))
+        return [{"ruta": ruta} for ruta in rutas]
+
+    base = os.path.dirname(os.path.abspath(origen))
+    entradas = []
+    with open(origen, encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.strip()
+            if not linea or linea.startswith("#"):
+                continue
+            entrada = json.loads(linea) if linea.startswith("{") else {"ruta": linea}
+            entrada["ruta"] = os.path.join(base, entrada["ruta"])
+            entradas.append(entrada)
+    return entradas
+
+
+def leer_hechos(salida):
+    """Rutas ya procesadas sin error en una salida anterior."""
+    hechos = set()
+    if not os.path.exists(salida):
+        return hechos
+    with open(salida, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                # Última línea a medio escribir de una ejecución interrumpida
+                continue
+            if not registro.get("error"):
+                hechos.add(registro["ruta"])
+    return hechos
+
+
+def compactar_salida(salida, reintentar):
+    """Prepara una salida anterior para reanudar: quita la línea a medio escribir y los
+    errores de las rutas de `reintentar`, y deja el archivo terminado en salto de línea."""
+    if not os.path.exists(salida):
+        return
+    conservadas = []
+    cambios = False
+    with open(salida, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                cambios = True
+                continue
+            if registro.get("error") and registro["ruta"] in reintentar:
+                cambios = True
+                continue
+            if not linea.endswith("\n"):
+                linea += "\n"
+                cambios = True
+            conservadas.append(linea)
+    if not cambios:
+        return
+    temporal = f"{salida}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        f.writelines(conservadas)
+    os.replace(temporal, salida)
+    logger.info(f"{salida}: {len(conservadas)} registros conservados para reanudar")
+
+
+# --- Trabajadores (procesos) ---
+
+def _iniciar_trabajador(modelo, hilos):
+    import asistente
+    from reparto_cpu import REPARTO
+    # Antes de cargar el modelo: la carga ya no cambia los hilos fijados aquí
+    REPARTO.configurar_torch(hilos)
+    asistente.obtener_whisper_model(modelo)
+
+
+def transcribir_archivo(ruta, modelo):
+    """Lectura, DSP y Whisper de un archivo. Se ejecuta en un proceso del grupo."""
+    import soundfile as sf
+    import asistente
+    from silencio import recortar_silencio, filtrar_segmentos
+    from utilidades_audio import a_mono
+
+    tiempos = {}
+    inicio = time.perf_counter()
+    audio, samplerate = sf.read(ruta, dtype="float32")
+    audio = a_mono(audio)
+    tiempos["lectura"] = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    recortado = recortar_silencio(audio, samplerate)
+    if recortado is not None:
+        recortado = asistente.mejorar_calidad_audio(recortado.copy(), np.empty_like(recortado))
+    tiempos["dsp"] = time.perf_counter() - inicio
+
+    texto = ""
+    if recortado is not None:
+        inicio = time.perf_counter()
+        resultado = asistente.transcribir_local(recortado, samplerate, modelo)
+        texto = asistente.limpiar_texto_transcrito(filtrar_segmentos(resultado).strip())
+        tiempos["asr"] = time.perf_counter() - inicio
+
+    return {
+        "segundos_audio": round(len(audio) / samplerate, 3),
+        "segundos_voz": round(len(recortado) / samplerate, 3) if recortado is not None else 0.0,
+        "transcripcion": texto,
+        "tiempos": tiempos,
+    }
+
+
+# --- LLM (hilos del proceso principal) ---
+
+def responder(texto, modelo, gobernador, nombre_usuario):
+    import asistente
+    from cliente_ollama import obtener_cliente
+    inicio = time.perf_counter()
+    prompt = asistente.redactar_prompt(texto, "ELISA", nombre_usuario, gobernador.max_palabras)
+    flujo = obtener_cliente().generate(model=modelo, prompt=prompt, stream=True,
+                                       options=gobernador.opciones(nombre_usuario=nombre_usuario),
+                                       respaldo=True)
+    return gobernador.generar(flujo), time.perf_counter() - inicio
+
+
+class Lote:
+    def __init__(self, args, total):
+        from gobernador import GobernadorRespuesta
+        self.args = args
+        self.total = total
+        self.gobernador = GobernadorRespuesta()
+        self.procesados = 0
+        self.errores = 0
+        self.tiempos = {}
+
+    def ejecutar(self, entradas):
+        args = self.args
+        hilos = max(1, (os.cpu_count() or 1) // args.procesos)
+        contexto = multiprocessing.get_context("spawn")
+        asr = ProcessPoolExecutor(args.procesos, mp_context=contexto,
+                                  initializer=_iniciar_trabajador, initargs=(args.modelo, hilos))
+        llm = ThreadPoolExecutor(args.llm_simultaneas, thread_name_prefix="llm")
+        pendientes = {}
+        siguiente = iter(entradas)
+        # Pocas tareas por delante de los procesos: se va leyendo el manifiesto a medida
+        max_en_cola = 2 * args.procesos
+        try:
+            with open(args.salida, "a", encoding="utf-8") as salida:
+                self._encolar_asr(asr, siguiente, pendientes, max_en_cola)
+                while pendientes:
+                    hechos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                    for futuro in hechos:
+                        etapa, entrada = pendientes.pop(futuro)
+                        self._recoger(etapa, entrada, futuro, llm, pendientes, salida)
+                    self._encolar_asr(asr, siguiente, pendientes, max_en_cola)
+        finally:
+            asr.shutdown(cancel_futures=True)
+            llm.shutdown(cancel_futures=True)
+
+    def _encolar_asr(self, asr, siguiente, pendientes, max_en_cola):
+        en_cola = sum(1 for etapa, _ in pendientes.values() if etapa == "asr")
+        while en_cola < max_en_cola:
+            entrada = next(siguiente, None)
+            if entrada is None:
+                return
+            futuro = asr.submit(transcribir_archivo, entrada["ruta"], self.args.modelo)
+            pendientes[futuro] = ("asr", entrada)
+            en_cola += 1
+
+    def _recoger(self, etapa, entrada, futuro, llm, pendientes, salida):
+        try:
+            resultado = futuro.result()
+        except Exception as e:
+            logger.error(f"Error en {etapa} de {entrada['ruta']}: {e}")
+            entrada["error"] = f"{etapa}: {e}"
+            self._escribir(entrada, salida)
+            return
+
+        if etapa == "asr":
+            entrada.update(resultado)
+            if self.args.sin_llm or not entrada["transcripcion"]:
+                entrada["respuesta"] = ""
+                self._escribir(entrada, salida)
+                return
+            futuro = llm.submit(responder, entrada["transcripcion"], self.args.modelo_llm,
+                                self.gobernador, self.args.nombre_usuario)
+            pendientes[futuro] = ("llm", entrada)
+        else:
+            entrada["respuesta"], entrada["tiempos"]["llm"] = resultado
+            self._escribir(entrada, salida)
+
+    def _escribir(self, entrada, salida):
+        salida.write(json.dumps(entrada, ensure_ascii=False) + "\n")
+        salida.flush()
+        self.procesados += 1
+        if entrada.get("error"):
+            self.errores += 1
+        for etapa, segundos in entrada.get("tiempos", {}).items():
+            self.tiempos.setdefault(etapa, []).append(segundos)
+        tiempos = ", ".join(f"{k} {v:.2f}s" for k, v in entrada.get("tiempos", {}).items())
+        print(f"[{self.procesados}/{self.total}] {os.path.basename(entrada['ruta'])}: "
+              f"{entrada.get('transcripcion', '') or entrada.get('error', '')!r} ({tiempos})", flush=True)
+
+    def resumen(self, segundos):
+        print(f"\n{self.procesados} archivos en {segundos:.1f}s, {self.errores} con error")
+        for etapa, valores in self.tiempos.items():
+            print(f"  {etapa:>8}: media {np.mean(valores):.2f}s, p90 {np.percentile(valores, 90):.2f}s")
+
+
+def main():
+    import asistente
+    parser = argparse.ArgumentParser(description="Transcribe y responde un lote de grabaciones")
+    parser.add_argument("origen", help="Directorio de audio o manifiesto (.txt / .jsonl)")
+    parser.add_argument("-o", "--salida", default="resultados.jsonl", help="Archivo JSONL de resultados")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 1,
+                        help="Procesos de transcripción (por defecto, uno por núcleo)")
+    parser.add_argument("--llm-simultaneas", type=int, default=2,
+                        help="Peticiones al LLM en curso como máximo")
+    parser.add_argument("--modelo", default=asistente.MODELO_WHISPER, help="Modelo de Whisper")
+    parser.add_argument("--modelo-llm", default=asistente.MODELO_LLM, help="Modelo de Ollama")
+    parser.add_argument("--nombre-usuario", default=None)
+    parser.add_argument("--sin-llm", action="store_true", help="Solo transcribir")
+    args = parser.parse_args()
+
+    configurar_registro("lote", nivel=logging.INFO)
+
+    entradas = leer_entradas(args.origen)
+    hechos = leer_hechos(args.salida)
+    pendientes = [e for e in entradas if e["ruta"] not in hechos]
+    compactar_salida(args.salida, {e["ruta"] for e in pendientes})
+    if hechos:
+        print(f"Reanudando: {len(entradas) - len(pendientes)} de {len(entradas)} ya procesados")
+    if not pendientes:
+        print("Nada que procesar")
+        return
+
+    lote = Lote(args, len(pendientes))
+    inicio = time.perf_counter()
+    try:
+        lote.ejecutar(pendientes)
+    except KeyboardInterrupt:
+        print("\nInterrumpido; vuelve a lanzar el mismo comando para continuar", file=sys.stderr)
+    lote.resumen(time.perf_counter() - inicio)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Memoria a largo plazo de ELISA sobre conversaciones anteriores.
+
+Cada turno se guarda como un vector de embeddings (calculado en local con
+Ollama) en una matriz float32 en disco que se mapea en memoria al arrancar.
+En cada turno se buscan por similitud coseno los turnos pasados más parecidos
+y se añaden al prompt.
+
+Archivos en `memoria/`:
+    vectores.f32   matriz (n, dimension) float32, una fila por turno
+    turnos.jsonl   texto de cada turno, en el mismo orden
+    meta.json      modelo de embeddings y dimensión
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DIR_MEMORIA = os.path.join(script_dir, "memoria")
+
+MODELO_EMBEDDINGS = os.environ.get("ELISA_MODELO_EMBEDDINGS", "nomic-embed-text")
+# nomic-embed-text admite truncar sus vectores (Matryoshka); 256 dimensiones
+# mantienen la búsqueda en pocos milisegundos con 100k turnos.
+DIMENSION = int(os.environ.get("ELISA_DIM_MEMORIA", "256"))
+SIMILITUD_MINIMA = 0.55
+# Filas nuevas que se acumulan en RAM antes de volver a mapear el archivo
+FILAS_POR_REMAPEO = 1024
+
+
+class MemoriaLargoPlazo:
+    def __init__(self, directorio=DIR_MEMORIA, modelo=MODELO_EMBEDDINGS, dimension=DIMENSION):
+        self.directorio = directorio
+        self.modelo = modelo
+        self.dimension = dimension
+        self.ruta_vectores = os.path.join(directorio, "vectores.f32")
+        self.ruta_turnos = os.path.join(directorio, "turnos.jsonl")
+        self.ruta_meta = os.path.join(directorio, "meta.json")
+        self.lock = threading.Lock()
+        self.activa = True
+        self.textos = []
+        self._matriz = np.zeros((0, dimension), dtype=np.float32)
+        self._nuevos = np.zeros((FILAS_POR_REMAPEO, dimension), dtype=np.float32)
+        self._n_nuevos = 0
+        try:
+            self._cargar()
+        except Exception as e:
+            logger.error(f"No se pudo cargar la memoria a largo plazo: {e}")
+            self.activa = False
+
+    def __len__(self):
+        return len(self._matriz) + self._n_nuevos
+
+    def _cargar(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        if os.path.exists(self.ruta_meta):
+            with open(self.ruta_meta, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dimension"] != self.dimension or meta["modelo"] != self.modelo:
+                raise ValueError(f"La memoria se creó con {meta['modelo']} "
+                                 f"({meta['dimension']} dimensiones)")
+        else:
+            with open(self.ruta_meta, "w", encoding="utf-8") as f:
+                json.dump({"modelo": self.modelo, "dimension": self.dimension}, f)
+
+        lineas = 0
+        if os.path.exists(self.ruta_turnos):
+            with open(self.ruta_turnos, encoding="utf-8") as f:
+                for linea in f:
+                    lineas += 1
+                    try:
+                        self.textos.append(json.loads(linea))
+                    except ValueError:
+                        # Última línea a medio escribir: lo que sigue no vale
+                        break
+
+        filas = 0
+        bytes_fila = 4 * self.dimension
+        if os.path.exists(self.ruta_vectores):
+            filas = os.path.getsize(self.ruta_vectores) // bytes_fila
+        # Tras un cierre abrupto puede sobrar una fila (o parte) en alguno de los dos
+        # archivos; se recortan en disco para que lo que se añada después quede alineado
+        filas = min(filas, len(self.textos))
+        if os.path.exists(self.ruta_vectores) and os.path.getsize(self.ruta_vectores) != filas * bytes_fila:
+            os.truncate(self.ruta_vectores, filas * bytes_fila)
+            logger.warning(f"Memoria: vectores.f32 recortado a {filas} filas")
+        if lineas != filas:
+            temporal = f"{self.ruta_turnos}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                for texto in self.textos[:filas]:
+                    f.write(json.dumps(texto, ensure_ascii=False) + "\n")
+            os.replace(temporal, self.ruta_turnos)
+            logger.warning(f"Memoria: turnos.jsonl recortado a {filas} filas")
+        self.textos = self.textos[:filas]
+        self._mapear(filas)
+        logger.info(f"Memoria a largo plazo: {filas} turnos")
+
+    def _mapear(self, filas):
+        if filas == 0:
+            self._matriz = np.zeros((0, self.dimension), dtype=np.float32)
+        else:
+            self._matriz = np.memmap(self.ruta_vectores, dtype=np.float32, mode="r",
+                                     shape=(filas, self.dimension))
+        self._n_nuevos = 0
+
+    def incrustar(self, texto):
+        """Vector normalizado del texto según el modelo de embeddings local."""
+        from cliente_ollama import obtener_cliente
+        vector = np.asarray(obtener_cliente().embeddings(model=self.modelo, prompt=texto)["embedding"],
+                            dtype=np.float32)[:self.dimension]
+        if len(vector) != self.dimension:
+            # Una fila más corta desplazaría todas las siguientes en vectores.f32
+            raise ValueError(f"{self.modelo} devolvió {len(vector)} dimensiones; "
+                             f"la memoria usa {self.dimension}")
+        return vector / (np.linalg.norm(vector) + 1e-12)
+
+    def buscar(self, vector, k=3, similitud_minima=SIMILITUD_MINIMA):
+        """Textos de los k turnos más parecidos al vector, del más al menos similar."""
+        if not self.activa or len(self) == 0:
+            return []
+        inicio = time.perf_counter()
+        with self.lock:
+            matriz, nuevos = self._matriz, self._nuevos[:self._n_nuevos]
+            similitudes = np.concatenate((matriz @ vector, nuevos @ vector))
+            k = min(k, len(similitudes))
+            mejores = np.argpartition(-similitudes, k - 1)[:k]
+            mejores = mejores[np.argsort(-similitudes[mejores])]
+            resultado = [self.textos[i] for i in mejores if similitudes[i] >= similitud_minima]
+        logger.debug(f"Búsqueda en memoria: {len(similitudes)} turnos en "
+                     f"{1000 * (time.perf_counter() - inicio):.2f} ms")
+        return resultado
+
+    def agregar(self, vector, texto):
+        """Añade un turno al final del índice (en disco y en la búsqueda)."""
+        if not self.activa:
+            return
+        vector = np.asarray(vector, dtype=np.float32)
+        if vector.shape != (self.dimension,):
+            raise ValueError(f"Vector de forma {vector.shape}; la memoria usa ({self.dimension},)")
+        with self.lock:
+            with open(self.ruta_vectores, "ab") as f:
+                f.write(vector.tobytes())
+            with open(self.ruta_turnos, "a", encoding="utf-8") as f:
+                f.write(json.dumps(texto, ensure_ascii=False) + "\n")
+            self.textos.append(texto)
+            self._nuevos[self._n_nuevos] = vector
+            self._n_nuevos += 1
+            if self._n_nuevos == len(self._nuevos):
+                self._mapear(len(self.textos))
@@ -0,0 +1,254 @@
+"""Servidor HTTP falso con la API de Ollama, para probar sin modelos.
+
+Responde a /api/generate (con y sin stream), /api/embeddings y /api/ps con
+una respuesta fija, y permite provocar los fallos que el cliente de
+cliente_ollama.py tiene que soportar: errores 5xx, cuelgues antes de
+responder o a mitad del flujo, errores dentro del flujo y lentitud entre
+tokens, por modelo.
+
+    servidor = ServidorOllamaFalso()
+    servidor.iniciar()
+    servidor.fallar("mistral", 3)        # las 3 siguientes peticiones dan 503
+    servidor.colgar("mistral", 5.0)      # tarda 5 s en empezar a responder
+    ...
+    servidor.detener()
+
+Con `python ollama_falso.py` comprueba el cliente en cada escenario.
+"""
+import json
+import time
+import logging
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RESPUESTA = "Claro, con gusto te ayudo con eso. Es una pregunta interesante."
+DIMENSION = 768
+
+
+class ManejadorOllama(BaseHTTPRequestHandler):
+    # HTTP/1.1 para que el cliente pueda reutilizar la conexión
+    protocol_version = "HTTP/1.1"
+    # Cada token sale en cuanto se escribe, como en Ollama
+    disable_nagle_algorithm = True
+
+    def log_message(self, formato, *args):
+        logger.debug(formato % args)
+
+    def _json(self, estado, cuerpo):
+        datos = json.dumps(cuerpo).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _trozo(self, cuerpo):
+        datos = json.dumps(cuerpo).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(datos):x}\r\n".encode() + datos + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/ps":
+            self._json(200, {"models": self.server.modelos_cargados()})
+        else:
+            self._json(404, {"error": "no encontrado"})
+
+    def do_POST(self):
+        servidor = self.server
+        cuerpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        modelo = cuerpo.get("model", "")
+        servidor.registrar(self.path, modelo)
+        estado = servidor.consumir_fallo(modelo)
+        if estado:
+            self._json(estado, {"error": f"{modelo} sobrecargado" if estado >= 500
+                                else f"{modelo} no encontrado"})
+            return
+        espera = servidor.cuelgues.get(modelo, 0)
+        if espera:
+            time.sleep(espera)
+        if self.path == "/api/embeddings":
+            self._json(200, {"embedding": servidor.rng.standard_normal(DIMENSION).tolist()})
+        elif self.path == "/api/generate":
+            servidor.cargar(modelo, cuerpo.get("keep_alive"))
+            if cuerpo.get("stream", True):
+                self._flujo(modelo)
+            else:
+                self._json(200, {"model": modelo, "response": servidor.respuesta, "done": True})
+        else:
+            self._json(404, {"error": "no encontrado"})
+
+    def _flujo(self, modelo):
+        servidor = self.server
+        palabras = servidor.respuesta.split()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            if servidor.errores_flujo.pop(modelo, None):
+                # Como Ollama cuando el modelo falla tras enviar las cabeceras
+                self._trozo({"error": f"{modelo} falló al generar"})
+                self.wfile.write(b"0\r\n\r\n")
+                return
+            for i, palabra in enumerate(palabras):
+                if i == len(palabras) // 2 and servidor.cortes.get(modelo):
+                    time.sleep(servidor.cortes[modelo])
+                if servidor.segundos_token:
+                    time.sleep(servidor.segundos_token)
+                self._trozo({"model": modelo, "response": palabra + " ", "done": False})
+            self._trozo({"model": modelo, "response": "", "done": True,
+                         "done_reason": "stop", "eval_count": len(palabras)})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cerró el flujo (respuesta cortada o cancelada)
+            self.close_connection = True
+
+
+class ServidorOllamaFalso(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, puerto=0, respuesta=RESPUESTA, segundos_token=0.0):
+        super().__init__(("127.0.0.1", puerto), ManejadorOllama)
+        self.respuesta = respuesta
+        self.segundos_token = segundos_token
+        self.rng = np.random.default_rng(0)
+        # modelo -> [peticiones que faltan por fallar, estado HTTP]
+        self.fallos = {}
+        self.cuelgues = {}
+        self.cortes = {}
+        self.errores_flujo = {}
+        self.peticiones = Counter()
+        self._cargados = {}
+        self._lock = threading.Lock()
+        self._hilo = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self.serve_forever, name="ollama-falso", daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        self.shutdown()
+        self.server_close()
+        if self._hilo is not None:
+            self._hilo.join()
+
+    # --- Fallos provocados ---
+
+    def fallar(self, modelo, veces, estado=503):
+        """Las `veces` siguientes peticiones a `modelo` responden con `estado` (503 por defecto)."""
+        with self._lock:
+            self.fallos[modelo] = [veces, estado]
+
+    def colgar(self, modelo, segundos):
+        """Las peticiones a `modelo` tardan `segundos` en empezar a responder (0 lo quita)."""
+        self.cuelgues[modelo] = segundos
+
+    def cortar(self, modelo, segundos):
+        """Los flujos de `modelo` se paran `segundos` a mitad de la respuesta (0 lo quita)."""
+        self.cortes[modelo] = segundos
+
+    def fallar_en_flujo(self, modelo):
+        """La siguiente petición en stream a `modelo` responde 200 con un error como primer fragmento."""
+        self.errores_flujo[modelo] = True
+
+    def consumir_fallo(self, modelo):
+        """Estado HTTP con que debe fallar esta petición, o None si no debe fallar."""
+        with self._lock:
+            fallo = self.fallos.get(modelo)
+            if fallo and fallo[0] > 0:
+                fallo[0] -= 1
+                return fallo[1]
+            return None
+
+    # --- Estado ---
+
+    def registrar(self, ruta, modelo):
+        with self._lock:
+            self.peticiones[ruta, modelo] += 1
+
+    def cargar(self, modelo, keep_alive):
+        with self._lock:
+            if keep_alive == 0:
+                self._cargados.pop(modelo, None)
+            else:
+                self._cargados[modelo] = 4 * 1024 ** 3
+
+    def modelos_cargados(self):
+        with self._lock:
+            return [{"name": nombre, "model": nombre, "size": tamano}
+                    for nombre, tamano in self._cargados.items()]
+
+
+def comprobar():
+    """Recorre los escenarios de fallo con el cliente. Devuelve los que no dieron lo esperado."""
+    from cliente_ollama import ClienteOllama, ErrorOllama
+
+    servidor = ServidorOllamaFalso().iniciar()
+    cliente = ClienteOllama(servidor.url, plazo=1.0, modelo_respaldo="tiny",
+                            fallos_circuito=3, segundos_circuito=0.5)
+
+    def generar(respaldo=False):
+        inicio = time.perf_counter()
+        try:
+            texto = "".join(f["response"] for f in cliente.generate("mistral", "hola", stream=True,
+                                                                    respaldo=respaldo))
+            resultado, detalle = "ok", f"{len(texto.split())} palabras"
+        except ErrorOllama as e:
+            resultado, detalle = type(e).__name__, str(e)
+        return resultado, f"{detalle} en {time.perf_counter() - inicio:.2f}s"
+
+    # (nombre, preparación del servidor, respaldo, resultado esperado)
+    escenarios = [
+        ("normal", lambda: None, False, "ok"),
+        ("conexión reutilizada", lambda: None, False, "ok"),
+        ("2 errores 503 y reintento", lambda: servidor.fallar("mistral", 2), False, "ok"),
+        ("cuelgue antes de responder", lambda: servidor.colgar("mistral", 3.0), False, "PlazoAgotado"),
+        ("cuelgue a mitad del flujo", lambda: (servidor.colgar("mistral", 0),
+                                               servidor.cortar("mistral", 3.0)), False, "PlazoAgotado"),
+        # Los dos cuelgues ya contaron como fallos: el primer 503 abre el circuito
+        ("503 persistente", lambda: (servidor.cortar("mistral", 0),
+                                     servidor.fallar("mistral", 10)), False, "CircuitoAbierto"),
+        ("circuito abierto con respaldo", lambda: None, True, "ok"),
+        ("circuito abierto sin respaldo", lambda: None, False, "CircuitoAbierto"),
+        # Un 404 en la petición de prueba también cierra el circuito (el servidor responde)
+        ("404 en el semiabierto", lambda: (time.sleep(0.6), servidor.fallar("mistral", 1, 404)),
+         False, "ErrorRespuesta"),
+        ("circuito tras el 404", lambda: None, False, "ok"),
+        ("503 persistente otra vez", lambda: servidor.fallar("mistral", 10), False, "ErrorOllama"),
+        ("circuito semiabierto", lambda: (time.sleep(0.6), servidor.fallar("mistral", 0)), False, "ok"),
+        ("circuito cerrado", lambda: None, False, "ok"),
+        ("error en el primer fragmento", lambda: servidor.fallar_en_flujo("mistral"), False, "ErrorOllama"),
+    ]
+    fallidos = []
+    for nombre, preparar, respaldo, esperado in escenarios:
+        preparar()
+        resultado, detalle = generar(respaldo)
+        if resultado != esperado:
+            fallidos.append(nombre)
+        print(f"{nombre:>30}: {resultado:<16} {detalle}"
+              + ("" if resultado == esperado else f"  (se esperaba {esperado})"))
+    print()
+    for clave, valor in cliente.metricas.informe().items():
+        print(f"{clave:>30}: {valor:.3f}" if isinstance(valor, float) else f"{clave:>30}: {valor}")
+    cliente.cerrar()
+    servidor.detener()
+    return fallidos
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s - %(message)s")
+    fallidos = comprobar()
+    if fallidos:
+        print(f"\nEscenarios con un resultado inesperado: {', '.join(fallidos)}")
+    sys.exit(1 if fallidos else 0)
@@ -0,0 +1,246 @@
+"""Detector ligero de la palabra clave ("Elisa") para el modo manos libres.
+
+El detector trabaja sobre bloques pequeños (20 ms) de un flujo continuo. En
+reposo solo calcula la energía de cada bloque; cuando aparece un tramo de voz
+de duración compatible con la palabra clave lo compara por DTW contra las
+grabaciones de referencia de `assets/palabra_clave/`. Así el coste con el
+micrófono abierto se mantiene en unas décimas de punto de CPU.
+
+Para grabar las plantillas:
+    python palabra_clave.py --enrolar 5
+"""
+import os
+import glob
+import logging
+import argparse
+
+import numpy as np
+
+from utilidades_audio import remuestrear, MUESTREO_WHISPER
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DIR_PLANTILLAS = os.path.join(script_dir, "assets", "palabra_clave")
+
+# Umbral de distancia DTW por debajo del cual se acepta la palabra clave
+UMBRAL = float(os.environ.get("ELISA_UMBRAL_PALABRA_CLAVE", "0.55"))
+
+MS_BLOQUE = 20
+MS_COLA_SILENCIO = 200
+MS_PREVIO = 100
+FACTOR_RUIDO = 3.0
+RMS_MINIMO = 0.005
+
+# Análisis espectral: ventanas de 25 ms con salto de 10 ms
+N_FFT = 400
+SALTO = 160
+N_MEL = 20
+N_CEPSTRAL = 13
+
+
+def _banco_mel(samplerate, n_fft=N_FFT, n_mel=N_MEL):
+    def hz_a_mel(f):
+        return 2595.0 * np.log10(1.0 + f / 700.0)
+
+    def mel_a_hz(m):
+        return 700.0 * (10 ** (m / 2595.0) - 1.0)
+
+    puntos = mel_a_hz(np.linspace(hz_a_mel(60.0), hz_a_mel(samplerate / 2), n_mel + 2))
+    bins = np.floor((n_fft + 1) * puntos / samplerate).astype(int)
+    banco = np.zeros((n_mel, n_fft // 2 + 1), dtype=np.float32)
+    for i in range(n_mel):
+        izq, centro, der = bins[i], bins[i + 1], bins[i + 2]
+        if centro > izq:
+            banco[i, izq:centro] = (np.arange(izq, centro) - izq) / (centro - izq)
+        if der > centro:
+            banco[i, centro:der] = (der - np.arange(centro, der)) / (der - centro)
+    return banco
+
+
+def _matriz_dct(n_entrada=N_MEL, n_salida=N_CEPSTRAL):
+    n = np.arange(n_entrada)
+    k = np.arange(n_salida)[:, None]
+    return np.cos(np.pi * k * (2 * n + 1) / (2 * n_entrada)).astype(np.float32)
+
+
+_BANCO = _banco_mel(MUESTREO_WHISPER)
+_DCT = _matriz_dct()
+_VENTANA = np.hamming(N_FFT).astype(np.float32)
+
+
+def caracteristicas(audio):
+    """Coeficientes cepstrales (normalizados por media) de audio a 16 kHz."""
+    audio = np.asarray(audio, dtype=np.float32)
+    if len(audio) < N_FFT:
+        audio = np.pad(audio, (0, N_FFT - len(audio)))
+    n_tramas = 1 + (len(audio) - N_FFT) // SALTO
+    tramas = np.lib.stride_tricks.as_strided(
+        audio, shape=(n_tramas, N_FFT),
+        strides=(audio.strides[0] * SALTO, audio.strides[0]))
+    espectro = np.abs(np.fft.rfft(tramas * _VENTANA, axis=1)) ** 2
+    log_mel = np.log(espectro @ _BANCO.T + 1e-10)
+    cepstro = log_mel @ _DCT.T
+    return cepstro - cepstro.mean(axis=0)
+
+
+def distancia_dtw(plantilla, candidato):
+    """Distancia DTW con final abierto: la plantilla puede acabar en cualquier
+    punto del candidato (la palabra clave suele ir seguida de la orden)."""
+    n, m = len(plantilla), len(candidato)
+    costes = np.sqrt(((plantilla[:, None, :] - candidato[None, :, :]) ** 2).sum(axis=2))
+    costes /= np.sqrt(plantilla.shape[1])
+    acumulado = np.full((n + 1, m + 1), np.inf)
+    acumulado[0, 0] = 0.0
+    for i in range(1, n + 1):
+        fila_previa = acumulado[i - 1]
+        fila = acumulado[i]
+        c = costes[i - 1]
+        for j in range(1, m + 1):
+            fila[j] = c[j - 1] + min(fila_previa[j], fila_previa[j - 1], fila[j - 1])
+    longitudes = n + np.arange(1, m + 1)
+    return float(np.min(acumulado[n, 1:] / longitudes))
+
+
+class DetectorPalabraClave:
+    def __init__(self, plantillas, umbral=UMBRAL, samplerate=MUESTREO_WHISPER):
+        if not plantillas:
+            raise ValueError("Se necesita al menos una plantilla de la palabra clave")
+        self.plantillas = [caracteristicas(p) for p in plantillas]
+        self.umbral = umbral
+        self.samplerate = samplerate
+        self.muestras_bloque = samplerate * MS_BLOQUE // 1000
+
+        duracion_max = max(len(p) for p in plantillas)
+        duracion_min = min(len(p) for p in plantillas)
+        # El tramo se evalúa al terminar o al superar 1.5 veces la plantilla más larga
+        self.muestras_evaluar = int(duracion_max * 1.5)
+        self.muestras_minimas = int(duracion_min * 0.6)
+        self.bloques_silencio = MS_COLA_SILENCIO // MS_BLOQUE
+        self.bloques_previos = MS_PREVIO // MS_BLOQUE
+
+        # Búfer preasignado para el tramo de voz en curso
+        self._segmento = np.zeros(self.muestras_evaluar + samplerate, dtype=np.float32)
+        self._previos = np.zeros((self.bloques_previos, self.muestras_bloque), dtype=np.float32)
+        self.piso_ruido = RMS_MINIMO
+        self.ultima_distancia = None
+        self.ultimo_segmento = np.zeros(0, dtype=np.float32)
+        self.al_evaluar = None
+        self.reiniciar()
+
+    @classmethod
+    def desde_directorio(cls, directorio=DIR_PLANTILLAS, **kwargs):
+        """Crea el detector con las grabaciones .wav de `directorio`."""
+        import soundfile as sf
+        plantillas = []
+        for ruta in sorted(glob.glob(os.path.join(directorio, "*.wav"))):
+            audio, samplerate = sf.read(ruta, dtype="float32")
+            plantillas.append(recortar_voz(remuestrear(audio, samplerate)))
+        return cls(plantillas, **kwargs)
+
+    def reiniciar(self):
+        self._en_voz = False
+        self._evaluado = False
+        self._largo = 0
+        self._silencio = 0
+        self._n_previos = 0
+
+    def es_voz(self, bloque):
+        return _rms(bloque) > max(self.piso_ruido * FACTOR_RUIDO, RMS_MINIMO)
+
+    def procesar(self, bloque):
+        """Procesa un bloque de audio mono a 16 kHz. Devuelve True al detectar la palabra clave."""
+        rms = _rms(bloque)
+        voz = rms > max(self.piso_ruido * FACTOR_RUIDO, RMS_MINIMO)
+
+        if not self._en_voz:
+            if not voz:
+                self.piso_ruido = 0.95 * self.piso_ruido + 0.05 * rms
+                self._guardar_previo(bloque)
+                return False
+            self._en_voz = True
+            for previo in self._previos_en_orden():
+                self._anadir(previo)
+
+        self._anadir(bloque)
+        self._silencio = 0 if voz else self._silencio + 1
+
+        detectado = False
+        if not self._evaluado and self._largo >= self.muestras_evaluar:
+            detectado = self._evaluar()
+        elif self._silencio >= self.bloques_silencio:
+            if not self._evaluado and self._largo >= self.muestras_minimas:
+                detectado = self._evaluar()
+            self.reiniciar()
+
+        if detectado:
+            self.reiniciar()
+        return detectado
+
+    def _evaluar(self):
+        self._evaluado = True
+        self.ultimo_segmento = self._segmento[:self._largo].copy()
+        candidato = caracteristicas(self.ultimo_segmento)
+        self.ultima_distancia = min(distancia_dtw(p, candidato) for p in self.plantillas)
+        if self.al_evaluar is not None:
+            self.al_evaluar(self.ultima_distancia)
+        logger.debug(f"Palabra clave: distancia {self.ultima_distancia:.3f}")
+        return self.ultima_distancia < self.umbral
+
+    def _anadir(self, bloque):
+        n = min(len(bloque), len(self._segmento) - self._largo)
+        self._segmento[self._largo:self._largo + n] = bloque[:n]
+        self._largo += n
+
+    def _guardar_previo(self, bloque):
+        if self.bloques_previos == 0 or len(bloque) != self.muestras_bloque:
+            return
+        self._previos[self._n_previos % self.bloques_previos] = bloque
+        self._n_previos += 1
+
+    def _previos_en_orden(self):
+        n = min(self._n_previos, self.bloques_previos)
+        inicio = self._n_previos - n
+        return [self._previos[i % self.bloques_previos] for i in range(inicio, self._n_previos)]
+
+
+def _rms(bloque):
+    return float(np.sqrt(np.mean(np.square(bloque, dtype=np.float32))))
+
+
+def recortar_voz(audio, ms_bloque=MS_BLOQUE, samplerate=MUESTREO_WHISPER):
+    """Recorta el silencio inicial y final de una grabación corta."""
+    n = samplerate * ms_bloque // 1000
+    if len(audio) < n:
+        return audio
+    bloques = audio[:len(audio) // n * n].reshape(-1, n)
+    energia = np.sqrt(np.mean(bloques ** 2, axis=1))
+    activos = np.nonzero(energia > max(energia.max() * 0.1, RMS_MINIMO))[0]
+    if len(activos) == 0:
+        return audio
+    return audio[activos[0] * n:(activos[-1] + 1) * n]
+
+
+def enrolar(cantidad, directorio=DIR_PLANTILLAS, duracion=1.5):
+    """Graba `cantidad` ejemplos de la palabra clave en `directorio`."""
+    import sounddevice as sd
+    import soundfile as sf
+    os.makedirs(directorio, exist_ok=True)
+    existentes = len(glob.glob(os.path.join(directorio, "*.wav")))
+    for i in range(cantidad):
+        input(f"[{i + 1}/{cantidad}] Pulsa Enter y di «Elisa»...")
+        audio = sd.rec(int(duracion * MUESTREO_WHISPER), samplerate=MUESTREO_WHISPER,
+                       channels=1, dtype="float32")
+        sd.wait()
+        audio = recortar_voz(audio[:, 0])
+        ruta = os.path.join(directorio, f"elisa_{existentes + i + 1:02d}.wav")
+        sf.write(ruta, audio, MUESTREO_WHISPER)
+        print(f"Guardado {ruta} ({len(audio) / MUESTREO_WHISPER:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plantillas de la palabra clave de ELISA")
+    parser.add_argument("--enrolar", type=int, default=5, help="Número de ejemplos a grabar")
+    parser.add_argument("--directorio", default=DIR_PLANTILLAS)
+    args = parser.parse_args()
+    enrolar(args.enrolar, args.directorio)
@@ -0,0 +1,348 @@
+"""Motor del pipeline de turnos de ELISA.
+
+Un turno recorre fases tipadas (captura → DSP → ASR → intención → LLM → TTS →
+reproducción). Cada etapa corre en su propio hilo y se comunica con la
+siguiente por una cola acotada: si una etapa se retrasa, las anteriores se
+bloquean al entregar (contrapresión) en lugar de acumular trabajo. Las etapas
+trabajan en paralelo sobre turnos o frases distintas; por ejemplo, la TTS
+sintetiza la segunda frase mientras se reproduce la primera.
+
+Cada turno lleva un testigo de cancelación. `Pipeline.cancelar` lo activa en
+los turnos en curso, retira de las colas lo que aún no ha empezado y deja que
+la etapa que lo está procesando se detenga en su siguiente punto de control.
+
+El motor es independiente de Qt: publica eventos a sus suscriptores desde los
+hilos de las etapas y cada interfaz decide cómo llevarlos a su hilo principal.
+"""
+import time
+import queue
+import logging
+import threading
+from enum import Enum, IntEnum
+from dataclasses import dataclass, field
+from typing import Optional
+
+import numpy as np
+
+from registro import establecer_turno
+
+logger = logging.getLogger(__name__)
+
+
+class Fase(IntEnum):
+    CAPTURA = 0
+    DSP = 1
+    ASR = 2
+    INTENCION = 3
+    LLM = 4
+    TTS = 5
+    REPRODUCCION = 6
+    TERMINADO = 7
+    DESCARTADO = 8
+
+
+class Estado(Enum):
+    """Estado visible del asistente, derivado de la actividad de las etapas."""
+    QUIETO = "quieto"
+    ESCUCHANDO = "escuchando"
+    GRABANDO = "grabando"
+    PENSANDO = "pensando"
+    HABLANDO = "hablando"
+
+
+# Qué estado muestra cada etapa mientras trabaja, de mayor a menor prioridad
+PRIORIDAD_ESTADOS = [
+    (Fase.CAPTURA, Estado.GRABANDO),
+    (Fase.REPRODUCCION, Estado.HABLANDO),
+    (Fase.DSP, Estado.PENSANDO),
+    (Fase.ASR, Estado.PENSANDO),
+    (Fase.INTENCION, Estado.PENSANDO),
+    (Fase.LLM, Estado.PENSANDO),
+    (Fase.TTS, Estado.PENSANDO),
+]
+
+
+@dataclass
+class Turno:
+    id: str
+    origen: str
+    fase: Fase
+    audio: Optional[np.ndarray] = None
+    samplerate: int = 16000
+    # Posición absoluta en la captura donde empieza el audio del turno
+    posicion: Optional[int] = None
+    segundos_grabados: float = 0.0
+    texto: str = ""
+    respuesta: str = ""
+    tiempos: dict = field(default_factory=dict)
+    cancelacion: threading.Event = field(default_factory=threading.Event, repr=False)
+    # Respuesta especulativa confirmada por la ASR (ver especulacion.py)
+    especulacion: Optional[object] = field(default=None, repr=False)
+
+    @property
+    def turno(self):
+        return self
+
+    @property
+    def cancelado(self):
+        return self.cancelacion.is_set()
+
+    def cancelar(self):
+        self.cancelacion.set()
+
+    def avanzar(self, fase):
+        """Pasa a una fase posterior; un turno nunca retrocede ni sale de un estado final."""
+        if self.fase in (Fase.TERMINADO, Fase.DESCARTADO) or fase < self.fase:
+            raise ValueError(f"Transición inválida del turno {self.id}: {self.fase.name} → {fase.name}")
+        self.fase = fase
+        return self
+
+
+@dataclass
+class Fragmento:
+    """Frase de la respuesta que viaja por TTS y reproducción.
+
+    El último fragmento de un turno lleva `ultimo=True` (y puede estar vacío).
+    """
+    turno: Turno
+    texto: str
+    indice: int
+    ultimo: bool = False
+    fase: Fase = Fase.TTS
+    ruta: Optional[str] = None
+
+    def avanzar(self, fase):
+        if fase < self.fase:
+            raise ValueError(f"Transición inválida de fragmento: {self.fase.name} → {fase.name}")
+        self.fase = fase
+        return self
+
+
+@dataclass
+class Evento:
+    tipo: str
+    turno: Optional[str]
+    datos: dict = field(default_factory=dict)
+
+
+class Etapa:
+    """Etapa del pipeline.
+
+    `procesar` recibe un Turno o Fragmento y devuelve None (el elemento no
+    sigue), un elemento o un iterable de elementos. Cada salida se envía a la
+    etapa que corresponde a su `fase`, así que una etapa puede saltarse las
+    siguientes (por ejemplo, la intención puede responder sin pasar por el LLM).
+    """
+    fase = None
+
+    def __init__(self):
+        self.pipeline = None
+
+    def publicar(self, tipo, turno=None, **datos):
+        self.pipeline.publicar(tipo, turno, **datos)
+
+    def procesar(self, elemento):
+        raise NotImplementedError
+
+    def descartar(self, elemento):
+        """Libera lo que tenga un elemento cancelado antes de procesarlo."""
+
+    def preparar_hilo(self):
+        """Se llama en el hilo de la etapa antes de procesar nada (afinidad, prioridad...)."""
+
+
+# Elementos que caben en la cola de cada etapa
+CAPACIDAD_COLAS = 2
+
+
+class Pipeline:
+    def __init__(self, etapas, capacidad=CAPACIDAD_COLAS):
+        self.etapas = {etapa.fase: etapa for etapa in etapas}
+        self.colas = {fase: queue.Queue(maxsize=capacidad) for fase in self.etapas}
+        self.suscriptores = []
+        self.estado_reposo = Estado.QUIETO
+        self.estado = Estado.QUIETO
+        self._ocupadas = {fase: 0 for fase in self.etapas}
+        self._turnos_activos = {}
+        self._lock = threading.Lock()
+        self._hilos = []
+        for etapa in etapas:
+            etapa.pipeline = self
+
+    # --- Ciclo de vida ---
+
+    def iniciar(self):
+        for fase, etapa in self.etapas.items():
+            hilo = threading.Thread(target=self._bucle, args=(fase,),
+                                    name=f"etapa-{fase.name.lower()}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+
+    def detener(self, timeout=2.0):
+        for cola in self.colas.values():
+            try:
+                cola.put_nowait(None)
+            except queue.Full:
+                pass
+        for hilo in self._hilos:
+            hilo.join(timeout)
+        self._hilos = []
+
+    # --- Entrada y eventos ---
+
+    def enviar(self, elemento, bloquear=True, timeout=None):
+        """Entrega un elemento a la etapa de su fase. Devuelve False si la cola está llena."""
+        turno = elemento.turno
+        with self._lock:
+            self._turnos_activos.setdefault(turno.id, turno)
+        try:
+            self.colas[elemento.fase].put(elemento, block=bloquear, timeout=timeout)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._turnos_activos.pop(turno.id, None)
+            return False
+
+    def suscribir(self, callback):
+        self.suscriptores.append(callback)
+
+    def publicar(self, tipo, turno=None, **datos):
+        evento = Evento(tipo, turno.id if isinstance(turno, Turno) else turno, datos)
+        for callback in self.suscriptores:
+            try:
+                callback(evento)
+            except Exception as e:
+                logger.error(f"Error en suscriptor de eventos: {e}")
+
+    def en_curso(self):
+        """Número de turnos que aún no han terminado."""
+        with self._lock:
+            return len(self._turnos_activos)
+
+    def activos(self):
+        with self._lock:
+            return list(self._turnos_activos.values())
+
+    def cancelar(self, turnos=None):
+        """Cancela los turnos indicados (por defecto, todos los que están en curso)."""
+        if turnos is None:
+            turnos = self.activos()
+        for turno in turnos:
+            turno.cancelar()
+        for fase in self.colas:
+            self._purgar(fase)
+        for turno in turnos:
+            logger.info(f"Turno {turno.id} cancelado en {turno.fase.name.lower()}")
+            self._finalizar(turno, Fase.DESCARTADO)
+        return turnos
+
+    def ocupada(self, fase):
+        return self._ocupadas.get(fase, 0) > 0
+
+    def establecer_reposo(self, estado):
+        self.estado_reposo = estado
+        self._actualizar_estado()
+
+    # --- Funcionamiento interno ---
+
+    def _bucle(self, fase):
+        etapa = self.etapas[fase]
+        cola = self.colas[fase]
+        try:
+            etapa.preparar_hilo()
+        except Exception as e:
+            logger.error(f"Error preparando el hilo de {fase.name}: {e}")
+        while True:
+            elemento = cola.get()
+            if elemento is None:
+                return
+            turno = elemento.turno
+            if turno.cancelado or turno.fase == Fase.DESCARTADO:
+                etapa.descartar(elemento)
+                continue
+            self._marcar(fase, +1)
+            # Los registros de esta etapa llevan el turno que procesa, no el último creado
+            establecer_turno(turno.id)
+            inicio = time.perf_counter()
+            try:
+                if isinstance(elemento, Turno):
+                    elemento.avanzar(fase)
+                salidas = etapa.procesar(elemento)
+                if salidas is None:
+                    salidas = []
+                elif isinstance(salidas, (Turno, Fragmento)):
+                    salidas = [salidas]
+                hubo_salida = False
+                for salida in salidas:
+                    if turno.cancelado:
+                        # Cerrar el generador detiene la etapa (p. ej. el flujo del LLM)
+                        if salida.fase in self.etapas:
+                            self.etapas[salida.fase].descartar(salida)
+                        cerrar = getattr(salidas, "close", None)
+                        if cerrar is not None:
+                            cerrar()
+                        break
+                    hubo_salida = True
+                    self._encaminar(salida)
+                if not hubo_salida and isinstance(elemento, Turno):
+                    self._finalizar(turno, Fase.DESCARTADO)
+            except Exception as e:
+                if turno.cancelado:
+                    logger.debug(f"Etapa {fase.name} interrumpida en el turno cancelado {turno.id}: {e}")
+                    continue
+                logger.exception(f"Error en la etapa {fase.name} del turno {turno.id}: {e}")
+                self.publicar("error", turno, etapa=fase.name, error=str(e))
+                self._finalizar(turno, Fase.DESCARTADO)
+            finally:
+                duracion = time.perf_counter() - inicio
+                clave = fase.name.lower()
+                turno.tiempos[clave] = turno.tiempos.get(clave, 0.0) + duracion
+                self.publicar("etapa", turno, etapa=fase, duracion=duracion)
+                self._marcar(fase, -1)
+                establecer_turno("-")
+
+    def _encaminar(self, salida):
+        if salida.fase == Fase.TERMINADO:
+            self._finalizar(salida.turno, Fase.TERMINADO)
+        elif salida.fase == Fase.DESCARTADO:
+            self._finalizar(salida.turno, Fase.DESCARTADO)
+        else:
+            self.colas[salida.fase].put(salida)
+
+    def _purgar(self, fase):
+        """Quita de la cola de una fase los elementos de turnos cancelados."""
+        cola = self.colas[fase]
+        with cola.mutex:
+            quitados = [e for e in cola.queue if e is not None and e.turno.cancelado]
+            if not quitados:
+                return
+            quedan = [e for e in cola.queue if e is None or not e.turno.cancelado]
+            cola.queue.clear()
+            cola.queue.extend(quedan)
+            cola.not_full.notify_all()
+        for elemento in quitados:
+            self.etapas[fase].descartar(elemento)
+
+    def _finalizar(self, turno, fase):
+        with self._lock:
+            if self._turnos_activos.pop(turno.id, None) is None:
+                return
+        if turno.fase not in (Fase.TERMINADO, Fase.DESCARTADO):
+            turno.fase = fase
+        resumen = ", ".join(f"{k} {v:.2f}s" for k, v in turno.tiempos.items())
+        logger.info(f"Turno {turno.id} {fase.name.lower()}: {resumen}")
+        self.publicar("fin_turno", turno, fase=fase, tiempos=dict(turno.tiempos))
+
+    def _marcar(self, fase, delta):
+        with self._lock:
+            self._ocupadas[fase] += delta
+        self._actualizar_estado()
+
+    def _actualizar_estado(self):
+        with self._lock:
+            estado = next((e for f, e in PRIORIDAD_ESTADOS if self._ocupadas.get(f)),
+                          self.estado_reposo)
+            if estado == self.estado:
+                return
+            self.estado = estado
+        self.publicar("estado", None, estado=estado)
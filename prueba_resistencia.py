@@ -0,0 +1,357 @@
+"""Prueba de resistencia (soak) de AsistenteVirtualGUI sin pantalla ni modelos.
+
+Ejecuta miles de turnos simulados (escritos y por voz) sobre la interfaz real
+con la plataforma Qt `offscreen` y sustitutos locales de Whisper, torch,
+gTTS, pygame, sounddevice y soundfile; Ollama es el servidor HTTP falso de
+ollama_falso.py, de modo que también se ejercitan las conexiones del cliente. Cada cierto número de turnos
+mide RSS, memoria de Python (tracemalloc), número de objetos, descriptores abiertos,
+hilos del proceso, archivos temporales y mensajes y bloques de la conversación
+en la ventana, y falla si la pendiente de alguno supera el límite configurado
+(unidades por cada 1000 turnos).
+
+Uso:
+    python prueba_resistencia.py [--turnos 2000] [--modulo elisa] [--salida informe.json]
+"""
+import os
+import sys
+import gc
+import json
+import time
+import types
+import argparse
+import functools
+import tempfile
+import threading
+import importlib
+import tracemalloc
+
+import numpy as np
+
+FRASES = [
+    "¿Qué hora es?",
+    "Cuéntame un chiste",
+    "¿Cómo estará el clima mañana?",
+    "Recomiéndame un libro de ciencia ficción",
+    "¿Cuál es la capital de Portugal?",
+]
+
+# Velocidad del micrófono falso (y del reloj de la cuenta atrás) respecto al tiempo real
+ACELERACION = 20.0
+
+
+# --- Sustitutos locales de los servicios externos ---
+
+def _falso_whisper():
+    modulo = types.ModuleType("whisper")
+
+    class ModeloFalso:
+        def transcribe(self, audio, **opciones):
+            texto = FRASES[int(time.monotonic() * 1000) % len(FRASES)]
+            return {"text": texto, "segments": [
+                {"id": 0, "start": 0.0, "end": 2.0, "text": texto, "avg_logprob": -0.2,
+                 "compression_ratio": 1.1, "no_speech_prob": 0.01}]}
+
+    modulo.load_model = lambda nombre, **kwargs: ModeloFalso()
+    return modulo
+
+
+def _falso_torch():
+    """Solo lo que configuran reparto_cpu.py y gestor_memoria.py."""
+    modulo = types.ModuleType("torch")
+    modulo.set_num_threads = lambda n: None
+    modulo.set_num_interop_threads = lambda n: None
+    modulo.cuda = types.SimpleNamespace(is_available=lambda: False, empty_cache=lambda: None)
+    return modulo
+
+
+def _falso_gtts():
+    modulo = types.ModuleType("gtts")
+
+    class gTTS:
+        def __init__(self, text, lang="es", slow=False):
+            self.text = text
+
+        def save(self, ruta):
+            with open(ruta, "wb") as f:
+                f.write(b"\xff\xfb" + self.text.encode("utf-8"))
+
+    modulo.gTTS = gTTS
+    return modulo
+
+
+def _falso_pygame():
+    modulo = types.ModuleType("pygame")
+    musica = types.SimpleNamespace(load=lambda ruta: None, play=lambda: None,
+                                   stop=lambda: None, get_busy=lambda: False)
+    modulo.mixer = types.SimpleNamespace(init=lambda *a, **k: None, quit=lambda: None,
+                                         music=musica)
+    modulo.init = lambda: None
+    modulo.quit = lambda: None
+    return modulo
+
+
+def _falso_sounddevice(aceleracion=ACELERACION):
+    """InputStream que genera ráfagas de tono sobre ruido, más rápido que el tiempo real."""
+    modulo = types.ModuleType("sounddevice")
+
+    class InputStream:
+        def __init__(self, samplerate, channels=1, dtype="float32", blocksize=0,
+                     latency=None, device=None, callback=None):
+            self.samplerate = samplerate
+            self.blocksize = blocksize or samplerate // 10
+            self.callback = callback
+            self.latency = 0.01
+            self.active = False
+            self._hilo = None
+
+        def start(self):
+            self.active = True
+            self._hilo = threading.Thread(target=self._producir, daemon=True)
+            self._hilo.start()
+
+        def _producir(self):
+            rng = np.random.default_rng(1)
+            indices = np.arange(self.blocksize)
+            estado = types.SimpleNamespace(input_overflow=False)
+            n = 0
+            while self.active:
+                bloque = 0.002 * rng.standard_normal(self.blocksize).astype(np.float32)
+                # Un segundo de "voz" cada tres
+                if (n * self.blocksize // self.samplerate) % 3 == 0:
+                    t = (indices + n * self.blocksize) / self.samplerate
+                    bloque += 0.3 * np.sin(2 * np.pi * 220 * t).astype(np.float32)
+                self.callback(bloque[:, None], self.blocksize, None, estado)
+                n += 1
+                time.sleep(self.blocksize / self.samplerate / aceleracion)
+
+        def stop(self):
+            self.active = False
+            if self._hilo is not None:
+                self._hilo.join()
+
+        def close(self):
+            pass
+
+    modulo.InputStream = InputStream
+    return modulo
+
+
+def _falso_soundfile():
+    modulo = types.ModuleType("soundfile")
+    modulo.write = lambda ruta, audio, samplerate, **kwargs: None
+    return modulo
+
+
+def instalar_sustitutos():
+    """Instala los sustitutos; llamar antes de importar la interfaz. Devuelve el Ollama falso."""
+    from ollama_falso import ServidorOllamaFalso
+    servidor = ServidorOllamaFalso().iniciar()
+    os.environ["OLLAMA_HOST"] = servidor.url
+    sys.modules["whisper"] = _falso_whisper()
+    sys.modules["torch"] = _falso_torch()
+    sys.modules["gtts"] = _falso_gtts()
+    sys.modules["pygame"] = _falso_pygame()
+    sys.modules["sounddevice"] = _falso_sounddevice()
+    sys.modules["soundfile"] = _falso_soundfile()
+    return servidor
+
+
+# --- Métricas del proceso ---
+
+def _rss_kb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().rss // 1024
+        except ImportError:
+            return float("nan")
+
+
+def _descriptores():
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        try:
+            import psutil
+            proceso = psutil.Process()
+            return proceso.num_handles() if hasattr(proceso, "num_handles") else proceso.num_fds()
+        except ImportError:
+            return float("nan")
+
+
+def _hilos():
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("Threads:"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return threading.active_count()
+
+
+def muestrear(ventana, dir_temporal):
+    return {
+        "rss_kb": _rss_kb(),
+        "tracemalloc_kb": tracemalloc.get_traced_memory()[0] / 1024,
+        "objetos": len(gc.get_objects()),
+        "descriptores": _descriptores(),
+        "hilos": _hilos(),
+        "temporales": len(os.listdir(dir_temporal)),
+        "mensajes": len(ventana.conversacion),
+        "bloques_documento": ventana.conversacion_text.document().blockCount(),
+    }
+
+
+# --- Conducción de la interfaz ---
+
+def esperar(app, condicion, timeout=30.0):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        app.processEvents()
+        if time.monotonic() > limite:
+            raise TimeoutError("La interfaz no terminó el turno a tiempo")
+        time.sleep(0.001)
+    app.processEvents()
+
+
+def _libre(ventana):
+    return ventana.asistente.pipeline.en_curso() == 0
+
+
+def turno_escrito(app, ventana, texto):
+    ventana.input_line.setText(texto)
+    ventana.enviar_mensaje()
+    esperar(app, lambda: _libre(ventana))
+
+
+def turno_voz(app, ventana):
+    ventana.iniciar_grabacion()
+    esperar(app, lambda: _libre(ventana))
+
+
+def pendiente_por_mil(turnos, valores):
+    if len(turnos) < 2:
+        return 0.0
+    return float(np.polyfit(turnos, valores, 1)[0] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de resistencia de ELISA")
+    parser.add_argument("--modulo", default="elisa", help="Interfaz a probar (elisa o elisa2)")
+    parser.add_argument("--turnos", type=int, default=2000)
+    parser.add_argument("--intervalo", type=int, default=50, help="Turnos entre muestras")
+    parser.add_argument("--cada-voz", type=int, default=10, help="Un turno de voz cada N turnos")
+    parser.add_argument("--calentamiento", type=float, default=0.1,
+                        help="Fracción inicial de muestras que no cuenta en la pendiente")
+    parser.add_argument("--max-rss-kb", type=float, default=2048)
+    parser.add_argument("--max-tracemalloc-kb", type=float, default=1024)
+    parser.add_argument("--max-objetos", type=float, default=2000)
+    parser.add_argument("--max-descriptores", type=float, default=1)
+    parser.add_argument("--max-hilos", type=float, default=1)
+    parser.add_argument("--max-temporales", type=float, default=1)
+    parser.add_argument("--max-mensajes", type=float, default=1)
+    parser.add_argument("--max-bloques-documento", type=float, default=1)
+    parser.add_argument("--mensajes-ventana", type=int, default=40,
+                        help="Mensajes que conserva la ventana (pequeño para alcanzar el tope pronto)")
+    parser.add_argument("--salida", help="Ruta del informe JSON")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    servidor_ollama = instalar_sustitutos()
+    tracemalloc.start()
+
+    from PyQt5.QtWidgets import QApplication
+    from memoria import MemoriaLargoPlazo
+    import asistente
+    import registro
+
+    # Todo lo que la interfaz escribe en disco va a un directorio temporal (también
+    # el registro, que la interfaz configura al importarse)
+    directorio = tempfile.mkdtemp(prefix="elisa_soak_")
+    registro.DIR_LOGS = os.path.join(directorio, "logs")
+
+    app = QApplication(sys.argv)
+    modulo = importlib.import_module(args.modulo)
+
+    dir_audio = os.path.join(directorio, "temp_audio")
+    modulo.conversacion_path = os.path.join(directorio, "conversacion.txt")
+    modulo.MAX_MENSAJES = args.mensajes_ventana
+    modulo.Asistente = functools.partial(
+        asistente.Asistente, directorio_audio=dir_audio,
+        memoria=MemoriaLargoPlazo(os.path.join(directorio, "memoria")))
+    # La cuenta atrás de la grabación corre a la misma velocidad que el micrófono falso
+    asistente.time = types.SimpleNamespace(**{k: getattr(time, k) for k in dir(time)
+                                              if not k.startswith("_")})
+    asistente.time.sleep = lambda segundos: time.sleep(segundos / ACELERACION)
+
+    ventana = modulo.AsistenteVirtualGUI()
+    esperar(app, lambda: _libre(ventana))
+    turno_escrito(app, ventana, "Me llamo Ana")
+
+    muestras = []
+    instantanea_inicial = None
+    inicio = time.monotonic()
+    for turno in range(1, args.turnos + 1):
+        if turno % args.cada_voz == 0:
+            turno_voz(app, ventana)
+        else:
+            turno_escrito(app, ventana, FRASES[turno % len(FRASES)])
+
+        if turno % args.intervalo == 0:
+            gc.collect()
+            muestra = muestrear(ventana, dir_audio)
+            muestra["turno"] = turno
+            muestras.append(muestra)
+            if instantanea_inicial is None and len(muestras) > args.calentamiento * args.turnos / args.intervalo:
+                instantanea_inicial = tracemalloc.take_snapshot()
+            print(f"turno {turno}: " + ", ".join(f"{k}={v:.0f}" for k, v in muestra.items()
+                                                 if k != "turno"), flush=True)
+
+    limites = {
+        "rss_kb": args.max_rss_kb,
+        "tracemalloc_kb": args.max_tracemalloc_kb,
+        "objetos": args.max_objetos,
+        "descriptores": args.max_descriptores,
+        "hilos": args.max_hilos,
+        "temporales": args.max_temporales,
+        "mensajes": args.max_mensajes,
+        "bloques_documento": args.max_bloques_documento,
+    }
+    validas = muestras[int(len(muestras) * args.calentamiento):]
+    turnos = [m["turno"] for m in validas]
+    pendientes = {k: pendiente_por_mil(turnos, [m[k] for m in validas])
+                  for k in limites}
+    fallos = [k for k, limite in limites.items() if pendientes[k] > limite]
+
+    crecimiento = []
+    if instantanea_inicial is not None:
+        diferencias = tracemalloc.take_snapshot().compare_to(instantanea_inicial, "lineno")
+        crecimiento = [str(d) for d in diferencias[:10]]
+
+    print(f"\n{args.turnos} turnos en {time.monotonic() - inicio:.1f}s. "
+          f"Pendientes por cada 1000 turnos:")
+    for k, valor in pendientes.items():
+        limite = limites.get(k)
+        estado = "" if limite is None else ("FALLO" if k in fallos else "ok")
+        print(f"  {k:>18}: {valor:12.1f}  {'' if limite is None else f'(límite {limite:g})'} {estado}")
+    if crecimiento:
+        print("\nMayores crecimientos de memoria de Python:")
+        for linea in crecimiento:
+            print(f"  {linea}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"muestras": muestras, "pendientes": pendientes, "limites": limites,
+                       "fallos": fallos, "crecimiento": crecimiento}, f, indent=2)
+
+    ventana.close()
+    servidor_ollama.detener()
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Registro (logging) no bloqueante para ELISA.
+
+Los hilos que registran (interfaz, captura, reproducción) solo encolan el
+registro; un hilo escritor en segundo plano los formatea por lotes como JSON
+de una línea, los escribe en `logs/elisa.log` con rotación por tamaño y los
+muestra por consola. Cada registro lleva el identificador del turno que
+procesa el hilo que registra (cada etapa del pipeline lo fija antes de
+procesar cada elemento). Si la cola se llena, los registros nuevos se
+descartan y el escritor avisa de cuántos al vaciarla y al cerrar.
+
+Los niveles por subsistema se leen de `ELISA_LOG_NIVELES`
+("whisper=WARNING,captura=DEBUG") y de `logs/niveles.json`, que se vuelve a
+leer en caliente cuando cambia.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import contextvars
+import threading
+import logging.handlers
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DIR_LOGS = os.path.join(script_dir, "logs")
+
+NIVEL_RAIZ = os.environ.get("ELISA_LOG_NIVEL", "DEBUG")
+NIVEL_CONSOLA = os.environ.get("ELISA_LOG_CONSOLA", "DEBUG")
+MAX_BYTES = 5 * 1024 * 1024
+COPIAS = 3
+TAMANO_LOTE = 256
+TAMANO_COLA = 10000
+
+# Bibliotecas cuyo DEBUG no interesa salvo que se pida expresamente
+NIVELES_POR_DEFECTO = {
+    "whisper": "WARNING",
+    "urllib3": "WARNING",
+    "httpx": "WARNING",
+    "httpcore": "WARNING",
+    "PIL": "WARNING",
+    "numba": "WARNING",
+}
+
+# Por hilo: las etapas procesan turnos distintos a la vez
+_turno_actual = contextvars.ContextVar("turno", default="-")
+_escritor = None
+
+
+def nuevo_turno():
+    """Genera un identificador de turno y lo establece como turno en curso del hilo."""
+    turno = f"{time.strftime('%H%M%S')}-{os.urandom(2).hex()}"
+    establecer_turno(turno)
+    return turno
+
+
+def establecer_turno(turno):
+    """Fija el turno en curso del hilo actual."""
+    _turno_actual.set(turno)
+
+
+def turno_actual():
+    return _turno_actual.get()
+
+
+def establecer_nivel(subsistema, nivel):
+    """Cambia en caliente el nivel de un subsistema ("" o "root" para el raíz)."""
+    nombre = None if subsistema in ("", "root") else subsistema
+    logging.getLogger(nombre).setLevel(nivel.upper() if isinstance(nivel, str) else nivel)
+
+
+def _niveles_entorno():
+    niveles = {}
+    for par in os.environ.get("ELISA_LOG_NIVELES", "").split(","):
+        if "=" in par:
+            subsistema, nivel = par.split("=", 1)
+            niveles[subsistema.strip()] = nivel.strip()
+    return niveles
+
+
+class _ManejadorCola(logging.handlers.QueueHandler):
+    """Encola sin bloquear nunca; si la cola está llena, descarta y cuenta."""
+
+    def __init__(self, cola):
+        super().__init__(cola)
+        self.descartados = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+    def prepare(self, record):
+        # Solo lo imprescindible en el hilo que registra; el formato se hace en el escritor
+        record.turno = _turno_actual.get()
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+class _FormatoJSON(logging.Formatter):
+    def format(self, record):
+        datos = {
+            "ts": f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))}"
+                  f".{int(record.msecs):03d}",
+            "nivel": record.levelname,
+            "subsistema": record.name,
+            "hilo": record.threadName,
+            "turno": getattr(record, "turno", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            datos["exc"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False)
+
+
+class EscritorRegistro(threading.Thread):
+    """Hilo que vacía la cola por lotes, escribe con rotación y recarga niveles."""
+
+    def __init__(self, cola, ruta, max_bytes=MAX_BYTES, copias=COPIAS, nivel_consola=NIVEL_CONSOLA,
+                 manejador=None):
+        super().__init__(name="registro", daemon=True)
+        self.cola = cola
+        self.manejador = manejador
+        self._descartados_avisados = 0
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.copias = copias
+        self.nivel_consola = logging.getLevelName(nivel_consola.upper())
+        self.formato_archivo = _FormatoJSON()
+        self.formato_consola = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        self.ruta_niveles = os.path.join(os.path.dirname(ruta), "niveles.json")
+        self._mtime_niveles = None
+        self._fin = threading.Event()
+        self._archivo = None
+
+    def run(self):
+        self._abrir()
+        ultima_revision = 0.0
+        while not (self._fin.is_set() and self.cola.empty()):
+            lote = self._siguiente_lote()
+            if lote:
+                self._escribir(lote)
+                if self.cola.empty():
+                    self._avisar_descartados()
+            if time.monotonic() - ultima_revision > 2.0:
+                ultima_revision = time.monotonic()
+                self._recargar_niveles()
+        self._avisar_descartados()
+        self._archivo.close()
+
+    def detener(self):
+        self._fin.set()
+        self.join(timeout=5)
+
+    def _siguiente_lote(self):
+        try:
+            lote = [self.cola.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        while len(lote) < TAMANO_LOTE:
+            try:
+                lote.append(self.cola.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _avisar_descartados(self):
+        """Registra cuántos mensajes se descartaron con la cola llena desde el último aviso."""
+        if self.manejador is None:
+            return
+        descartados = self.manejador.descartados
+        if descartados == self._descartados_avisados:
+            return
+        aviso = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                  f"Cola del registro llena: {descartados - self._descartados_avisados} "
+                                  f"mensajes descartados ({descartados} en total)", None, None)
+        self._descartados_avisados = descartados
+        self._escribir([aviso])
+
+    def _escribir(self, lote):
+        lineas = []
+        for record in lote:
+            try:
+                lineas.append(self.formato_archivo.format(record))
+                if record.levelno >= self.nivel_consola:
+                    sys.stderr.write(self.formato_consola.format(record) + "\n")
+            except Exception:
+                pass
+        self._archivo.write("\n".join(lineas) + "\n")
+        self._archivo.flush()
+        sys.stderr.flush()
+        if self._archivo.tell() >= self.max_bytes:
+            self._rotar()
+
+    def _abrir(self):
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        self._archivo = open(self.ruta, "a", encoding="utf-8")
+
+    def _rotar(self):
+        self._archivo.close()
+        for i in range(self.copias - 1, 0, -1):
+            origen = f"{self.ruta}.{i}"
+            if os.path.exists(origen):
+                os.replace(origen, f"{self.ruta}.{i + 1}")
+        os.replace(self.ruta, f"{self.ruta}.1")
+        self._abrir()
+
+    def _recargar_niveles(self):
+        try:
+            mtime = os.path.getmtime(self.ruta_niveles)
+        except OSError:
+            return
+        if mtime == self._mtime_niveles:
+            return
+        self._mtime_niveles = mtime
+        try:
+            with open(self.ruta_niveles, encoding="utf-8") as f:
+                for subsistema, nivel in json.load(f).items():
+                    establecer_nivel(subsistema, nivel)
+        except Exception as e:
+            sys.stderr.write(f"No se pudo leer {self.ruta_niveles}: {e}\n")
+
+
+def configurar_registro(nombre="elisa", nivel=NIVEL_RAIZ, niveles=None):
+    """Sustituye los manejadores del logger raíz por la cola no bloqueante."""
+    global _escritor
+    if _escritor is not None:
+        return _escritor
+
+    cola = queue.Queue(maxsize=TAMANO_COLA)
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        raiz.removeHandler(manejador)
+    manejador = _ManejadorCola(cola)
+    raiz.addHandler(manejador)
+    raiz.setLevel(nivel)
+
+    for subsistema, nivel_subsistema in {**NIVELES_POR_DEFECTO, **_niveles_entorno(),
+                                         **(niveles or {})}.items():
+        establecer_nivel(subsistema, nivel_subsistema)
+
+    _escritor = EscritorRegistro(cola, os.path.join(DIR_LOGS, f"{nombre}.log"), manejador=manejador)
+    _escritor.start()
+    atexit.register(_escritor.detener)
+    return _escritor
@@ -0,0 +1,168 @@
+"""Reparto de los núcleos entre la interfaz, Whisper y Ollama.
+
+Con los valores por defecto PyTorch usa todos los núcleos para Whisper,
+Ollama hace lo mismo y el bucle de eventos de Qt se queda sin CPU durante la
+transcripción (el avatar se entrecorta y el teclado va con retraso). Este
+módulo reparte los núcleos en tres grupos:
+
+    ui   el hilo principal de Qt (los del asistente no se limitan)
+    asr  Whisper: hilos intra/inter-op de torch, afinidad y prioridad del hilo
+    llm  Ollama: opción `num_thread` de cada petición
+
+Configuración única en ELISA_REPARTO_CPU, en forma corta o JSON (en línea o
+ruta a un archivo):
+
+    ELISA_REPARTO_CPU="ui=1,asr=4,llm=3,afinidad=1"
+    ELISA_REPARTO_CPU='{"ui": 1, "asr": {"nucleos": 4, "nice": 5}, "llm": 3, "afinidad": true}'
+
+Sin configurar se reserva un núcleo para la interfaz y el resto se divide
+entre Whisper y Ollama. La afinidad (fijar cada grupo a sus núcleos) y la
+prioridad (nice) son opcionales y solo se aplican en Linux, donde afectan al
+hilo que las pide y a los que este cree después; por eso la interfaz se fija
+una vez creados los hilos del asistente, y los que se creen después desde
+ella se liberan con `liberar_hilo`. `benchmark_reparto.py`
+compara la fluidez de la interfaz y la latencia de cada etapa con distintos
+repartos.
+"""
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+GRUPOS = ("ui", "asr", "llm")
+
+
+def nucleos_disponibles():
+    """CPUs en las que puede ejecutarse el proceso."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+
+def reparto_automatico(total):
+    """Núcleos por grupo para `total` núcleos: uno (dos desde 12) para la interfaz,
+    y el resto a medias entre Whisper y Ollama, que rara vez trabajan a la vez."""
+    ui = 2 if total >= 12 else 1
+    resto = max(1, total - ui)
+    asr = max(1, (resto + 1) // 2)
+    return {"ui": ui, "asr": asr, "llm": max(1, resto - asr)}
+
+
+class Grupo:
+    def __init__(self, nombre, nucleos, nice=0):
+        self.nombre = nombre
+        self.nucleos = nucleos
+        self.nice = nice
+        self.cpus = set()
+
+
+class RepartoCPU:
+    def __init__(self, nucleos=None, nice=None, afinidad=False, disponibles=None):
+        """`nucleos` y `nice` son diccionarios por grupo; lo que falte se reparte solo."""
+        disponibles = disponibles or nucleos_disponibles()
+        automatico = reparto_automatico(len(disponibles))
+        nucleos = {**automatico, **(nucleos or {})}
+        nice = nice or {}
+        self.afinidad = afinidad
+        self.cpus_proceso = set(disponibles)
+        self.grupos = {g: Grupo(g, max(1, int(nucleos[g])), int(nice.get(g, 0))) for g in GRUPOS}
+        # CPUs consecutivas por grupo; si no alcanzan, los últimos grupos comparten
+        indice = 0
+        for grupo in self.grupos.values():
+            grupo.cpus = {disponibles[(indice + i) % len(disponibles)] for i in range(grupo.nucleos)}
+            indice += grupo.nucleos
+        self._torch_configurado = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def desde_texto(cls, texto, disponibles=None):
+        """Construye el reparto a partir de la forma corta, JSON o ruta a un JSON."""
+        texto = (texto or "").strip()
+        if not texto:
+            return cls(disponibles=disponibles)
+        if os.path.isfile(texto):
+            with open(texto, encoding="utf-8") as f:
+                texto = f.read()
+        if texto.startswith("{"):
+            config = json.loads(texto)
+        else:
+            config = dict(parte.split("=", 1) for parte in texto.split(",") if parte.strip())
+        nucleos, nice = {}, {}
+        for grupo in GRUPOS:
+            valor = config.get(grupo)
+            if isinstance(valor, dict):
+                if "nucleos" in valor:
+                    nucleos[grupo] = valor["nucleos"]
+                nice[grupo] = valor.get("nice", 0)
+            elif valor is not None:
+                nucleos[grupo] = valor
+        afinidad = config.get("afinidad", False)
+        if isinstance(afinidad, str):
+            afinidad = afinidad.lower() in ("1", "true", "si", "sí")
+        return cls(nucleos, nice, afinidad, disponibles)
+
+    def describir(self):
+        return ", ".join(f"{g.nombre} {g.nucleos}" + (f" (nice {g.nice})" if g.nice else "")
+                         for g in self.grupos.values()) + \
+            (" con afinidad" if self.afinidad else "")
+
+    def configurar_torch(self, hilos=None):
+        """Hilos de torch para Whisper. Idempotente; llamar antes de cargar el modelo.
+
+        `hilos` sustituye a los núcleos del grupo asr (p. ej. los de cada
+        proceso de lote.py); la primera llamada manda y las siguientes no
+        cambian nada.
+        """
+        with self._lock:
+            if self._torch_configurado:
+                return
+            self._torch_configurado = True
+        import torch
+        torch.set_num_threads(hilos or self.grupos["asr"].nucleos)
+        try:
+            # Whisper apenas paraleliza entre operadores; solo se puede fijar una vez
+            torch.set_num_interop_threads(1)
+        except RuntimeError as e:
+            logger.debug(f"No se pudieron fijar los hilos inter-op de torch: {e}")
+        logger.info(f"Reparto de CPU: {self.describir()}")
+
+    def aplicar_hilo(self, grupo):
+        """Aplica afinidad y prioridad del grupo al hilo actual (y a los que cree)."""
+        grupo = self.grupos[grupo]
+        if self.afinidad and hasattr(os, "sched_setaffinity"):
+            try:
+                # En Linux, el pid 0 es el hilo que llama
+                os.sched_setaffinity(0, grupo.cpus)
+            except OSError as e:
+                logger.warning(f"No se pudo fijar la afinidad de {grupo.nombre}: {e}")
+        if grupo.nice > 0 and hasattr(os, "setpriority"):
+            try:
+                # En Linux la prioridad es por hilo
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), grupo.nice)
+            except OSError as e:
+                logger.warning(f"No se pudo bajar la prioridad de {grupo.nombre}: {e}")
+
+    def liberar_hilo(self):
+        """Devuelve al hilo actual todos los núcleos del proceso (deshace la afinidad heredada)."""
+        if self.afinidad and hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(0, self.cpus_proceso)
+            except OSError as e:
+                logger.warning(f"No se pudo liberar la afinidad del hilo: {e}")
+
+    def opciones_ollama(self):
+        return {"num_thread": self.grupos["llm"].nucleos}
+
+
+def _desde_entorno():
+    try:
+        return RepartoCPU.desde_texto(os.environ.get("ELISA_REPARTO_CPU"))
+    except (ValueError, OSError) as e:
+        logger.error(f"ELISA_REPARTO_CPU no válido ({e}); se usa el reparto automático")
+        return RepartoCPU()
+
+
+REPARTO = _desde_entorno()
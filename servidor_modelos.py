@@ -0,0 +1,327 @@
+"""Servidor local de modelos compartido entre instancias de ELISA.
+
+Un único proceso carga Whisper y el motor de TTS y atiende a los clientes
+(elisa.py, elisa2.py, kioscos del mismo equipo) por un socket Unix. El audio
+capturado viaja en memoria compartida; por el socket solo pasan mensajes JSON
+pequeños.
+
+El socket solo es accesible por el usuario que arranca el servidor (permisos
+0600, en su XDG_RUNTIME_DIR o en un directorio propio 0700 del temporal) y el
+audio sintetizado se escribe siempre en un directorio temporal del servidor:
+los clientes no eligen rutas.
+
+Uso:
+    python servidor_modelos.py [--modelo small] [--socket RUTA]
+"""
+import os
+import sys
+import json
+import uuid
+import shutil
+import socket
+import socketserver
+import tempfile
+import time
+import threading
+import logging
+import argparse
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from utilidades_audio import remuestrear, MUESTREO_WHISPER
+from registro import configurar_registro
+from gestor_memoria import rss_bytes, devolver_memoria, MB
+from reparto_cpu import REPARTO
+import codificador_corto
+
+logger = logging.getLogger(__name__)
+
+
+def directorio_privado():
+    """Directorio del usuario para el socket: XDG_RUNTIME_DIR o uno propio en el temporal."""
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime and os.path.isdir(runtime):
+        return runtime
+    usuario = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "")
+    return os.path.join(tempfile.gettempdir(), f"elisa-{usuario}")
+
+
+# Ruta del socket compartido por servidor y clientes
+RUTA_SOCKET = os.environ.get(
+    "ELISA_SOCKET_MODELOS",
+    os.path.join(directorio_privado(), "elisa_modelos.sock"))
+
+
+class ErrorServidorModelos(Exception):
+    """Error al comunicarse con el servidor de modelos."""
+
+
+def _enviar(conexion, mensaje):
+    conexion.sendall(json.dumps(mensaje).encode("utf-8") + b"\n")
+
+
+def _segmentos_serializables(segmentos):
+    """Deja en los segmentos de Whisper solo los campos útiles para el cliente."""
+    campos = ("id", "start", "end", "text", "avg_logprob",
+              "compression_ratio", "no_speech_prob")
+    return [{k: s[k] for k in campos if k in s} for s in segmentos]
+
+
+class ServidorModelos(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, ruta_socket, modelo_whisper="small"):
+        self.modelo_por_defecto = modelo_whisper
+        # Modelos Whisper cargados por nombre; el cliente elige el nivel en cada petición
+        self.modelos = {}
+        self.lock_carga = threading.Lock()
+        # Un modelo Whisper no es seguro entre hilos: sus transcripciones se
+        # serializan, pero modelos distintos (borrador y nivel actual) van en paralelo
+        self.locks_whisper = {}
+        # Último uso de cada modelo por cualquier cliente: un cliente inactivo no
+        # debe descargar lo que otros siguen usando
+        self.ultimo_uso = {}
+        # El audio sintetizado solo se escribe aquí (0700, del usuario del servidor)
+        self.directorio_tts = tempfile.mkdtemp(prefix="elisa_tts_")
+        self.cargar(modelo_whisper)
+        # Socket 0600 desde que se crea: otros usuarios del equipo no pueden conectarse
+        mascara = os.umask(0o177)
+        try:
+            super().__init__(ruta_socket, ManejadorModelos)
+        finally:
+            os.umask(mascara)
+        os.chmod(ruta_socket, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        shutil.rmtree(self.directorio_tts, ignore_errors=True)
+
+    def cargar(self, nombre):
+        """Carga un modelo Whisper si aún no lo está (sin bloquear las transcripciones)."""
+        # Sin bloqueo si ya está cargado: la carga en segundo plano de otro nivel
+        # no debe retener las transcripciones con los modelos ya residentes
+        self.ultimo_uso[nombre] = time.monotonic()
+        modelo = self.modelos.get(nombre)
+        if modelo is not None:
+            return modelo
+        with self.lock_carga:
+            if nombre not in self.modelos:
+                import whisper
+                logger.info(f"Cargando modelo Whisper '{nombre}'...")
+                self.modelos[nombre] = whisper.load_model(nombre)
+                self.locks_whisper.setdefault(nombre, threading.Lock())
+            return self.modelos[nombre]
+
+    def descargar(self, inactivo=None):
+        """Libera los modelos Whisper; se recargan en la siguiente petición.
+
+        Con `inactivo` (segundos) solo los que ningún cliente ha usado en ese
+        tiempo. Devuelve los bytes de RSS liberados por el servidor (0 si no se
+        pueden medir).
+        """
+        with self.lock_carga:
+            ahora = time.monotonic()
+            nombres = [n for n in self.modelos
+                       if inactivo is None or ahora - self.ultimo_uso.get(n, 0) >= inactivo]
+            if not nombres:
+                return 0
+            locks = [self.locks_whisper[n] for n in nombres]
+            for lock in locks:
+                lock.acquire()
+            try:
+                antes = rss_bytes()
+                for nombre in nombres:
+                    del self.modelos[nombre]
+                devolver_memoria()
+                despues = rss_bytes()
+            finally:
+                for lock in locks:
+                    lock.release()
+        liberado = max(0, antes - despues) if antes is not None and despues is not None else 0
+        logger.info(f"Modelos Whisper {nombres} descargados: {liberado / MB:.0f} MB liberados")
+        return liberado
+
+    def transcribir(self, nombre_shm, muestras, opciones, modelo=None, corto=False):
+        shm = shared_memory.SharedMemory(name=nombre_shm)
+        # El cliente es el dueño del segmento; evitar que el resource_tracker
+        # de este proceso lo elimine al salir.
+        resource_tracker.unregister(shm._name, "shared_memory")
+        try:
+            audio = np.ndarray((muestras,), dtype=np.float32, buffer=shm.buf)
+            modelo = modelo or self.modelo_por_defecto
+            whisper_model = self.cargar(modelo)
+            with self.locks_whisper[modelo]:
+                if corto:
+                    resultado = codificador_corto.transcribir(whisper_model, audio, **opciones)
+                else:
+                    resultado = whisper_model.transcribe(audio, **opciones)
+            del audio
+        finally:
+            shm.close()
+        return {"text": resultado["text"],
+                "segments": _segmentos_serializables(resultado.get("segments", []))}
+
+    def sintetizar(self, texto, lang="es"):
+        """Genera el mp3 de `texto` en el directorio del servidor y devuelve su ruta.
+
+        El cliente lo reproduce y lo borra.
+        """
+        from gtts import gTTS
+        ruta = os.path.join(self.directorio_tts, f"respuesta_{uuid.uuid4().hex}.mp3")
+        gTTS(text=texto, lang=lang, slow=False).save(ruta)
+        return {"ruta": ruta}
+
+
+class ManejadorModelos(socketserver.StreamRequestHandler):
+    def handle(self):
+        for linea in self.rfile:
+            try:
+                solicitud = json.loads(linea)
+                op = solicitud.get("op")
+                if op == "ping":
+                    respuesta = {"ok": True}
+                elif op == "transcribir":
+                    resultado = self.server.transcribir(
+                        solicitud["shm"], solicitud["muestras"], solicitud.get("opciones", {}),
+                        solicitud.get("modelo"), solicitud.get("corto", False))
+                    respuesta = {"ok": True, "resultado": resultado}
+                elif op == "cargar":
+                    self.server.cargar(solicitud["modelo"])
+                    respuesta = {"ok": True}
+                elif op == "descargar":
+                    respuesta = {"ok": True,
+                                 "liberado": self.server.descargar(solicitud.get("inactivo"))}
+                elif op == "sintetizar":
+                    resultado = self.server.sintetizar(solicitud["texto"], solicitud.get("lang", "es"))
+                    respuesta = {"ok": True, "resultado": resultado}
+                else:
+                    respuesta = {"ok": False, "error": f"Operación desconocida: {op}"}
+            except Exception as e:
+                logger.error(f"Error atendiendo solicitud: {e}")
+                respuesta = {"ok": False, "error": str(e)}
+            _enviar(self.connection, respuesta)
+
+
+class ClienteModelos:
+    """Cliente del servidor de modelos.
+
+    Si el servidor no está en marcha, `disponible()` devuelve False y el
+    llamador debe usar sus modelos locales.
+    """
+
+    def __init__(self, ruta_socket=RUTA_SOCKET, timeout=300.0):
+        self.ruta_socket = ruta_socket
+        self.timeout = timeout
+
+    def disponible(self):
+        if not hasattr(socket, "AF_UNIX") or not os.path.exists(self.ruta_socket):
+            return False
+        try:
+            return self._solicitud({"op": "ping"}, timeout=1.0).get("ok", False)
+        except ErrorServidorModelos:
+            return False
+
+    def transcribir(self, audio, samplerate=MUESTREO_WHISPER, modelo=None, corto=False, **opciones):
+        """Transcribe el audio en el servidor y devuelve el resultado de Whisper.
+
+        `modelo` elige el tamaño de Whisper; por defecto, el que cargó el servidor.
+        `corto` usa el codificador recortado (ver codificador_corto.py).
+        """
+        audio = remuestrear(audio, samplerate)
+        shm = shared_memory.SharedMemory(create=True, size=max(audio.nbytes, 1))
+        try:
+            destino = np.ndarray(audio.shape, dtype=np.float32, buffer=shm.buf)
+            destino[:] = audio
+            del destino
+            respuesta = self._solicitud({
+                "op": "transcribir",
+                "shm": shm.name,
+                "muestras": len(audio),
+                "modelo": modelo,
+                "corto": corto,
+                "opciones": opciones,
+            })
+        finally:
+            shm.close()
+            shm.unlink()
+        return respuesta["resultado"]
+
+    def cargar(self, modelo):
+        """Pide al servidor que cargue un modelo Whisper para usarlo más adelante."""
+        self._solicitud({"op": "cargar", "modelo": modelo})
+
+    def descargar(self, inactivo=None):
+        """Pide al servidor que libere sus modelos Whisper. Devuelve los bytes liberados.
+
+        Con `inactivo` (segundos) el servidor solo libera los que ningún cliente
+        ha usado en ese tiempo.
+        """
+        return self._solicitud({"op": "descargar", "inactivo": inactivo})["liberado"]
+
+    def sintetizar(self, texto, lang="es"):
+        """Genera en el servidor el mp3 de `texto`. Devuelve su ruta, que el llamador debe borrar."""
+        return self._solicitud({"op": "sintetizar", "texto": texto,
+                                "lang": lang})["resultado"]["ruta"]
+
+    def _solicitud(self, mensaje, timeout=None):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conexion:
+                conexion.settimeout(timeout or self.timeout)
+                conexion.connect(self.ruta_socket)
+                _enviar(conexion, mensaje)
+                with conexion.makefile("rb") as lector:
+                    linea = lector.readline()
+        except OSError as e:
+            raise ErrorServidorModelos(f"No se pudo contactar el servidor de modelos: {e}")
+        if not linea:
+            raise ErrorServidorModelos("El servidor de modelos cerró la conexión")
+        respuesta = json.loads(linea)
+        if not respuesta.get("ok"):
+            raise ErrorServidorModelos(respuesta.get("error", "Error desconocido"))
+        return respuesta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local de modelos de ELISA")
+    parser.add_argument("--modelo", default="small", help="Modelo de Whisper a cargar")
+    parser.add_argument("--socket", default=RUTA_SOCKET, help="Ruta del socket Unix")
+    args = parser.parse_args()
+
+    configurar_registro("servidor_modelos", nivel=logging.INFO)
+
+    if not hasattr(socket, "AF_UNIX"):
+        sys.exit("Esta plataforma no admite sockets Unix")
+
+    directorio = os.path.dirname(os.path.abspath(args.socket))
+    os.makedirs(directorio, mode=0o700, exist_ok=True)
+    if directorio == directorio_privado():
+        # Si otro usuario creó antes el directorio, podría sustituir el socket
+        estado = os.stat(directorio)
+        if estado.st_uid != os.getuid() or estado.st_mode & 0o077:
+            sys.exit(f"{directorio} no es un directorio privado de este usuario")
+
+    if os.path.exists(args.socket):
+        if ClienteModelos(args.socket).disponible():
+            sys.exit(f"Ya hay un servidor de modelos activo en {args.socket}")
+        os.remove(args.socket)
+
+    # Todo el servidor es Whisper: sus hilos heredan la afinidad del grupo asr
+    REPARTO.aplicar_hilo("asr")
+    REPARTO.configurar_torch()
+    servidor = ServidorModelos(args.socket, args.modelo)
+    logger.info(f"Servidor de modelos escuchando en {args.socket}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        try:
+            os.remove(args.socket)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Recorte de silencio antes de Whisper y filtrado de segmentos después.
+
+Antes de decodificar se recorta el silencio inicial y final de la grabación y
+se descarta el turno si no contiene voz. Después, los segmentos de Whisper se
+filtran por `no_speech_prob` y `compression_ratio` en lugar de borrar palabras
+de una lista fija.
+"""
+import os
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MS_TRAMA = 20
+FACTOR_RUIDO = 3.0
+RMS_MINIMO = 0.005
+# Voz mínima para considerar que hay algo que transcribir
+SEGUNDOS_VOZ_MINIMA = 0.25
+# Margen que se conserva alrededor de la voz
+SEGUNDOS_MARGEN = 0.2
+
+# Umbrales de descarte de segmentos (los mismos criterios que usa Whisper)
+MAX_NO_SPEECH = float(os.environ.get("ELISA_MAX_NO_SPEECH", "0.6"))
+MIN_LOGPROB = -1.0
+MAX_COMPRESION = float(os.environ.get("ELISA_MAX_COMPRESION", "2.4"))
+
+
+def energia_por_tramas(audio, samplerate, ms_trama=MS_TRAMA):
+    """RMS de cada trama de `ms_trama` milisegundos."""
+    n = samplerate * ms_trama // 1000
+    tramas = audio[:len(audio) // n * n].reshape(-1, n)
+    return np.sqrt(np.einsum("ij,ij->i", tramas, tramas) / n)
+
+
+def recortar_silencio(audio, samplerate, margen=SEGUNDOS_MARGEN, voz_minima=SEGUNDOS_VOZ_MINIMA):
+    """Devuelve una vista de `audio` sin el silencio inicial y final,
+    o None si no hay voz suficiente. Debe aplicarse antes de normalizar."""
+    energia = energia_por_tramas(audio, samplerate)
+    if len(energia) == 0:
+        return None
+    umbral = max(np.percentile(energia, 10) * FACTOR_RUIDO, RMS_MINIMO)
+    activas = np.flatnonzero(energia > umbral)
+    if len(activas) * MS_TRAMA / 1000 < voz_minima:
+        return None
+    n = samplerate * MS_TRAMA // 1000
+    margen = int(margen * samplerate)
+    inicio = max(0, activas[0] * n - margen)
+    fin = min(len(audio), (activas[-1] + 1) * n + margen)
+    return audio[inicio:fin]
+
+
+def filtrar_segmentos(resultado):
+    """Texto de los segmentos de Whisper que no parecen silencio ni alucinación."""
+    segmentos = resultado.get("segments")
+    if not segmentos:
+        return resultado.get("text", "")
+    textos = []
+    for s in segmentos:
+        silencio = (s.get("no_speech_prob", 0.0) > MAX_NO_SPEECH
+                    and s.get("avg_logprob", 0.0) < MIN_LOGPROB)
+        repetitivo = s.get("compression_ratio", 0.0) > MAX_COMPRESION
+        if silencio or repetitivo:
+            logger.debug(f"Segmento descartado ({'silencio' if silencio else 'repetitivo'}): "
+                         f"{s.get('text', '')!r}")
+            continue
+        textos.append(s.get("text", ""))
+    return "".join(textos)
+
+
+class MedidorDecodificacion:
+    """Estima el tiempo de decodificación ahorrado con el recorte.
+
+    Lleva una media móvil de segundos de decodificación por segundo de audio y
+    la aplica al audio que no llegó a Whisper.
+    """
+
+    def __init__(self, alfa=0.2):
+        self.alfa = alfa
+        self.coste_por_segundo = None
+        self.ahorro_total = 0.0
+        self.turnos = 0
+
+    def registrar(self, segundos_originales, segundos_decodificados, segundos_decodificacion):
+        if segundos_decodificados > 0:
+            coste = segundos_decodificacion / segundos_decodificados
+            self.coste_por_segundo = coste if self.coste_por_segundo is None else \
+                (1 - self.alfa) * self.coste_por_segundo + self.alfa * coste
+        ahorro = (self.coste_por_segundo or 0.0) * (segundos_originales - segundos_decodificados)
+        self.ahorro_total += ahorro
+        self.turnos += 1
+        logger.info(f"Decodificación: {segundos_decodificacion:.2f}s para "
+                    f"{segundos_decodificados:.1f}s de {segundos_originales:.1f}s grabados; "
+                    f"ahorro estimado {ahorro:.2f}s (total {self.ahorro_total:.1f}s "
+                    f"en {self.turnos} turnos)")
+        return ahorro
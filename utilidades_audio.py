@@ -0,0 +1,75 @@
+import math
+import functools
+
+import numpy as np
+
+# Frecuencia de muestreo que espera Whisper
+MUESTREO_WHISPER = 16000
+
+# Filtro del remuestreo: cruces por cero a cada lado del sinc y ventana de Kaiser
+# (~55 dB de rechazo fuera de banda, suficiente para audio de 16 bits de voz)
+CRUCES_FILTRO = 10
+BETA_KAISER = 5.0
+MUESTRAS_BLOQUE_REMUESTREO = 16384
+
+
+def a_mono(audio):
+    """Convierte el audio a un vector mono float32."""
+    audio = np.asarray(audio, dtype=np.float32)
+    if audio.ndim > 1:
+        audio = np.mean(audio, axis=1, dtype=np.float32)
+    return audio
+
+
+@functools.lru_cache(maxsize=8)
+def _filtro_polifase(arriba, abajo):
+    """Paso bajo (sinc con ventana de Kaiser) para sobremuestrear por `arriba` y diezmar
+    por `abajo`, repartido en fases: la columna p tiene h[p], h[p + arriba], ..."""
+    factor = max(arriba, abajo)
+    mitad = CRUCES_FILTRO * factor
+    n = np.arange(-mitad, mitad + 1)
+    h = np.sinc(n / factor) * np.kaiser(len(n), BETA_KAISER) * arriba / factor
+    coeficientes = -(-len(h) // arriba)
+    h = np.pad(h, (0, coeficientes * arriba - len(h)))
+    return h.reshape(coeficientes, arriba).astype(np.float32), mitad
+
+
+def remuestrear(audio, samplerate, destino=MUESTREO_WHISPER):
+    """Remuestrea el audio mono a la frecuencia de destino con un filtro polifásico
+    (como scipy.signal.resample_poly): filtra por encima de la nueva Nyquist antes
+    de diezmar para que esas frecuencias no se plieguen sobre la voz."""
+    audio = a_mono(audio)
+    samplerate, destino = int(samplerate), int(destino)
+    if samplerate == destino or len(audio) == 0:
+        return audio
+    comun = math.gcd(samplerate, destino)
+    arriba, abajo = destino // comun, samplerate // comun
+    fases, mitad = _filtro_polifase(arriba, abajo)
+    coeficientes = len(fases)
+
+    # Muestra de salida n = sum_i fases[i, fase[n]] * audio[base[n] - i]
+    n_destino = int(round(len(audio) * destino / samplerate))
+    t = np.arange(n_destino, dtype=np.int64) * abajo + mitad
+    fase, base = t % arriba, t // arriba + coeficientes
+    relleno = np.zeros(coeficientes, dtype=np.float32)
+    x = np.concatenate((relleno, audio, np.zeros(max(0, base[-1] + 1 - coeficientes - len(audio)),
+                                                 dtype=np.float32)))
+    salida = np.empty(n_destino, dtype=np.float32)
+    desplazamientos = np.arange(coeficientes)
+    # Por bloques, para no reservar una matriz de (muestras x coeficientes) entera
+    for inicio in range(0, n_destino, MUESTRAS_BLOQUE_REMUESTREO):
+        fin = inicio + MUESTRAS_BLOQUE_REMUESTREO
+        indices = base[inicio:fin, None] - desplazamientos
+        salida[inicio:fin] = np.einsum("ij,ji->i", x[indices], fases[:, fase[inicio:fin]])
+    return salida
+
+
+def suavizar(audio, salida):
+    """Media móvil de 5 muestras (equivale a np.convolve(audio, np.ones(5)/5, 'same'))
+    escrita en `salida`, sin reservar memoria nueva."""
+    salida[:] = audio
+    for k in (1, 2):
+        salida[k:] += audio[:-k]
+        salida[:-k] += audio[k:]
+    salida /= 5
+    return salida